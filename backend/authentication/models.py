@@ -126,6 +126,9 @@ class User(AbstractUser):
     @property
     def highest_role(self):
         """Возвращает роль пользователя с наивысшим приоритетом"""
+        if 'roles' in getattr(self, '_prefetched_objects_cache', {}):
+            # Роли уже загружены через prefetch_related - обходимся без запроса
+            return max(self.roles.all(), key=lambda role: role.priority, default=None)
         return self.roles.order_by('-priority').first()
     
     def add_role(self, role_name):
@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после инициализации Django: модуль использует модели и настройки
+from messaging.realtime import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """HTTP обслуживает Django, WebSocket-соединения чатов - messaging.realtime"""
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
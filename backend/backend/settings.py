@@ -66,6 +66,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'common.instrumentation.RequestInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -111,6 +112,26 @@ DATABASES = {
     }
 }
 
+# Кэш
+# Через кэш процессы обмениваются метками версий снимков в памяти (дерево
+# категорий, справочники) и буфером счетчиков предметов, поэтому на сервере
+# он должен быть общим (Redis, REDIS_URL). LocMemCache работает в пределах
+# одного процесса и допустим только при разработке (проверки common.E001 и common.E002)
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -165,6 +186,12 @@ AWS_IS_GZIPPED = False
 AWS_S3_ADDRESSING_STYLE = "path"
 AWS_S3_SIGNATURE_VERSION = "s3v4"
 
+# Общий клиент S3: размер пула соединений, таймауты (секунд) и число попыток
+AWS_S3_MAX_POOL_CONNECTIONS = 50
+AWS_S3_CONNECT_TIMEOUT = 5
+AWS_S3_READ_TIMEOUT = 60
+AWS_S3_MAX_ATTEMPTS = 5
+
 # s3 static settings
 STATIC_LOCATION = 'static'
 STATIC_URL = f'{AWS_S3_ENDPOINT_URL}/{AWS_STORAGE_BUCKET_NAME}/{STATIC_LOCATION}/'
@@ -263,12 +290,86 @@ IMAGE_SIZES = {
     }
 }
 
+# Генерация производных изображений IMAGE_SIZES после загрузки
+IMAGE_DERIVATIVES_ENABLED = True
+# Генерировать в фоновом потоке (False - синхронно после фиксации транзакции)
+IMAGE_DERIVATIVES_ASYNC = True
+# Количество процессов для декодирования и масштабирования (0 - в текущем процессе)
+IMAGE_PROCESSING_WORKERS = 2
+# Форматы производных изображений
+IMAGE_DERIVATIVE_FORMATS = ['webp', 'jpeg']
+# Хранилище оригиналов и производных изображений
+IMAGE_DERIVATIVES_STORAGE = 'backend.storage_backends.MediaStorage'
+
 # Максимальный размер загружаемого файла (10 МБ)
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024
 
 # Разрешенные форматы изображений
 ALLOWED_IMAGE_FORMATS = ['jpeg', 'jpg', 'png', 'webp']
 
+# Счетчики просмотров и избранного копятся в кэше и пишутся в БД пакетами
+ITEM_COUNTERS_WRITE_BEHIND = True
+# Интервал фонового сброса счетчиков в БД, секунд (0 - только командой flush_item_counters)
+ITEM_COUNTERS_FLUSH_INTERVAL = 10
+# Окно, в котором повторные просмотры предмета одним пользователем не учитываются, секунд
+ITEM_VIEW_DEDUPE_WINDOW = 30 * 60
+
+# Количество процессов ASGI-сервера (uvicorn --workers в start.sh)
+ASGI_WORKERS = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+# Брокер событий чатов для WebSocket-соединений (messaging.realtime).
+# InMemoryBroker работает в пределах одного процесса: сообщение, сохраненное
+# в другом процессе, до его соединений не дойдет. Поэтому с ним HTTP и WebSocket
+# обслуживает один процесс uvicorn, а при ASGI_WORKERS > 1 проверка
+# messaging.E001 не дает запуститься
+MESSAGING_REALTIME_BROKER = 'messaging.realtime.InMemoryBroker'
+# Максимум недоставленных событий на соединение; при переполнении соединение закрывается
+MESSAGING_REALTIME_QUEUE_SIZE = 100
+# Сколько секунд ждать сообщение с токеном, если он не передан в заголовке Authorization
+MESSAGING_REALTIME_AUTH_TIMEOUT = 10
+
+# Архивация сообщений (команда archive_messages, messaging.archive)
+# Сообщения старше указанного числа дней переносятся в архивную таблицу
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv('MESSAGE_ARCHIVE_AFTER_DAYS', '180'))
+# Количество сообщений, переносимых в одной транзакции
+MESSAGE_ARCHIVE_CHUNK_SIZE = 1000
+
+# Максимум измененных сообщений в ответе дельта-синхронизации чатов;
+# при большем числе клиент получает reset и загружает чаты заново
+MESSAGING_SYNC_MAX_CHANGES = 500
+# Сколько дней хранятся записи об удалениях для синхронизации (очищаются командой
+# archive_messages); клиент с токеном старше этого срока загружает чаты заново
+MESSAGING_SYNC_TOMBSTONE_DAYS = int(os.getenv('MESSAGING_SYNC_TOMBSTONE_DAYS', '90'))
+
+# Поиск циклов обмена по избранному (trades.matching, команда match_trade_cycles)
+# Максимальное число участников цикла
+TRADE_CYCLE_MAX_LENGTH = 5
+# Сколько лучших циклов сохраняется на каждого пользователя, через которого они найдены
+TRADE_CYCLES_PER_USER = 20
+# Ограничение шагов обхода графа на одного пользователя
+TRADE_CYCLE_MAX_EXPANSIONS = 20000
+
+# Время жизни сводки предложений обмена пользователя в кэше, секунд
+# (сводка сбрасывается при каждом изменении предложений пользователя)
+TRADE_SUMMARY_CACHE_TIMEOUT = 600
+# Максимум предложений обмена в одном запросе пакетного создания
+TRADE_BULK_OFFERS_MAX = 50
+
+# Истечение ожидающих ответа предложений обмена (trades.expiry, команда expire_trade_offers)
+# Срок ответа на предложение, дней (0 - предложения не истекают)
+TRADE_OFFER_EXPIRE_AFTER_DAYS = int(os.getenv('TRADE_OFFER_EXPIRE_AFTER_DAYS', '14'))
+# Количество предложений, обрабатываемых в одной транзакции
+TRADE_OFFER_EXPIRE_BATCH_SIZE = 500
+
+# Инструментирование запросов (заголовок Server-Timing и JSON-лог common.instrumentation)
+# Доля запросов, для которых метрики пишутся в лог (без заголовка Server-Timing; 0 - только по заголовку)
+REQUEST_INSTRUMENTATION_SAMPLE_RATE = float(os.getenv('REQUEST_INSTRUMENTATION_SAMPLE_RATE', '0.01'))
+# Разрешить включать метрики заголовком X-Request-Timing
+REQUEST_INSTRUMENTATION_ALLOW_HEADER = os.getenv('REQUEST_INSTRUMENTATION_ALLOW_HEADER', 'False') == 'True'
+# Общий секрет для заголовка (X-Request-Timing: <секрет>). Без секрета заголовок
+# X-Request-Timing: 1 принимается только от сотрудников (is_staff) с JWT-токеном
+REQUEST_INSTRUMENTATION_HEADER_SECRET = os.getenv('REQUEST_INSTRUMENTATION_HEADER_SECRET', '')
+
 # Настройки логирования
 LOGGING = {
     'version': 1,
@@ -1,26 +1,175 @@
 from django.conf import settings
 from storages.backends.s3boto3 import S3Boto3Storage
+from collections import OrderedDict
 import logging
+import mimetypes
 import os
+import posixpath
 import hashlib
+import threading
+import uuid
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
+from botocore.exceptions import ClientError
 
 # Настраиваем логгер
 logger = logging.getLogger(__name__)
 
+# Файлы меньше порога читаются в память за один проход и загружаются одним PUT,
+# более крупные потоково загружаются multipart-загрузкой во временный ключ
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+# Префикс временных ключей незавершенных загрузок
+UPLOAD_TEMP_PREFIX = '.uploads'
+
+# Сколько ключей уже загруженных файлов помнить в процессе
+KNOWN_KEYS_CACHE_SIZE = 10000
+
+
+class HashingReader:
+    """
+    Обертка над файлом, считающая SHA-256 во время чтения.
+
+    Повторно прочитанные после seek байты (повтор части при сбое) не хешируются дважды:
+    учитывается только продвижение за уже прочитанную границу
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._hasher = hashlib.sha256()
+        self._hashed = 0
+        self._position = 0
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        end = self._position + len(data)
+        if end > self._hashed:
+            if self._position > self._hashed:
+                raise IOError('Пропуск данных при потоковой загрузке: хеш не может быть вычислен')
+            self._hasher.update(data[self._hashed - self._position:])
+            self._hashed = end
+        self._position = end
+        self.size = max(self.size, end)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._position = self._fileobj.seek(offset, whence)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+
+class KnownKeysCache:
+    """Потокобезопасный LRU-кэш ключей, наличие которых в бакете уже подтверждено"""
+
+    def __init__(self, max_size=KNOWN_KEYS_CACHE_SIZE):
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_size = max_size
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key):
+        with self._lock:
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > self._max_size:
+                self._keys.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_s3_client_config():
+    """Настройки клиента S3: пул соединений, keep-alive, повторы и таймауты"""
+    return Config(
+        s3={'addressing_style': 'path'},  # Используем 'path' вместо 'virtual'
+        signature_version='s3v4',
+        max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS,
+        connect_timeout=settings.AWS_S3_CONNECT_TIMEOUT,
+        read_timeout=settings.AWS_S3_READ_TIMEOUT,
+        retries={'max_attempts': settings.AWS_S3_MAX_ATTEMPTS, 'mode': 'standard'},
+        tcp_keepalive=True,
+    )
+
+
+def build_s3_client(**overrides):
+    """Создает новый клиент S3 с общими настройками"""
+    options = {
+        'endpoint_url': settings.AWS_S3_ENDPOINT_URL,
+        'aws_access_key_id': settings.AWS_ACCESS_KEY_ID,
+        'aws_secret_access_key': settings.AWS_SECRET_ACCESS_KEY,
+        'region_name': settings.AWS_S3_REGION_NAME,
+        'config': get_s3_client_config(),
+    }
+    options.update(overrides)
+    session = boto3.session.Session()
+    return session.client('s3', **options)
+
+
+def get_s3_client():
+    """
+    Возвращает общий для процесса клиент S3.
+
+    Клиенты boto3 потокобезопасны, поэтому один клиент с пулом соединений
+    обслуживает все потоки. После fork (pre-fork серверы) клиент создается заново:
+    соединения родителя не должны использоваться дочерним процессом
+    """
+    global _client, _client_pid
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = build_s3_client()
+            _client_pid = os.getpid()
+            logger.info(f"Создан общий клиент S3 для процесса {_client_pid}")
+        return _client
+
+
+def reset_s3_client():
+    """Сбрасывает общий клиент S3 (вызывается в дочернем процессе после fork)"""
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_s3_client)
+
+
 class S3Storage:
-    def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME,
-            config=Config(s3={'addressing_style': 'path'})  # Используем 'path' вместо 'virtual'
-        )
+    # Общий для процесса кэш известных ключей: позволяет не делать head_object
+    known_keys = KnownKeysCache()
+
+    def __init__(self, client=None):
+        self.s3_client = client or get_s3_client()
         self.bucket_name = settings.AWS_STORAGE_BUCKET_NAME
         self.base_url = f"{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}"
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=MULTIPART_CHUNKSIZE,
+        )
 
     def generate_file_hash(self, file):
         """Генерирует хеш на основе содержимого файла"""
@@ -29,32 +178,105 @@ class S3Storage:
             hasher.update(chunk)
         return hasher.hexdigest()
 
-    def upload_file(self, file, folder='media'):
+    def upload_file(self, file, folder='media', key=None):
+        """
+        Загружает файл и возвращает его публичный URL или None при ошибке.
+        Без key файл сохраняется под ключом folder/<sha256>.<расширение>
+        """
         try:
-            file_extension = file.name.split('.')[-1]
-            file_hash = self.generate_file_hash(file)
-            file_key = f"{folder}/{file_hash}.{file_extension}"
-            
-            logger.info(f"Загрузка файла в S3: bucket={self.bucket_name}, key={file_key}")
-
-            try:
-                self.s3_client.head_object(Bucket=self.bucket_name, Key=file_key)
-                logger.info(f"Файл уже существует: {file_key}")
-                return f"{self.base_url}/{file_key}"
-            except:
-                file.seek(0)
-                self.s3_client.upload_fileobj(
-                    file,
-                    self.bucket_name,
-                    file_key,
-                    ExtraArgs={'ACL': 'public-read'}
-                )
-                logger.info(f"Файл успешно загружен: {file_key}")
-                return f"{self.base_url}/{file_key}"
+            file_key = self.upload(file, folder=folder, key=key)
+            return f"{self.base_url}/{file_key}"
         except Exception as e:
             logger.error(f"Ошибка при загрузке файла: {e}")
             return None
 
+    def upload(self, file, folder='media', key=None, name=None):
+        """
+        Загружает файл за один проход чтения и возвращает ключ в бакете.
+
+        Небольшие файлы читаются в память, хешируются и загружаются одним PUT,
+        если такого содержимого еще нет. Крупные файлы потоково загружаются
+        во временный ключ с одновременным хешированием, после чего временный
+        объект переносится под ключ из хеша или удаляется как дубликат.
+        При явном key файл загружается под этим ключом без дедупликации.
+        name задает имя файла, если у объекта файла его нет (например, ContentFile)
+        """
+        file_name = name or getattr(file, 'name', None) or ''
+        file_extension = file_name.split('.')[-1] if '.' in file_name else 'bin'
+        extra_args = {'ACL': 'public-read'}
+        content_type = mimetypes.guess_type(file_name)[0]
+        if content_type:
+            extra_args['ContentType'] = content_type
+
+        if hasattr(file, 'seek'):
+            file.seek(0)
+
+        if key is not None:
+            logger.info(f"Загрузка файла в S3: bucket={self.bucket_name}, key={key}")
+            self.s3_client.upload_fileobj(
+                file, self.bucket_name, key, ExtraArgs=extra_args, Config=self.transfer_config
+            )
+            self.known_keys.add(key)
+            return key
+
+        size = getattr(file, 'size', None)
+        if size is not None and size <= MULTIPART_THRESHOLD:
+            data = file.read()
+            file_key = f"{folder}/{hashlib.sha256(data).hexdigest()}.{file_extension}"
+            if self._exists(file_key):
+                logger.info(f"Файл уже существует: {file_key}")
+                return file_key
+
+            logger.info(f"Загрузка файла в S3: bucket={self.bucket_name}, key={file_key}")
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=file_key, Body=data, **extra_args)
+            self.known_keys.add(file_key)
+            logger.info(f"Файл успешно загружен: {file_key}")
+            return file_key
+
+        return self._upload_streaming(file, folder, file_extension, extra_args)
+
+    def _upload_streaming(self, file, folder, file_extension, extra_args):
+        """Потоковая multipart-загрузка во временный ключ с последующим переносом"""
+        temp_key = f"{folder}/{UPLOAD_TEMP_PREFIX}/{uuid.uuid4().hex}.{file_extension}"
+        reader = HashingReader(file)
+
+        logger.info(f"Потоковая загрузка файла в S3: bucket={self.bucket_name}, временный ключ={temp_key}")
+        self.s3_client.upload_fileobj(
+            reader, self.bucket_name, temp_key, ExtraArgs=extra_args, Config=self.transfer_config
+        )
+
+        file_key = f"{folder}/{reader.hexdigest()}.{file_extension}"
+        try:
+            if self._exists(file_key):
+                logger.info(f"Файл уже существует, временная копия удаляется: {file_key}")
+            else:
+                self.s3_client.copy_object(
+                    Bucket=self.bucket_name,
+                    Key=file_key,
+                    CopySource={'Bucket': self.bucket_name, 'Key': temp_key},
+                    MetadataDirective='COPY',
+                    **extra_args
+                )
+                self.known_keys.add(file_key)
+                logger.info(f"Файл успешно загружен: {file_key}, размер={reader.size}")
+        finally:
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=temp_key)
+
+        return file_key
+
+    def _exists(self, file_key):
+        """Проверяет наличие объекта, сначала по локальному кэшу известных ключей"""
+        if file_key in self.known_keys:
+            return True
+        try:
+            self.s3_client.head_object(Bucket=self.bucket_name, Key=file_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        self.known_keys.add(file_key)
+        return True
+
     def delete_file(self, file_key):
         """
         Удаляет файл из S3 по ключу
@@ -64,6 +286,7 @@ class S3Storage:
                 Bucket=self.bucket_name,
                 Key=file_key
             )
+            self.known_keys.discard(file_key)
             logger.info(f"Файл успешно удален: {file_key}")
             return True
         except Exception as e:
@@ -76,11 +299,10 @@ class StaticStorage(S3Boto3Storage):
     file_overwrite = True
     
     def _save(self, name, content):
-        # Используем прямую загрузку через S3Storage
+        # Статические файлы адресуются по имени, поэтому загружаем их под тем же ключом
         storage = S3Storage()
-        file_url = storage.upload_file(content, folder=self.location)
+        file_url = storage.upload_file(content, key=f"{self.location}/{name}")
         if file_url:
-            # Возвращаем только имя файла, как ожидается Django
             return name
         else:
             # Попытка использовать стандартный метод
@@ -92,16 +314,19 @@ class MediaStorage(S3Boto3Storage):
     file_overwrite = False
     
     def _save(self, name, content):
-        # Используем прямую загрузку через S3Storage
+        # Используем прямую загрузку через S3Storage: файл сохраняется в каталог
+        # из name под ключом из хеша содержимого
         storage = S3Storage()
-        file_url = storage.upload_file(content, folder=self.location)
-        if file_url:
-            logger.info(f"Файл успешно сохранен с URL: {file_url}")
-            # Возвращаем только имя файла, как ожидается Django
-            return name
-        else:
-            logger.error("Не удалось сохранить файл через S3Storage, пробуем стандартный метод")
+        folder = posixpath.join(self.location, posixpath.dirname(name)).rstrip('/')
+        try:
+            file_key = storage.upload(content, folder=folder, name=name)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить файл через S3Storage, пробуем стандартный метод: {e}")
             return super()._save(name, content)
+        
+        logger.info(f"Файл успешно сохранен: {file_key}")
+        # Возвращаем имя относительно location, под которым файл действительно сохранен
+        return file_key[len(self.location) + 1:]
     
     def url(self, name, parameters=None, expire=None):
         """Возвращает публичный URL для файла"""
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:08
+
+from django.db import migrations, models
+
+
+def fill_category_paths(apps, schema_editor):
+    """Заполняет материализованные пути и уровни существующих категорий обходом от корней"""
+    Category = apps.get_model('categories', 'Category')
+    categories = list(Category.objects.all())
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    stack = [(category, '/', 0) for category in children.get(None, [])]
+    while stack:
+        category, parent_path, level = stack.pop()
+        category.path = f'{parent_path}{category.pk}/'
+        category.level = level
+        stack.extend((child, category.path, level + 1) for child in children.get(category.pk, []))
+
+    Category.objects.bulk_update(categories, ['path', 'level'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categories', '0002_alter_category_icon_alter_category_is_active_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='Материализованный путь из идентификаторов предков, например /1/5/12/', max_length=255, verbose_name='Путь'),
+        ),
+        migrations.RunPython(fill_category_paths, migrations.RunPython.noop),
+    ]
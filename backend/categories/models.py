@@ -1,9 +1,13 @@
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.lookups import StartsWith
 from django.utils.translation import gettext_lazy as _
 from django.utils.text import slugify
 from django.core.validators import FileExtensionValidator
 from django.core.exceptions import ValidationError
 from common.models import TimeStampedModel
+from .tree import get_category_tree
 import logging
 from django.conf import settings
 
@@ -32,6 +36,10 @@ class CategoryQuerySet(models.QuerySet):
     def ordered(self):
         """Возвращает категории в правильном порядке"""
         return self.order_by('order', 'name')
+    
+    def subtree(self, category):
+        """Возвращает категорию вместе со всеми потомками (один запрос по индексу path)"""
+        return self.filter(path__startswith=category.path)
 
 
 class CategoryManager(models.Manager):
@@ -46,26 +54,12 @@ class CategoryManager(models.Manager):
     def root_categories(self):
         return self.get_queryset().root_categories()
     
-    def build_tree(self):
-        """Строит дерево категорий"""
-        categories = list(self.get_queryset().active().ordered())
-        return self._build_tree_recursive(categories, None)
+    def subtree(self, category):
+        return self.get_queryset().subtree(category)
     
-    def _build_tree_recursive(self, categories, parent_id):
-        """Рекурсивно строит дерево категорий"""
-        tree = []
-        for category in categories:
-            if category.parent_id == parent_id:
-                children = self._build_tree_recursive(categories, category.id)
-                category_dict = {
-                    'id': category.id,
-                    'name': category.name,
-                    'slug': category.slug,
-                    'level': category.level,
-                    'children': children
-                }
-                tree.append(category_dict)
-        return tree
+    def build_tree(self):
+        """Строит дерево активных категорий по снимку дерева"""
+        return get_category_tree().to_tree()
 
 
 def category_icon_upload_path(instance, filename):
@@ -142,6 +136,16 @@ class Category(TimeStampedModel):
         db_index=True
     )
 
+    path = models.CharField(
+        _("Путь"),
+        max_length=255,
+        blank=True,
+        default='',
+        editable=False,
+        db_index=True,
+        help_text=_("Материализованный путь из идентификаторов предков, например /1/5/12/")
+    )
+
     objects = CategoryManager()
 
     class Meta:
@@ -185,10 +189,17 @@ class Category(TimeStampedModel):
         # Логирование загрузки иконки
         self._log_icon_save()
         
+        # Запоминаем прежнее положение в дереве для перестройки поддерева
+        previous = None
+        if self.pk:
+            previous = Category.objects.filter(pk=self.pk).values('path', 'level').first()
+        
         super().save(*args, **kwargs)
         
-        # Обновление уровня дочерних элементов при изменении родителя
-        self._update_children_levels()
+        # Обновление пути, а также пути и уровня потомков при изменении родителя
+        self._update_path()
+        if previous:
+            self._update_children_levels(previous['path'], previous['level'])
 
     def _generate_unique_slug(self):
         """Генерирует уникальный slug"""
@@ -211,66 +222,126 @@ class Category(TimeStampedModel):
 
     def _check_circular_dependency(self):
         """Проверяет наличие циклических зависимостей"""
-        current_parent = self.parent
-        while current_parent:
-            if current_parent.id == self.id:
-                return True
-            current_parent = current_parent.parent
-        return False
+        if not self.pk:
+            return False
+        return self.parent_id == self.pk or f'/{self.pk}/' in self.parent.path
+
+    def _build_path(self):
+        """Строит материализованный путь по пути родителя"""
+        parent_path = self.parent.path if self.parent_id else '/'
+        return f"{parent_path}{self.pk}/"
+
+    def _update_path(self):
+        """Сохраняет материализованный путь категории"""
+        path = self._build_path()
+        if path != self.path:
+            Category.objects.filter(pk=self.pk).update(path=path)
+            self.path = path
+
+    def _update_children_levels(self, old_path, old_level):
+        """
+        Обновляет путь и уровень всех потомков одним UPDATE
+        после перемещения категории в дереве
+        """
+        if not old_path or (old_path == self.path and old_level == self.level):
+            return
+        
+        Category.rebase_subtree(old_path, self.path, self.level - old_level, exclude_pk=self.pk)
 
-    def _update_children_levels(self):
-        """Обновляет уровень всех дочерних категорий"""
-        children = self.children.all()
-        for child in children:
-            old_level = child.level
-            child._calculate_level()
-            if child.level != old_level:
-                child.save(update_fields=['level'])
+    @classmethod
+    def rebase_subtree(cls, old_path, new_path, level_delta, exclude_pk=None):
+        """Переносит поддерево с префиксом old_path под префикс new_path"""
+        descendants = cls.objects.filter(path__startswith=old_path)
+        if exclude_pk is not None:
+            descendants = descendants.exclude(pk=exclude_pk)
+        
+        updated = descendants.update(
+            path=Concat(Value(new_path), Substr('path', len(old_path) + 1), output_field=models.CharField()),
+            level=F('level') + level_delta
+        )
+        logger.info(f"Перестроено поддерево категорий: {old_path} -> {new_path}, потомков: {updated}")
+        return updated
 
     def _log_icon_save(self):
         """Логирует информацию о сохранении иконки"""
         if self.icon and hasattr(self.icon, 'name'):
             logger.info(f"Сохранение категории с иконкой: category_id={self.pk}, icon={self.icon.name}")
 
+    @property
+    def ancestor_ids(self):
+        """Возвращает идентификаторы предков от корня, разбирая материализованный путь"""
+        return [int(pk) for pk in self.path.strip('/').split('/')[:-1] if pk]
+
+    def _tree_node(self):
+        """
+        Возвращает снимок дерева и узел категории в нем,
+        если положение категории в снимке совпадает с сохраненным
+        """
+        tree = get_category_tree()
+        node = tree.get(self.pk)
+        if node is not None and node.path == self.path:
+            return tree, node
+        return tree, None
+
     @property
     def full_path(self):
         """Возвращает полный путь категории"""
-        path = [self.name]
-        current = self.parent
-        while current:
-            path.insert(0, current.name)
-            current = current.parent
-        return " > ".join(path)
+        tree, node = self._tree_node()
+        if node is not None:
+            ancestors = [ancestor.name for ancestor in tree.ancestors(node)]
+        else:
+            ancestors = [ancestor.name for ancestor in self.get_ancestors()]
+        return " > ".join(ancestors + [self.name])
 
     @property
     def children_count(self):
         """Возвращает количество дочерних категорий"""
+        tree, node = self._tree_node()
+        if node is not None:
+            return len(tree.children(node))
         return self.children.filter(is_active=True).count()
 
     @property
     def descendants_count(self):
         """Возвращает общее количество потомков"""
-        count = 0
-        for child in self.children.filter(is_active=True):
-            count += 1 + child.descendants_count
-        return count
+        return self._active_descendants().count()
 
     def get_ancestors(self):
         """Возвращает список всех предков"""
-        ancestors = []
-        current = self.parent
-        while current:
-            ancestors.insert(0, current)
-            current = current.parent
-        return ancestors
+        ancestor_ids = self.ancestor_ids
+        if not ancestor_ids:
+            return []
+        return list(Category.objects.filter(pk__in=ancestor_ids).order_by('level'))
 
     def get_descendants(self):
         """Возвращает список всех потомков"""
-        descendants = []
-        for child in self.children.filter(is_active=True):
-            descendants.append(child)
-            descendants.extend(child.get_descendants())
-        return descendants
+        descendants = list(self._active_descendants().ordered())
+        
+        # Восстанавливаем порядок обхода в глубину по уже загруженным категориям
+        children = {}
+        for category in descendants:
+            children.setdefault(category.parent_id, []).append(category)
+        
+        result = []
+        stack = list(reversed(children.get(self.pk, [])))
+        while stack:
+            category = stack.pop()
+            result.append(category)
+            stack.extend(reversed(children.get(category.pk, [])))
+        return result
+
+    def _active_descendants(self):
+        """
+        Активные потомки, у которых все промежуточные предки тоже активны
+        (одним запросом по префиксу path)
+        """
+        hidden_by_inactive = Category.objects.filter(
+            path__startswith=self.path, is_active=False
+        ).exclude(pk=self.pk).filter(StartsWith(OuterRef('path'), F('path')))
+        
+        return Category.objects.subtree(self).exclude(pk=self.pk).filter(
+            is_active=True
+        ).filter(~Exists(hidden_by_inactive))
 
     def can_be_parent_of(self, category):
         """Проверяет, может ли категория быть родителем указанной категории"""
@@ -278,10 +349,4 @@ class Category(TimeStampedModel):
             return False
         
         # Проверяем, не является ли указанная категория предком текущей
-        current = self.parent
-        while current:
-            if current == category:
-                return False
-            current = current.parent
-        
-        return True
+        return category.pk not in self.ancestor_ids
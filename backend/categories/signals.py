@@ -0,0 +1,34 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+import logging
+
+from .models import Category
+from .tree import schedule_tree_invalidation
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_delete, sender=Category)
+def rebase_orphaned_children(sender, instance, **kwargs):
+    """
+    После удаления категории ее дочерние категории становятся корневыми
+    (on_delete=SET_NULL): перестраиваем пути и уровни их поддеревьев
+    """
+    if not instance.path:
+        return
+
+    orphans = Category.objects.filter(
+        path__startswith=instance.path, level=instance.level + 1, parent__isnull=True
+    )
+    for child in orphans:
+        Category.rebase_subtree(child.path, f'/{child.pk}/', -child.level)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_tree_snapshot(sender, instance, **kwargs):
+    """
+    Меняет версию снимка дерева категорий после фиксации; до нее текущая
+    транзакция видит изменения в собственном снимке
+    """
+    schedule_tree_invalidation()
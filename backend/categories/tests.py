@@ -1,3 +1,101 @@
 from django.test import TestCase
 
 # Create your tests here.
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .models import Category
+
+
+class CategoryPathTest(TestCase):
+    """Тесты материализованного пути категорий"""
+
+    def setUp(self):
+        """Создает дерево: Электроника > Телефоны > Смартфоны, Электроника > Ноутбуки"""
+        self.root = Category.objects.create(name='Электроника', slug='electronics')
+        self.phones = Category.objects.create(name='Телефоны', slug='phones', parent=self.root)
+        self.smartphones = Category.objects.create(name='Смартфоны', slug='smartphones', parent=self.phones)
+        self.laptops = Category.objects.create(name='Ноутбуки', slug='laptops', parent=self.root)
+
+    def test_path_and_queries(self):
+        """Тест пути, предков и потомков"""
+        self.assertEqual(self.smartphones.path, f'/{self.root.pk}/{self.phones.pk}/{self.smartphones.pk}/')
+        self.assertEqual(self.smartphones.full_path, 'Электроника > Телефоны > Смартфоны')
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.root.descendants_count, 3)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(self.root.get_descendants(), [self.laptops, self.phones, self.smartphones])
+
+        self.phones.is_active = False
+        self.phones.save()
+        self.assertEqual(self.root.descendants_count, 1)
+
+    def test_move_and_delete_rebuild_subtree(self):
+        """Тест перестройки поддерева при перемещении и удалении родителя"""
+        self.phones.parent = self.laptops
+        self.phones.save()
+        self.smartphones.refresh_from_db()
+        self.assertEqual(self.smartphones.level, 3)
+        self.assertEqual(self.smartphones.ancestor_ids, [self.root.pk, self.laptops.pk, self.phones.pk])
+        self.assertFalse(self.smartphones.can_be_parent_of(self.laptops))
+
+        self.laptops.delete()
+        self.phones.refresh_from_db()
+        self.smartphones.refresh_from_db()
+        self.assertEqual((self.phones.path, self.phones.level), (f'/{self.phones.pk}/', 0))
+        self.assertEqual(self.smartphones.path, f'/{self.phones.pk}/{self.smartphones.pk}/')
+        self.assertEqual(self.smartphones.level, 1)
+
+
+class CategoryTreeSnapshotTest(TestCase):
+    """Тесты снимка дерева категорий"""
+
+    def test_snapshot_follows_writes(self):
+        """Тест перестройки снимка после изменения категорий"""
+        from .tree import get_category_tree
+
+        with self.captureOnCommitCallbacks(execute=True):
+            root = Category.objects.create(name='Спорт', slug='sport')
+            bikes = Category.objects.create(name='Велосипеды', slug='bikes', parent=root)
+            hidden = Category.objects.create(name='Архив', slug='archive', parent=root, is_active=False)
+            Category.objects.create(name='Запчасти', slug='parts', parent=hidden)
+
+        tree = get_category_tree()
+        self.assertIs(get_category_tree(), tree)
+        self.assertEqual(
+            Category.objects.build_tree(),
+            [{'id': root.id, 'name': 'Спорт', 'slug': 'sport', 'level': 0, 'children': [
+                {'id': bikes.id, 'name': 'Велосипеды', 'slug': 'bikes', 'level': 1, 'children': []},
+            ]}]
+        )
+        self.assertEqual(len(tree.descendant_ids(tree.get_by_slug('sport'))), 4)
+
+        bikes.name = 'Велосипеды и самокаты'
+        with self.captureOnCommitCallbacks(execute=True):
+            bikes.save()
+        self.assertIsNot(get_category_tree(), tree)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(bikes.full_path, 'Спорт > Велосипеды и самокаты')
+        self.assertEqual(len(context.captured_queries), 0)
+
+    def test_rolled_back_writes_not_published(self):
+        """Тест: снимок с откаченными изменениями не публикуется"""
+        from .tree import get_category_tree
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Спорт', slug='sport')
+        tree = get_category_tree()
+
+        try:
+            with transaction.atomic():
+                Category.objects.create(name='Туризм', slug='tourism')
+                own_tree = get_category_tree()
+                self.assertIsNotNone(own_tree.get_by_slug('tourism'))
+                self.assertIsNot(get_category_tree(), own_tree)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        self.assertIs(get_category_tree(), tree)
+        self.assertIsNone(tree.get_by_slug('tourism'))
@@ -0,0 +1,190 @@
+"""
+Неизменяемый снимок дерева категорий в памяти процесса.
+
+Снимок строится за O(n) одним запросом и хранит компактные узлы с индексами
+родителя и детей, а также словари id -> узел и slug -> узел. Актуальность
+определяется меткой версии в общем кэше: после фиксации любой записи категории
+метка меняется, и каждый воркер лениво перестраивает свой снимок при следующем
+обращении. Транзакция, изменившая категории, до фиксации получает снимок,
+построенный только для нее (common.versioning).
+"""
+import logging
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from common.versioning import has_uncommitted_writes, schedule_version_bump
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'categories:tree:version'
+
+
+class CategoryNode:
+    """Компактный узел дерева категорий"""
+    __slots__ = (
+        'index', 'id', 'name', 'slug', 'level', 'order', 'is_active', 'path',
+        'parent_index', 'child_indexes',
+    )
+
+    def __init__(self, index, category, parent_index):
+        self.index = index
+        self.id = category.id
+        self.name = category.name
+        self.slug = category.slug
+        self.level = category.level
+        self.order = category.order
+        self.is_active = category.is_active
+        self.path = category.path
+        self.parent_index = parent_index
+        self.child_indexes = ()
+
+
+class CategoryTreeSnapshot:
+    """Снимок дерева категорий. После построения не изменяется"""
+
+    def __init__(self, categories, version):
+        """
+        categories - все категории, упорядоченные по (order, name),
+        поэтому дети каждого узла сразу получаются в порядке отображения
+        """
+        self.version = version
+        index_by_id = {category.id: index for index, category in enumerate(categories)}
+
+        self.nodes = tuple(
+            CategoryNode(index, category, index_by_id.get(category.parent_id))
+            for index, category in enumerate(categories)
+        )
+
+        children = [[] for _ in self.nodes]
+        roots = []
+        for node in self.nodes:
+            if node.parent_index is None:
+                roots.append(node.index)
+            else:
+                children[node.parent_index].append(node.index)
+        for node, child_indexes in zip(self.nodes, children):
+            node.child_indexes = tuple(child_indexes)
+
+        self.root_indexes = tuple(roots)
+        self.by_id = {node.id: node for node in self.nodes}
+        self.by_slug = {node.slug: node for node in self.nodes}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get(self, category_id):
+        """Возвращает узел по id или None"""
+        return self.by_id.get(category_id)
+
+    def get_by_slug(self, slug):
+        """Возвращает узел по slug или None"""
+        return self.by_slug.get(slug)
+
+    def children(self, node, active_only=True):
+        """Возвращает дочерние узлы в порядке отображения"""
+        nodes = (self.nodes[index] for index in node.child_indexes)
+        return [child for child in nodes if child.is_active or not active_only]
+
+    def ancestors(self, node):
+        """Возвращает предков узла от корня"""
+        ancestors = []
+        while node.parent_index is not None:
+            node = self.nodes[node.parent_index]
+            ancestors.append(node)
+        ancestors.reverse()
+        return ancestors
+
+    def full_path(self, node):
+        """Возвращает полный путь категории вида «Родитель > Категория»"""
+        return " > ".join([ancestor.name for ancestor in self.ancestors(node)] + [node.name])
+
+    def descendant_ids(self, node, include_self=True):
+        """Возвращает id всех потомков узла (включая неактивные)"""
+        result = [node.id] if include_self else []
+        stack = list(node.child_indexes)
+        while stack:
+            child = self.nodes[stack.pop()]
+            result.append(child.id)
+            stack.extend(child.child_indexes)
+        return result
+
+    def to_tree(self):
+        """
+        Возвращает дерево активных категорий в формате API.
+        Поддеревья неактивных категорий не выводятся
+        """
+        def build(indexes):
+            tree = []
+            for index in indexes:
+                node = self.nodes[index]
+                if node.is_active:
+                    tree.append({
+                        'id': node.id,
+                        'name': node.name,
+                        'slug': node.slug,
+                        'level': node.level,
+                        'children': build(node.child_indexes),
+                    })
+            return tree
+
+        return build(self.root_indexes)
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_tree_version():
+    """Возвращает текущую метку версии дерева из общего кэша"""
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def invalidate_category_tree():
+    """Меняет метку версии: все воркеры перестроят снимок при следующем обращении"""
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+    logger.debug("Метка версии дерева категорий обновлена")
+
+
+def schedule_tree_invalidation():
+    """Меняет метку версии после фиксации текущей транзакции"""
+    schedule_version_bump(VERSION_CACHE_KEY, invalidate_category_tree)
+
+
+def _build_snapshot(version):
+    from .models import Category
+
+    categories = list(
+        Category.objects.only(
+            'id', 'name', 'slug', 'level', 'order', 'is_active', 'path', 'parent_id'
+        ).order_by('order', 'name', 'id')
+    )
+    return CategoryTreeSnapshot(categories, version)
+
+
+def get_category_tree():
+    """Возвращает актуальный снимок дерева категорий, перестраивая его при смене версии"""
+    global _snapshot
+
+    if has_uncommitted_writes(VERSION_CACHE_KEY):
+        # Незафиксированные изменения категорий видны только этой транзакции
+        return _build_snapshot(None)
+
+    # Версию читаем до загрузки категорий: запись, завершившаяся во время
+    # построения, сменит метку, и снимок будет перестроен при следующем обращении
+    version = get_tree_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _snapshot_lock:
+        if _snapshot is not None and _snapshot.version == version:
+            return _snapshot
+        _snapshot = _build_snapshot(version)
+        logger.info(f"Построен снимок дерева категорий: {len(_snapshot)} категорий")
+        return _snapshot
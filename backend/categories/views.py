@@ -6,10 +6,9 @@ from django_filters.rest_framework import DjangoFilterBackend
 from django.db import transaction, models
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from copy import copy
 from .models import Category
+from .tree import get_category_tree, schedule_tree_invalidation
 from .serializers import (
     CategorySerializer, 
     CategoryListSerializer, 
@@ -61,13 +60,14 @@ class CacheManagerMixin:
         return f"categories:{action}:{':'.join(map(str, args))}"
     
     def _invalidate_cache(self):
-        """Очищает кеш категорий"""
+        """Очищает кеш категорий и снимок дерева во всех воркерах"""
         cache_keys = [
             'categories:tree',
             'categories:root',
             'categories:list'
         ]
         cache.delete_many(cache_keys)
+        schedule_tree_invalidation()
         logger.debug("Кеш категорий очищен")
 
 
@@ -199,7 +199,6 @@ class CategoryViewSet(ActionLoggerMixin, CacheManagerMixin, viewsets.ModelViewSe
             f"ip={ip}, params={params}"
         )
     
-    @method_decorator(cache_page(60 * 15))  # Кеш на 15 минут
     @action(detail=True, methods=['get'])
     def children(self, request, pk=None):
         """
@@ -207,7 +206,13 @@ class CategoryViewSet(ActionLoggerMixin, CacheManagerMixin, viewsets.ModelViewSe
         """
         try:
             category = self.get_object()
-            children = category.children.filter(is_active=True).order_by('order', 'name')
+            tree = get_category_tree()
+            node = tree.get(category.id)
+            child_ids = [child.id for child in tree.children(node)] if node else []
+            
+            # Порядок берем из снимка, данные для сериализации - одним запросом
+            children_by_id = Category.objects.in_bulk(child_ids)
+            children = [children_by_id[child_id] for child_id in child_ids if child_id in children_by_id]
             
             serializer = CategoryListSerializer(children, many=True, context={'request': request})
             
@@ -232,35 +237,14 @@ class CategoryViewSet(ActionLoggerMixin, CacheManagerMixin, viewsets.ModelViewSe
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
-    @method_decorator(cache_page(60 * 30))  # Кеш на 30 минут
     @action(detail=False, methods=['get'])
     def tree(self, request):
         """
         Возвращает дерево категорий, начиная с верхнего уровня
         """
         try:
-            cache_key = self._get_cache_key('tree')
-            cached_data = cache.get(cache_key)
-            
-            if cached_data:
-                logger.debug("Возвращаем дерево категорий из кеша")
-                return Response(cached_data)
-            
-            # Используем менеджер для построения дерева
-            tree_data = Category.objects.build_tree()
-            
-            # Или альтернативный способ через сериализатор
-            if not tree_data:
-                root_categories = Category.objects.root_categories().active().ordered()
-                serializer = CategorySerializer(
-                    root_categories, 
-                    many=True, 
-                    context={'request': request}
-                )
-                tree_data = serializer.data
-            
-            # Кешируем результат
-            cache.set(cache_key, tree_data, 60 * 30)
+            # Снимок дерева перестраивается автоматически при смене версии после записи
+            tree_data = get_category_tree().to_tree()
             
             logger.info(f"Запрос дерева категорий: root_count={len(tree_data)}")
             
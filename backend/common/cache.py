@@ -0,0 +1,10 @@
+"""
+Свойства настроенного кэша Django.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_process_local(alias='default'):
+    """True, если кэш виден только текущему процессу (LocMemCache)"""
+    return isinstance(caches[alias], LocMemCache)
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+from .cache import is_process_local
+
+LOCAL_CACHE_HINT = "Задайте REDIS_URL: кэш должен быть общим для всех процессов"
+
+
+@register(Tags.caches)
+def check_shared_cache_for_workers(app_configs, **kwargs):
+    """Несколько процессов ASGI-сервера не увидят изменений друг друга в LocMemCache"""
+    if is_process_local() and settings.ASGI_WORKERS > 1:
+        return [Error(
+            f"Кэш LocMemCache не общий для {settings.ASGI_WORKERS} процессов ASGI-сервера (WEB_CONCURRENCY)",
+            hint=LOCAL_CACHE_HINT,
+            id='common.E002',
+        )]
+    return []
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache_for_deploy(app_configs, **kwargs):
+    """На сервере команды и воркеры - разные процессы, им нужен общий кэш"""
+    if is_process_local() and not settings.DEBUG:
+        return [Error(
+            "Кэш LocMemCache допустим только при разработке (DEBUG)",
+            hint=LOCAL_CACHE_HINT,
+            id='common.E001',
+        )]
+    return []
@@ -0,0 +1,247 @@
+"""
+Генерация производных изображений (settings.IMAGE_SIZES).
+
+После загрузки изображения (ItemImage, аватар профиля, вложение сообщения)
+оригинал декодируется в пуле процессов: ориентация исправляется по EXIF,
+метаданные удаляются, для каждого размера создаются варианты WebP и JPEG.
+Производные сохраняются рядом с оригиналом под ключами из хеша содержимого
+и записываются в JSON-поле модели вида:
+
+    {
+        "source": "<имя оригинала>",
+        "thumbnail": {"width": 150, "height": 150, "webp": "<ключ>", "jpeg": "<ключ>"},
+        ...
+    }
+
+Хранилище задается настройкой IMAGE_DERIVATIVES_STORAGE, поэтому в тестах
+вместо S3 можно использовать FileSystemStorage.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import posixpath
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {
+    'webp': 'webp',
+    'jpeg': 'jpg',
+}
+
+DEFAULT_QUALITY = 82
+
+
+def render_derivatives(data, sizes, formats, quality=DEFAULT_QUALITY):
+    """
+    Декодирует изображение и возвращает производные:
+    {размер: {'width': w, 'height': h, формат: bytes}}.
+
+    Выполняется в дочернем процессе, поэтому принимает и возвращает только
+    сериализуемые данные и не обращается к Django
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as source:
+        # JPEG можно декодировать сразу в уменьшенном масштабе
+        largest = max(max(spec['width'], spec['height']) for spec in sizes.values())
+        source.draft('RGB', (largest * 2, largest * 2))
+
+        # Поворот по EXIF; сохранение без параметра exif удаляет метаданные
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'P') else 'RGB')
+
+        result = {}
+        for name, spec in sizes.items():
+            box = (spec['width'], spec['height'])
+            if spec.get('crop'):
+                resized = ImageOps.fit(image, box, Image.LANCZOS)
+            else:
+                resized = image.copy()
+                resized.thumbnail(box, Image.LANCZOS)
+
+            variants = {'width': resized.width, 'height': resized.height}
+            for image_format in formats:
+                variants[image_format] = _encode(resized, image_format, quality)
+            result[name] = variants
+
+    return result
+
+
+def _encode(image, image_format, quality):
+    """Кодирует изображение в заданный формат без метаданных"""
+    from PIL import Image
+
+    if image_format == 'jpeg' and image.mode == 'RGBA':
+        # JPEG не поддерживает прозрачность: накладываем на белый фон
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+
+    buffer = io.BytesIO()
+    if image_format == 'jpeg':
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    elif image_format == 'webp':
+        image.save(buffer, 'WEBP', quality=quality, method=4)
+    else:
+        raise ValueError(f'Неподдерживаемый формат производного изображения: {image_format}')
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=None)
+def get_image_storage():
+    """Возвращает хранилище для чтения оригиналов и записи производных"""
+    return import_string(settings.IMAGE_DERIVATIVES_STORAGE)()
+
+
+_process_pool = None
+_process_pool_pid = None
+_dispatcher = None
+_dispatcher_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    """Пул процессов для декодирования; пересоздается после fork воркера"""
+    global _process_pool, _process_pool_pid
+    with _pool_lock:
+        if _process_pool is None or _process_pool_pid != os.getpid():
+            _process_pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            _process_pool_pid = os.getpid()
+        return _process_pool
+
+
+def _get_dispatcher():
+    """Поток-диспетчер: чтение оригинала и запись производных в хранилище"""
+    global _dispatcher, _dispatcher_pid
+    with _pool_lock:
+        if _dispatcher is None or _dispatcher_pid != os.getpid():
+            _dispatcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-derivatives')
+            _dispatcher_pid = os.getpid()
+        return _dispatcher
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    if setting == 'IMAGE_DERIVATIVES_STORAGE':
+        get_image_storage.cache_clear()
+
+
+def _render(data):
+    sizes = settings.IMAGE_SIZES
+    formats = list(settings.IMAGE_DERIVATIVE_FORMATS)
+    if settings.IMAGE_PROCESSING_WORKERS:
+        return _get_process_pool().submit(render_derivatives, data, sizes, formats).result()
+    return render_derivatives(data, sizes, formats)
+
+
+def generate_derivatives(model, pk, file_field, derivatives_field):
+    """
+    Создает производные изображения для объекта и записывает их в модель.
+    Ничего не делает, если производные для текущего файла уже есть
+    """
+    instance = model._default_manager.filter(pk=pk).first()
+    if instance is None:
+        return None
+
+    name = getattr(instance, file_field).name
+    if not name or (getattr(instance, derivatives_field) or {}).get('source') == name:
+        return None
+
+    storage = get_image_storage()
+    with storage.open(name, 'rb') as original:
+        data = original.read()
+
+    rendered = _render(data)
+
+    record = {'source': name}
+    directory = posixpath.dirname(name)
+    for size, variants in rendered.items():
+        entry = {'width': variants.pop('width'), 'height': variants.pop('height')}
+        for image_format, payload in variants.items():
+            digest = hashlib.sha256(payload).hexdigest()
+            key = posixpath.join(directory, f'{digest}.{FORMAT_EXTENSIONS[image_format]}')
+            if not storage.exists(key):
+                key = storage.save(key, ContentFile(payload))
+            entry[image_format] = key
+        record[size] = entry
+
+    # Записываем, только если файл не заменили, пока шла обработка
+    updated = model._default_manager.filter(pk=pk, **{file_field: name}).update(**{derivatives_field: record})
+    if updated:
+        logger.info(f"Созданы производные изображения: {model._meta.label} id={pk}, файл={name}")
+    return record if updated else None
+
+
+def _run_job(model, pk, file_field, derivatives_field):
+    try:
+        generate_derivatives(model, pk, file_field, derivatives_field)
+    except Exception:
+        logger.exception(f"Ошибка создания производных изображения: {model._meta.label} id={pk}")
+
+
+def _run_job_in_thread(*args):
+    try:
+        _run_job(*args)
+    finally:
+        close_old_connections()
+
+
+def schedule_derivatives(instance, file_field='image', derivatives_field='derivatives'):
+    """
+    Ставит создание производных изображения в очередь после фиксации транзакции
+    """
+    if not getattr(settings, 'IMAGE_DERIVATIVES_ENABLED', False):
+        return
+    if not getattr(instance, file_field).name:
+        return
+    if (getattr(instance, derivatives_field) or {}).get('source') == getattr(instance, file_field).name:
+        return
+
+    args = (type(instance), instance.pk, file_field, derivatives_field)
+
+    def dispatch():
+        if settings.IMAGE_DERIVATIVES_ASYNC:
+            _get_dispatcher().submit(_run_job_in_thread, *args)
+        else:
+            _run_job(*args)
+
+    transaction.on_commit(dispatch)
+
+
+def media_url(name):
+    """Возвращает публичный URL файла в медиахранилище"""
+    return get_image_storage().url(name)
+
+
+def derivative_urls(record):
+    """
+    Возвращает URL производных по размерам: {размер: {формат: url}}.
+    Пока производные не готовы, возвращает None
+    """
+    if not record:
+        return None
+    urls = {}
+    for size in settings.IMAGE_SIZES:
+        entry = record.get(size)
+        if entry:
+            urls[size] = {
+                image_format: media_url(entry[image_format])
+                for image_format in FORMAT_EXTENSIONS if image_format in entry
+            }
+    return urls or None
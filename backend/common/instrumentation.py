@@ -0,0 +1,184 @@
+"""
+Инструментирование запросов: количество SQL-запросов, время БД и отдельных этапов.
+
+RequestInstrumentationMiddleware включает сбор метрик для запроса, если он попал
+в выборку (REQUEST_INSTRUMENTATION_SAMPLE_RATE) или клиент явно запросил метрики
+заголовком X-Request-Timing (если REQUEST_INSTRUMENTATION_ALLOW_HEADER). Заголовок
+принимается со значением REQUEST_INSTRUMENTATION_HEADER_SECRET, а если секрет
+не задан - со значением 1 от сотрудника (is_staff) с JWT-токеном.
+Для инструментированного запроса в лог common.instrumentation пишется одна
+JSON-строка; заголовок Server-Timing добавляется в ответ, только если метрики
+запрошены разрешенным заголовком (запросы из выборки его не получают).
+
+Этапы размечаются в коде контекстным менеджером span():
+
+    with span('serialize'):
+        data = serializer.data
+
+Вне инструментированного запроса span() ничего не делает, поэтому разметка
+остается в коде постоянно, и отладочные запросы к БД добавлять не нужно.
+"""
+from contextlib import ExitStack, contextmanager
+import contextvars
+import hmac
+import json
+import logging
+import random
+import re
+import time
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+TIMING_HEADER = 'HTTP_X_REQUEST_TIMING'
+
+# Причины инструментирования запроса (RequestInstrumentationMiddleware.is_enabled)
+REASON_HEADER = 'header'
+REASON_SAMPLE = 'sample'
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Метрики одного запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.spans = {}
+
+    def add_span(self, name, duration):
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обертка выполнения SQL для connection.execute_wrapper"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        """Значение заголовка Server-Timing, длительности в миллисекундах"""
+        entries = [
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+        ]
+        for name, duration in self.spans.items():
+            entries.append(f'{_metric_name(name)};dur={duration * 1000:.1f}')
+        return ', '.join(entries)
+
+    def as_dict(self, total):
+        return {
+            'total_ms': round(total * 1000, 1),
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 1),
+            'spans_ms': {name: round(duration * 1000, 1) for name, duration in self.spans.items()},
+        }
+
+
+def _metric_name(name):
+    # Имя метрики в Server-Timing должно быть токеном HTTP
+    return re.sub(r'[^A-Za-z0-9_.\-]', '_', name)
+
+
+def get_metrics():
+    """Возвращает метрики текущего запроса или None, если он не инструментирован"""
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Замеряет длительность этапа текущего запроса"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_span(name, time.perf_counter() - started)
+
+
+@contextmanager
+def instrument():
+    """Собирает метрики для блока кода; возвращает RequestMetrics"""
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(metrics))
+            yield metrics
+    finally:
+        _current.reset(token)
+
+
+class RequestInstrumentationMiddleware:
+    """Собирает метрики запроса и отдает их в Server-Timing и структурированный лог"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reason = self.is_enabled(request)
+        if reason is None:
+            return self.get_response(request)
+
+        with instrument() as metrics:
+            response = self.get_response(request)
+        total = metrics.total
+
+        if reason == REASON_HEADER:
+            response['Server-Timing'] = metrics.server_timing(total)
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'reason': reason,
+            **metrics.as_dict(total),
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
+        return response
+
+    def is_enabled(self, request):
+        """
+        Возвращает причину инструментирования запроса (REASON_HEADER или
+        REASON_SAMPLE) или None, если запрос не инструментируется
+        """
+        if getattr(settings, 'REQUEST_INSTRUMENTATION_ALLOW_HEADER', False):
+            forced = request.META.get(TIMING_HEADER)
+            if forced is not None and self.header_allowed(request, forced):
+                return REASON_HEADER
+        rate = getattr(settings, 'REQUEST_INSTRUMENTATION_SAMPLE_RATE', 0)
+        if rate > 0 and random.random() < rate:
+            return REASON_SAMPLE
+        return None
+
+    def header_allowed(self, request, value):
+        """Проверяет, может ли клиент включить метрики заголовком"""
+        secret = getattr(settings, 'REQUEST_INSTRUMENTATION_HEADER_SECRET', '')
+        if secret:
+            return hmac.compare_digest(value.encode(), secret.encode())
+        return value == '1' and self._is_staff(request)
+
+    def _is_staff(self, request):
+        # Middleware работает до аутентификации DRF: токен проверяется здесь,
+        # только для запросов с заголовком
+        from rest_framework_simplejwt.authentication import JWTAuthentication
+
+        try:
+            result = JWTAuthentication().authenticate(request)
+        except Exception:
+            return False
+        return result is not None and result[0].is_staff
@@ -0,0 +1,135 @@
+"""
+Справочные таблицы (статусы, состояния, типы) в памяти процесса.
+
+Строки справочника загружаются одним запросом при первом обращении и
+выдаются по названию и id без запросов к БД. Актуальность определяется
+меткой версии справочника в общем кэше: после фиксации любой записи в таблицу
+метка меняется, и каждый воркер лениво перезагружает справочник при следующем
+обращении (как снимок дерева категорий в categories.tree). Транзакция,
+изменившая справочник, до фиксации получает снимок, загруженный только для нее
+(common.versioning).
+
+    from common import lookups
+    pending = lookups.get(TradeStatus, 'pending')
+    pending_id = lookups.get_id(TradeStatus, 'pending')
+"""
+import copy
+import logging
+import threading
+import uuid
+
+from django.apps import apps
+from django.core.cache import cache
+
+from .versioning import has_uncommitted_writes, schedule_version_bump
+
+logger = logging.getLogger(__name__)
+
+# Справочные модели: app_label.ModelName с уникальным полем name
+LOOKUP_MODELS = (
+    'trades.TradeStatus',
+    'items.ItemStatus',
+    'items.ItemCondition',
+    'reviews.ReviewType',
+    'notifications.NotificationType',
+    'moderation.ReportReason',
+)
+
+
+def _version_key(model):
+    return f'lookups:{model._meta.label_lower}:version'
+
+
+class LookupTable:
+    """Неизменяемый снимок строк одного справочника"""
+
+    def __init__(self, model, rows, version):
+        self.model = model
+        self.version = version
+        self.by_id = {row.pk: row for row in rows}
+        self.by_name = {row.name: row for row in rows}
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_version(model):
+    """Возвращает текущую метку версии справочника из общего кэша"""
+    key = _version_key(model)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(model):
+    """Меняет метку версии: все воркеры перезагрузят справочник при следующем обращении"""
+    cache.set(_version_key(model), uuid.uuid4().hex, timeout=None)
+    logger.debug(f"Метка версии справочника {model._meta.label} обновлена")
+
+
+def schedule_invalidation(model):
+    """Меняет метку версии после фиксации текущей транзакции"""
+    schedule_version_bump(_version_key(model), lambda: invalidate(model))
+
+
+def get_table(model):
+    """Возвращает актуальный снимок справочника, перезагружая его при смене версии"""
+    if has_uncommitted_writes(_version_key(model)):
+        # Незафиксированные изменения справочника видны только этой транзакции
+        return LookupTable(model, list(model.objects.all()), None)
+
+    # Версию читаем до загрузки строк: запись, завершившаяся во время
+    # загрузки, сменит метку, и справочник будет перезагружен при следующем обращении
+    version = get_version(model)
+    table = _tables.get(model)
+    if table is not None and table.version == version:
+        return table
+
+    with _tables_lock:
+        table = _tables.get(model)
+        if table is not None and table.version == version:
+            return table
+        table = LookupTable(model, list(model.objects.all()), version)
+        _tables[model] = table
+        logger.info(f"Загружен справочник {model._meta.label}: {len(table)} строк")
+        return table
+
+
+def get(model, name):
+    """
+    Строка справочника по названию. Возвращается копия: ее можно присваивать
+    внешним ключам и изменять, не затрагивая снимок.
+    Если строки нет, выбрасывается model.DoesNotExist
+    """
+    try:
+        return copy.copy(get_table(model).by_name[name])
+    except KeyError:
+        raise model.DoesNotExist(f"{model._meta.object_name} с названием '{name}' не найден")
+
+
+def get_id(model, name):
+    """id строки справочника по названию (model.DoesNotExist, если строки нет)"""
+    try:
+        return get_table(model).by_name[name].pk
+    except KeyError:
+        raise model.DoesNotExist(f"{model._meta.object_name} с названием '{name}' не найден")
+
+
+def find(model, name):
+    """Строка справочника по названию или None"""
+    row = get_table(model).by_name.get(name)
+    return copy.copy(row) if row is not None else None
+
+
+def lookup_models():
+    """Классы справочных моделей из LOOKUP_MODELS"""
+    return [apps.get_model(label) for label in LOOKUP_MODELS]
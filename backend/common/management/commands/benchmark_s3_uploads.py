@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import statistics
+import threading
+import time
+
+from botocore.config import Config
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+
+from backend.storage_backends import S3Storage, build_s3_client
+
+
+class LocalS3Handler(BaseHTTPRequestHandler):
+    """Минимальная имитация S3: HEAD отвечает 404, PUT принимает объект"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('ETag', '"benchmark"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет число загрузок в S3 в секунду: отдельный клиент на каждый файл '
+        '(прежнее поведение) против общего клиента с пулом соединений'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=200, help='Количество загрузок в каждом режиме')
+        parser.add_argument('--size', type=int, default=64 * 1024, help='Размер файла, байт')
+        parser.add_argument('--threads', type=int, default=8, help='Количество параллельных потоков')
+        parser.add_argument(
+            '--local', action='store_true',
+            help='Загружать на встроенный локальный HTTP-сервер, имитирующий S3, а не в бакет'
+        )
+
+    def handle(self, *args, **options):
+        server = None
+        client_options = {}
+        if options['local']:
+            server = ThreadingHTTPServer(('127.0.0.1', 0), LocalS3Handler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            client_options = {
+                'endpoint_url': f'http://127.0.0.1:{server.server_address[1]}',
+                'aws_access_key_id': 'benchmark',
+                'aws_secret_access_key': 'benchmark',
+                'region_name': 'us-east-1',
+            }
+            self.stdout.write(f"Локальный сервер S3: {client_options['endpoint_url']}")
+
+        try:
+            def legacy_client():
+                # Как раньше: новый клиент со стандартной конфигурацией на каждый файл
+                return build_s3_client(config=Config(s3={'addressing_style': 'path'}), **client_options)
+
+            shared = build_s3_client(**client_options)
+
+            before = self._run('Клиент на каждый файл', legacy_client, options)
+            after = self._run('Общий клиент', lambda: shared, options)
+            self.stdout.write(self.style.SUCCESS(f'Ускорение: x{after / before:.2f}'))
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    def _run(self, label, get_client, options):
+        size = options['size']
+        latencies = []
+
+        def upload(_):
+            payload = os.urandom(size)
+            started = time.perf_counter()
+            storage = S3Storage(client=get_client())
+            storage.upload(ContentFile(payload, name='benchmark.bin'), folder=f'{settings.MEDIA_LOCATION}/benchmark')
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            list(executor.map(upload, range(options['files'])))
+        elapsed = time.perf_counter() - started
+
+        rate = options['files'] / elapsed
+        self.stdout.write(
+            f'{label}: {rate:.1f} загрузок/с, '
+            f'p50={statistics.median(latencies):.1f} мс, '
+            f'p95={sorted(latencies)[int(0.95 * (len(latencies) - 1))]:.1f} мс'
+        )
+        return rate
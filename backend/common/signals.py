@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+
+from .lookups import LOOKUP_MODELS, schedule_invalidation
+
+
+def invalidate_lookup_table(sender, **kwargs):
+    """
+    Меняет версию справочника после фиксации; до нее текущая транзакция
+    видит изменения в собственном снимке
+    """
+    schedule_invalidation(sender)
+
+
+for label in LOOKUP_MODELS:
+    post_save.connect(invalidate_lookup_table, sender=label, dispatch_uid=f'lookups:{label}:save')
+    post_delete.connect(invalidate_lookup_table, sender=label, dispatch_uid=f'lookups:{label}:delete')
@@ -1,3 +1,165 @@
-from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from categories.models import Category
+from items.models import Item, ItemCondition, ItemStatus
+from trades.models import TradeStatus
+from . import lookups
+from .checks import check_shared_cache_for_deploy, check_shared_cache_for_workers
+
+User = get_user_model()
+
+
+@override_settings(REQUEST_INSTRUMENTATION_SAMPLE_RATE=0, REQUEST_INSTRUMENTATION_ALLOW_HEADER=True)
+class RequestInstrumentationTest(APITestCase):
+    """Тесты инструментирования запросов"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='timing', email='timing@test.com', password='testpass123', is_staff=True
+        )
+        category = Category.objects.create(name='Книги', slug='books')
+        condition, _ = ItemCondition.objects.get_or_create(name='Новый')
+        item_status, _ = ItemStatus.objects.get_or_create(name='Доступен')
+        for i in range(3):
+            Item.objects.create(
+                owner=self.user, title=f'Книга {i}', description='Описание',
+                category=category, condition=condition, status=item_status
+            )
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        self.url = reverse('item-list')
+
+    def test_server_timing_on_request(self):
+        """По заголовку X-Request-Timing ответ содержит метрики запросов и этапов"""
+        with self.assertLogs('common.instrumentation', level='INFO') as logs:
+            response = self.client.get(self.url, {'search': 'книга'}, HTTP_X_REQUEST_TIMING='1')
+
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'db;dur=', 'serialize;dur=', 'paginate;dur=',
+                       'filter.ItemFilter;dur=', 'filter.ItemSearchFilter;dur='):
+            self.assertIn(metric, timing)
+        self.assertIn('"queries":', logs.output[0])
+
+    def test_disabled_by_default(self):
+        """Без заголовка и выборки метрики не собираются"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_header_requires_staff_or_secret(self):
+        """Заголовок принимается от сотрудника или с общим секретом"""
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(self.url, HTTP_X_REQUEST_TIMING='1')
+        self.assertNotIn('Server-Timing', response)
+
+        with override_settings(REQUEST_INSTRUMENTATION_HEADER_SECRET='s3cret'):
+            response = self.client.get(self.url, HTTP_X_REQUEST_TIMING='1')
+            self.assertNotIn('Server-Timing', response)
+            response = self.client.get(self.url, HTTP_X_REQUEST_TIMING='s3cret')
+            self.assertIn('Server-Timing', response)
+
+    @override_settings(REQUEST_INSTRUMENTATION_SAMPLE_RATE=1)
+    def test_sampled_request_only_logs(self):
+        """Запрос из выборки пишется в лог, но анонимный клиент не получает Server-Timing"""
+        self.client.credentials()
+        with self.assertLogs('common.instrumentation', level='INFO') as logs:
+            response = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+        self.assertIn('"reason": "sample"', logs.output[0])
+
+    def test_list_does_not_run_diagnostic_counts(self):
+        """Список с курсорной пагинацией не выполняет COUNT-запросов"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql'].upper()])
+
+
+class LookupRegistryTest(TestCase):
+    """Тесты справочников в памяти процесса"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pending, _ = TradeStatus.objects.get_or_create(name='pending')
+
+    def test_lookup_without_queries(self):
+        """После загрузки справочник отдает строки по названию без запросов"""
+        lookups.get_table(TradeStatus)
+        with self.assertNumQueries(0):
+            self.assertEqual(lookups.get_id(TradeStatus, 'pending'), self.pending.id)
+            self.assertEqual(lookups.get(TradeStatus, 'pending').name, 'pending')
+            self.assertIsNone(lookups.find(TradeStatus, 'missing'))
+        with self.assertRaises(TradeStatus.DoesNotExist):
+            lookups.get(TradeStatus, 'missing')
+
+    def test_invalidated_on_write(self):
+        """После фиксации записи в справочник снимок перезагружается"""
+        table = lookups.get_table(TradeStatus)
+        with self.captureOnCommitCallbacks(execute=True):
+            created = TradeStatus.objects.create(name='archived')
+        self.assertIsNot(lookups.get_table(TradeStatus), table)
+        with self.assertNumQueries(0):
+            self.assertEqual(lookups.get_id(TradeStatus, 'archived'), created.id)
+
+    def test_reloaded_when_other_process_swaps_version(self):
+        """Смена метки версии другим процессом перезагружает снимок этого процесса"""
+        with self.captureOnCommitCallbacks(execute=True):
+            created = TradeStatus.objects.create(name='archived')
+        table = lookups.get_table(TradeStatus)
+        self.assertIs(lookups.get_table(TradeStatus), table)
+
+        # Другой процесс изменил таблицу без сигналов этого процесса: ему
+        # доступна только метка версии в общем кэше
+        TradeStatus.objects.filter(pk=created.pk).update(name='hidden')
+        with self.assertNumQueries(0):
+            self.assertIsNone(lookups.find(TradeStatus, 'hidden'))
+        cache.set(lookups._version_key(TradeStatus), 'other-process', timeout=None)
+
+        self.assertEqual(lookups.get_id(TradeStatus, 'hidden'), created.id)
+        self.assertEqual(lookups.get_table(TradeStatus).version, 'other-process')
+
+    def test_rolled_back_write_not_published(self):
+        """Транзакция видит свою запись, а после отката снимок ее не содержит"""
+        table = lookups.get_table(TradeStatus)
+        try:
+            with transaction.atomic():
+                TradeStatus.objects.create(name='archived')
+                self.assertIsNotNone(lookups.find(TradeStatus, 'archived'))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        with self.assertNumQueries(0):
+            self.assertIs(lookups.get_table(TradeStatus), table)
+            self.assertIsNone(lookups.find(TradeStatus, 'archived'))
+
+
+class SharedCacheCheckTest(TestCase):
+    """Тесты проверок общего кэша"""
+
+    @override_settings(DEBUG=False, ASGI_WORKERS=1)
+    def test_local_cache_rejected_on_deploy(self):
+        """LocMemCache допустим только при разработке"""
+        self.assertEqual([e.id for e in check_shared_cache_for_deploy(None)], ['common.E001'])
+        with override_settings(DEBUG=True):
+            self.assertEqual(check_shared_cache_for_deploy(None), [])
+
+    @override_settings(ASGI_WORKERS=4)
+    def test_local_cache_rejected_for_workers(self):
+        """LocMemCache не общий для нескольких процессов ASGI-сервера"""
+        self.assertEqual([e.id for e in check_shared_cache_for_workers(None)], ['common.E002'])
+        with override_settings(ASGI_WORKERS=1):
+            self.assertEqual(check_shared_cache_for_workers(None), [])
@@ -0,0 +1,56 @@
+"""
+Смена меток версий снимков в памяти процесса после фиксации транзакции.
+
+Снимки (categories.tree, common.lookups) публикуются в памяти процесса под
+меткой версии из общего кэша. Метка меняется только после фиксации
+транзакции, изменившей данные снимка, поэтому другие воркеры не увидят
+незафиксированных изменений. Сама транзакция до фиксации видит их в снимке,
+который строится только для нее и не публикуется: после отката в процессе
+не остается снимка с отмененными изменениями.
+
+    schedule_version_bump('categories:tree', invalidate_category_tree)
+    if has_uncommitted_writes('categories:tree'):
+        ...  # строим снимок без публикации
+"""
+import threading
+
+from django.db import transaction
+
+_local = threading.local()
+
+
+class _VersionBump:
+    """Отложенная смена метки версии: callback для transaction.on_commit"""
+
+    def __init__(self, key, invalidate):
+        self.key = key
+        self.invalidate = invalidate
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        self.invalidate()
+
+
+def schedule_version_bump(key, invalidate):
+    """
+    Вызывает invalidate() после фиксации текущей транзакции (вне транзакции - сразу).
+    До фиксации has_uncommitted_writes(key) в этом потоке возвращает True
+    """
+    bump = _VersionBump(key, invalidate)
+    if transaction.get_connection().in_atomic_block:
+        if not hasattr(_local, 'bumps'):
+            _local.bumps = []
+        _local.bumps.append(bump)
+    transaction.on_commit(bump)
+
+
+def has_uncommitted_writes(key):
+    """Есть ли в текущей транзакции этого потока незафиксированные изменения снимка key"""
+    bumps = getattr(_local, 'bumps', None)
+    if not bumps:
+        return False
+    # Выполненные после фиксации и отброшенные при откате смены больше не учитываются
+    queued = [callback for _, callback, _ in transaction.get_connection().run_on_commit]
+    _local.bumps = [bump for bump in bumps if not bump.done and any(bump is callback for callback in queued)]
+    return any(bump.key == key for bump in _local.bumps)
@@ -0,0 +1,274 @@
+"""
+Отложенная запись счетчиков предметов (views_count, favorites_count).
+
+Приращения копятся в кэше Django, а не пишутся в строку предмета на каждый запрос:
+популярные предметы перестают быть точкой конкуренции за блокировку строки.
+Накопленные дельты периодически сбрасываются в БД пакетными UPDATE ... CASE
+фоновым потоком процесса и/или командой flush_item_counters.
+
+Чтобы счетчики были общими для нескольких процессов, в CACHES должен быть настроен
+разделяемый кэш с атомарным incr, допускающим отрицательные значения (Redis по REDIS_URL).
+С LocMemCache (только при разработке) буфер локален для процесса, его сбрасывает поток
+этого процесса, а команда flush_item_counters завершается ошибкой.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('views_count', 'favorites_count')
+
+KEY_PREFIX = 'items:counters'
+DIRTY_KEY = f'{KEY_PREFIX}:dirty'
+LOCK_KEY = f'{KEY_PREFIX}:lock'
+
+# Сколько ждать блокировку множества измененных предметов, секунд
+LOCK_WAIT = 2.0
+LOCK_TIMEOUT = 10
+
+# Количество предметов в одном UPDATE ... CASE
+FLUSH_BATCH_SIZE = 500
+
+
+def _delta_key(item_id, field):
+    return f'{KEY_PREFIX}:{field}:{item_id}'
+
+
+def _view_key(item_id, user_id):
+    return f'{KEY_PREFIX}:viewed:{item_id}:{user_id}'
+
+
+class ItemCounterService:
+    """
+    Сервис счетчиков предметов с отложенной записью.
+
+    Инвариант: предмет попадает в множество измененных, когда его дельта
+    отходит от нуля. Сброс вычитает из дельты ровно записанное значение и,
+    если за это время пришли новые приращения, снова помечает предмет измененным.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._thread_pid = None
+        self._thread_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    # ------------------------------------------------------------------ запись
+
+    def record_view(self, item_id, user_id):
+        """
+        Учитывает просмотр предмета. Повторные просмотры того же пользователя
+        в пределах ITEM_VIEW_DEDUPE_WINDOW не учитываются.
+        Возвращает True, если просмотр засчитан
+        """
+        window = getattr(settings, 'ITEM_VIEW_DEDUPE_WINDOW', 0)
+        if window and user_id is not None and not cache.add(_view_key(item_id, user_id), 1, window):
+            return False
+        self.increment(item_id, 'views_count')
+        return True
+
+    def record_favorite(self, item_id, added):
+        """Учитывает добавление (added=True) или удаление предмета из избранного"""
+        self.increment(item_id, 'favorites_count', 1 if added else -1)
+
+    def increment(self, item_id, field, delta=1):
+        """Добавляет приращение счетчика в буфер или сразу в БД, если буфер отключен"""
+        if field not in COUNTER_FIELDS:
+            raise ValueError(f'Неизвестный счетчик: {field}')
+
+        if not getattr(settings, 'ITEM_COUNTERS_WRITE_BEHIND', True):
+            self._write({field: {item_id: delta}})
+            return
+
+        key = _delta_key(item_id, field)
+        if cache.add(key, delta, timeout=None):
+            value = delta
+        else:
+            try:
+                value = cache.incr(key, delta)
+            except ValueError:
+                # Ключ вытеснен между add и incr
+                cache.add(key, 0, timeout=None)
+                value = cache.incr(key, delta)
+
+        # Дельта только что отошла от нуля - предмет нужно сбросить
+        if value == delta and not self._mark_dirty([item_id]):
+            # Не удалось отметить предмет: пишем приращение напрямую, чтобы не потерять его
+            cache.incr(key, -delta)
+            self._write({field: {item_id: delta}})
+
+        self._ensure_flusher()
+
+    # ------------------------------------------------------------------ чтение
+
+    def pending(self, item_ids):
+        """Возвращает несброшенные дельты {item_id: {field: delta}}"""
+        item_ids = list(item_ids)
+        keys = {_delta_key(item_id, field): (item_id, field)
+                for item_id in item_ids for field in COUNTER_FIELDS}
+        result = {item_id: dict.fromkeys(COUNTER_FIELDS, 0) for item_id in item_ids}
+        for key, value in cache.get_many(list(keys)).items():
+            item_id, field = keys[key]
+            result[item_id][field] = value or 0
+        return result
+
+    def apply_pending(self, items):
+        """Добавляет несброшенные дельты к счетчикам загруженных предметов"""
+        items = list(items)
+        if not items:
+            return items
+        pending = self.pending(item.pk for item in items)
+        for item in items:
+            for field, delta in pending[item.pk].items():
+                if delta:
+                    setattr(item, field, max(getattr(item, field) + delta, 0))
+        return items
+
+    # ------------------------------------------------------------------ сброс
+
+    def flush(self):
+        """
+        Сбрасывает накопленные дельты в БД.
+        Возвращает количество обновленных предметов
+        """
+        item_ids = self._take_dirty()
+        if not item_ids:
+            return 0
+
+        keys = {_delta_key(item_id, field): (item_id, field)
+                for item_id in item_ids for field in COUNTER_FIELDS}
+        updates = {field: {} for field in COUNTER_FIELDS}
+        redirty = set()
+
+        for key, value in cache.get_many(list(keys)).items():
+            if not value:
+                continue
+            item_id, field = keys[key]
+            # Вычитаем ровно то, что запишем: приращения, пришедшие после чтения, сохранятся
+            if cache.incr(key, -value):
+                redirty.add(item_id)
+            updates[field][item_id] = value
+
+        if redirty:
+            self._mark_dirty(redirty)
+
+        try:
+            self._write(updates)
+        except Exception:
+            logger.exception("Ошибка записи счетчиков предметов, дельты возвращены в буфер")
+            for field, deltas in updates.items():
+                for item_id, delta in deltas.items():
+                    self.increment(item_id, field, delta)
+            raise
+
+        flushed = {item_id for deltas in updates.values() for item_id in deltas}
+        logger.info(f"Сброшены счетчики предметов: {len(flushed)} предметов")
+        return len(flushed)
+
+    def _write(self, updates):
+        """Пишет дельты в БД: один UPDATE ... CASE на поле и пакет предметов"""
+        from .models import Item
+
+        with transaction.atomic():
+            for field, deltas in updates.items():
+                item_ids = sorted(deltas)
+                for start in range(0, len(item_ids), FLUSH_BATCH_SIZE):
+                    batch = item_ids[start:start + FLUSH_BATCH_SIZE]
+                    delta = Case(
+                        *[When(pk=item_id, then=Value(deltas[item_id])) for item_id in batch],
+                        default=Value(0), output_field=IntegerField()
+                    )
+                    # Queryset.update не вызывает сигналы, поисковый индекс не переиндексируется
+                    Item.objects.filter(pk__in=batch).update(**{field: Greatest(F(field) + delta, Value(0))})
+
+    # ------------------------------------------------------------------ множество измененных
+
+    def _mark_dirty(self, item_ids):
+        token = self._acquire()
+        if token is None:
+            logger.warning("Не удалось получить блокировку счетчиков предметов")
+            return False
+        try:
+            dirty = cache.get(DIRTY_KEY) or set()
+            dirty.update(item_ids)
+            cache.set(DIRTY_KEY, dirty, timeout=None)
+        finally:
+            self._release(token)
+        return True
+
+    def _take_dirty(self):
+        token = self._acquire()
+        if token is None:
+            logger.warning("Не удалось получить блокировку счетчиков предметов для сброса")
+            return set()
+        try:
+            dirty = cache.get(DIRTY_KEY) or set()
+            cache.delete(DIRTY_KEY)
+        finally:
+            self._release(token)
+        return dirty
+
+    def _acquire(self):
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + LOCK_WAIT
+        while not cache.add(LOCK_KEY, token, LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.001)
+        return token
+
+    def _release(self, token):
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+    # ------------------------------------------------------------------ фоновый сброс
+
+    def _ensure_flusher(self):
+        """Запускает поток периодического сброса в текущем процессе"""
+        interval = getattr(settings, 'ITEM_COUNTERS_FLUSH_INTERVAL', None)
+        if not interval or self._thread_pid == os.getpid():
+            return
+        with self._thread_lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(interval,), name='item-counters-flusher', daemon=True
+            )
+            self._thread_pid = os.getpid()
+            self._thread.start()
+            logger.info(f"Запущен фоновый сброс счетчиков предметов, интервал {interval} с")
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ошибка фонового сброса счетчиков предметов")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        """Останавливает фоновый поток и сбрасывает остаток"""
+        self._stop.set()
+        if self._thread_pid == os.getpid() and self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread_pid = None
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ошибка сброса счетчиков предметов при остановке")
+
+
+item_counters = ItemCounterService()
+atexit.register(item_counters.stop)
@@ -1,5 +1,7 @@
 import django_filters
+from rest_framework import filters
 from .models import Item, Favorite
+from .search import get_search_backend
 from django.db.models import Q
 import logging
 
@@ -23,28 +25,22 @@ class ItemFilter(django_filters.FilterSet):
     def __init__(self, *args, **kwargs):
         self.request = kwargs.pop('request', None)
         super().__init__(*args, **kwargs)
-        logger.info(f"=== ItemFilter INIT ===")
-        logger.info(f"Filter data: {self.data}")
-        logger.info(f"Request user: {getattr(self.request, 'user', 'No request')}")
     
     @property
     def qs(self):
         """
-        Переопределяем свойство qs для логирования
+        Переопределяем свойство qs для логирования примененных фильтров.
+        Количество и время запросов собирает common.instrumentation
         """
-        logger.info(f"=== ItemFilter QS ===")
-        logger.info(f"Filter form data: {self.form.data}")
-        logger.info(f"Filter form is_valid: {self.form.is_valid()}")
         if not self.form.is_valid():
             logger.warning(f"Filter form errors: {self.form.errors}")
         
         queryset = super().qs
-        logger.info(f"Filtered queryset count: {queryset.count()}")
         
         # Логируем применяемые фильтры
         for field_name, field_value in self.form.cleaned_data.items():
             if field_value is not None and field_value != '':
-                logger.info(f"Applied filter: {field_name} = {field_value}")
+                logger.debug(f"Applied filter: {field_name} = {field_value}")
         
         return queryset
     
@@ -52,23 +48,17 @@ class ItemFilter(django_filters.FilterSet):
         """
         Фильтр по категории и всем её подкатегориям
         """
-        # Находим все идентификаторы подкатегорий (рекурсивно)
-        from categories.models import Category
+        # Категория и все её подкатегории берутся из снимка дерева категорий без запросов к БД
+        from categories.tree import get_category_tree
+        tree = get_category_tree()
         try:
-            category = Category.objects.get(id=value)
-            subcategories = Category.objects.filter(parent=category)
-            category_ids = [category.id]
-            
-            while subcategories:
-                new_subcategories = []
-                for subcat in subcategories:
-                    category_ids.append(subcat.id)
-                    new_subcategories.extend(Category.objects.filter(parent=subcat))
-                subcategories = new_subcategories
-            
-            return queryset.filter(category_id__in=category_ids)
-        except Category.DoesNotExist:
+            node = tree.get(int(value))
+        except (TypeError, ValueError):
+            node = None
+        if node is None:
             return queryset.none()
+        
+        return queryset.filter(category_id__in=tree.descendant_ids(node))
     
     def filter_tags(self, queryset, name, value):
         """
@@ -102,4 +92,38 @@ class ItemFilter(django_filters.FilterSet):
         fields = [
             'title', 'category', 'condition', 'status', 
             'owner', 'min_value', 'max_value', 'is_favorite'
-        ] 
\ No newline at end of file
+        ]
+
+
+class ItemSearchFilter(filters.SearchFilter):
+    """
+    Полнотекстовый поиск по предметам через поисковый индекс.
+
+    Совпадения с индексом ищутся в том же запросе, что и остальные фильтры,
+    и queryset получает аннотацию search_rank (меньше - релевантнее). Если
+    СУБД не поддерживает индекс, используется стандартный icontains-поиск DRF.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+
+        backend = get_search_backend()
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        logger.info(f"Полнотекстовый поиск: query='{query}'")
+        return backend.match_queryset(queryset, query)
+
+
+class RankedOrderingFilter(filters.OrderingFilter):
+    """
+    Сортировка с учетом релевантности поиска: если сортировка не задана явно,
+    а queryset содержит search_rank, результаты упорядочиваются по релевантности
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if 'search_rank' in queryset.query.annotations and not request.query_params.get(self.ordering_param):
+            return queryset.order_by('search_rank', '-created_at')
+        return super().filter_queryset(request, queryset, view)
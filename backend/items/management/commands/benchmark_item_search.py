@@ -0,0 +1,148 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from categories.models import Category
+from items.filters import ItemSearchFilter
+from items.models import Item, ItemCondition, ItemStatus, ItemTag, ItemTagRelation
+from items.search import get_search_backend, iter_documents
+
+User = get_user_model()
+
+WORDS = [
+    'книга', 'книги', 'учебник', 'велосипед', 'самокат', 'телефон', 'смартфон',
+    'ноутбук', 'куртка', 'зимняя', 'детская', 'коляска', 'игрушка', 'конструктор',
+    'гитара', 'акустическая', 'электрическая', 'стол', 'стул', 'кресло', 'лампа',
+    'настольная', 'палатка', 'туристическая', 'рюкзак', 'кроссовки', 'ботинки',
+    'кожаные', 'новый', 'новая', 'почти', 'отличном', 'состоянии', 'подарок',
+    'коллекция', 'марки', 'монеты', 'пластинки', 'виниловые', 'фотоаппарат',
+    'объектив', 'зеркальный', 'планшет', 'наушники', 'беспроводные', 'часы',
+    'наручные', 'сумка', 'чемодан', 'коньки', 'лыжи', 'сноуборд', 'ролики',
+    'мяч', 'футбольный', 'баскетбольный', 'посуда', 'сервиз', 'чайник', 'утюг',
+    'пылесос', 'микроволновка', 'холодильник', 'машинка', 'швейная', 'пазл',
+]
+
+SYLLABLES = [
+    'ка', 'ро', 'ми', 'ло', 'ве', 'ста', 'ни', 'ко', 'ра', 'те', 'до', 'лу',
+    'за', 'по', 'ше', 'ри', 'на', 'ту', 'бо', 'ги', 'све', 'тра', 'мо', 'ны',
+]
+
+QUERIES = [
+    'книга', 'велосипед детский', 'kniga', 'гитара', 'зимние куртки', 'ноутбук',
+    'наушники беспроводные', 'fotoapparat', 'кожаная сумка', 'настольные лампы',
+    'самокаты', 'plastinki', 'коньки', 'сервиз', 'туристические палатки',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку полнотекстового поиска предметов на синтетическом каталоге. '
+        'Все созданные данные откатываются по завершении.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000, help='Размер синтетического каталога')
+        parser.add_argument('--queries', type=int, default=300, help='Количество поисковых запросов')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--compare', action='store_true',
+            help='Дополнительно замерить прежний icontains-поиск'
+        )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if backend is None:
+            raise CommandError('Текущая СУБД не поддерживает поисковый индекс')
+
+        rng = random.Random(options['seed'])
+
+        with transaction.atomic():
+            self._populate(backend, options['items'], rng)
+
+            queries = [rng.choice(QUERIES) for _ in range(options['queries'])]
+            self._report('Индекс', [self._timed(self._indexed_search, query) for query in queries])
+            if options['compare']:
+                self._report('icontains', [self._timed(self._icontains_search, query) for query in queries])
+
+            transaction.set_rollback(True)
+
+    def _populate(self, backend, count, rng):
+        self.stdout.write(f'Создаем {count} синтетических предметов...')
+        started = time.perf_counter()
+
+        owner = User.objects.create_user(username='search-benchmark', password=None)
+        category = Category.objects.create(name='Бенчмарк поиска', slug='search-benchmark')
+        condition = ItemCondition.objects.order_by('id').first() or ItemCondition.objects.create(name='Бенчмарк')
+        status = ItemStatus.objects.order_by('id').first() or ItemStatus.objects.create(name='Бенчмарк')
+        tags = ItemTag.objects.bulk_create(
+            [ItemTag(name=f'бенчмарк {word}', slug=f'benchmark-{i}') for i, word in enumerate(WORDS)]
+        )
+
+        # Словарь каталога: реальные слова и несколько тысяч псевдослов
+        # с распределением частот по закону Ципфа
+        vocabulary = sorted({
+            ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(5000)
+        })
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+        def words(k):
+            return rng.choices(vocabulary, weights=weights, k=k)
+
+        for start in range(0, count, 5000):
+            size = min(5000, count - start)
+            items = Item.objects.bulk_create([
+                Item(
+                    title=' '.join([rng.choice(WORDS)] + words(2)).capitalize(),
+                    slug=f'search-benchmark-{start + i}',
+                    description=' '.join(words(20) + rng.sample(WORDS, 2)),
+                    owner=owner, category=category, condition=condition, status=status,
+                )
+                for i in range(size)
+            ])
+            ItemTagRelation.objects.bulk_create([
+                ItemTagRelation(item=item, tag=tag)
+                for item in items
+                for tag in rng.sample(tags, 2)
+            ])
+            backend.index_documents(iter_documents(Item, ItemTagRelation, [item.id for item in items]))
+
+        self.stdout.write(f'Каталог подготовлен за {time.perf_counter() - started:.1f} с')
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        func(*args)
+        return (time.perf_counter() - started) * 1000
+
+    def _indexed_search(self, query):
+        request = type('Request', (), {'query_params': {'search': query}})()
+        queryset = ItemSearchFilter().filter_queryset(request, Item.objects.filter(is_deleted=False), None)
+        if 'search_rank' not in queryset.query.annotations:
+            return []
+        return list(queryset.order_by('search_rank')[:20])
+
+    def _icontains_search(self, query):
+        condition = Q()
+        for term in query.split():
+            condition &= (
+                Q(title__icontains=term)
+                | Q(description__icontains=term)
+                | Q(tag_relations__tag__name__icontains=term)
+            )
+        return list(Item.objects.filter(is_deleted=False).filter(condition).distinct()[:20])
+
+    def _report(self, label, timings):
+        timings = sorted(timings)
+
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(round(p / 100 * (len(timings) - 1))))]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: запросов={len(timings)}, '
+            f'p50={percentile(50):.2f} мс, p95={percentile(95):.2f} мс, '
+            f'p99={percentile(99):.2f} мс, среднее={statistics.mean(timings):.2f} мс'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from common.cache import is_process_local
+from items.counters import item_counters
+
+
+class Command(BaseCommand):
+    help = 'Сбрасывает накопленные счетчики просмотров и избранного предметов в БД'
+
+    def handle(self, *args, **options):
+        if is_process_local():
+            # Буфер LocMemCache принадлежит процессам сервера: команда увидела бы пустой кэш
+            raise CommandError(
+                'Кэш LocMemCache локален для процесса, счетчики сбрасывает поток сервера. '
+                'Задайте REDIS_URL, чтобы сбрасывать их командой'
+            )
+        flushed = item_counters.flush()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено предметов: {flushed}'))
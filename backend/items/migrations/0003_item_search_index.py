@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Создает поисковый индекс для текущей СУБД и заполняет его существующими предметами
+    """
+    from items.search import get_search_backend, iter_documents
+
+    backend = get_search_backend(schema_editor.connection)
+    if backend is None:
+        return
+
+    backend.create_index()
+
+    Item = apps.get_model('items', 'Item')
+    ItemTagRelation = apps.get_model('items', 'ItemTagRelation')
+    batch = []
+    for document in iter_documents(Item, ItemTagRelation):
+        batch.append(document)
+        if len(batch) >= 1000:
+            backend.index_documents(batch)
+            batch = []
+    backend.index_documents(batch)
+
+
+def drop_search_index(apps, schema_editor):
+    from items.search import get_search_backend
+
+    backend = get_search_backend(schema_editor.connection)
+    if backend is not None:
+        backend.drop_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0002_add_initial_statuses_and_conditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categories', '0002_alter_category_icon_alter_category_is_active_and_more'),
+        ('items', '0003_item_search_index'),
+        ('profiles', '0002_alter_location_latitude_alter_location_longitude_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['created_at', 'id'], name='item_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['updated_at', 'id'], name='item_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['views_count', 'id'], name='item_views_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['favorites_count', 'id'], name='item_favorites_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0004_item_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemimage',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict, help_text='Уменьшенные копии изображения по размерам IMAGE_SIZES', verbose_name='Производные изображения'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from django.utils.text import slugify
@@ -165,6 +166,11 @@ class Item(TimeStampedModel, SoftDeleteModel):
             models.Index(fields=['status'], name='item_status_idx'),
             models.Index(fields=['owner'], name='item_owner_idx'),
             models.Index(fields=['created_at'], name='item_created_idx'),
+            # Составные индексы для курсорной пагинации по (поле сортировки, id)
+            models.Index(fields=['created_at', 'id'], name='item_created_id_idx', condition=Q(is_deleted=False)),
+            models.Index(fields=['updated_at', 'id'], name='item_updated_id_idx', condition=Q(is_deleted=False)),
+            models.Index(fields=['views_count', 'id'], name='item_views_id_idx', condition=Q(is_deleted=False)),
+            models.Index(fields=['favorites_count', 'id'], name='item_favorites_id_idx', condition=Q(is_deleted=False)),
         ]
 
     def __str__(self):
@@ -210,6 +216,12 @@ class ItemImage(TimeStampedModel):
         default=0,
         help_text=_("Порядок отображения изображения")
     )
+    derivatives = models.JSONField(
+        _("Производные изображения"),
+        default=dict,
+        blank=True,
+        help_text=_("Уменьшенные копии изображения по размерам IMAGE_SIZES")
+    )
     
     class Meta:
         db_table = 'item_images'
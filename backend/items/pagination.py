@@ -0,0 +1,174 @@
+from collections import OrderedDict
+from datetime import datetime
+import logging
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+logger = logging.getLogger(__name__)
+
+
+class ItemPagination(PageNumberPagination):
+    """Постраничная пагинация для списка предметов"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ItemCursorPagination(BasePagination):
+    """
+    Keyset-пагинация для бесконечной прокрутки списка предметов.
+
+    Включается параметром ?pagination=cursor (или наличием ?cursor=...).
+    Страница выбирается условием по паре (поле сортировки, id), а не OFFSET,
+    поэтому стоимость запроса не зависит от глубины страницы. Общее количество
+    не считается. Курсор - подписанный непрозрачный токен, привязанный к сортировке.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    mode_value = 'cursor'
+    default_ordering = '-created_at'
+    # Поля, по которым допускается keyset-пагинация, помимо ordering_fields представления
+    extra_ordering_fields = ('search_rank',)
+    signing_salt = 'items.pagination.cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    @classmethod
+    def is_requested(cls, request):
+        """Проверяет, запрошен ли курсорный режим пагинации"""
+        params = request.query_params
+        return cls.cursor_query_param in params or params.get(cls.mode_query_param) == cls.mode_value
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = remove_query_param(request.build_absolute_uri(), 'page')
+        self.ordering = self.get_ordering(queryset, view)
+        self.field = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+        page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request, queryset.model)
+        backwards = bool(cursor and cursor['previous'])
+        if backwards:
+            descending = not descending
+
+        if cursor is not None:
+            queryset = queryset.filter(self._after(descending, cursor['value'], cursor['id']))
+
+        direction = '-' if descending else ''
+        results = list(queryset.order_by(f'{direction}{self.field}', f'{direction}id')[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+
+        if backwards:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.page = results
+        logger.debug(f"Курсорная пагинация: ordering={self.ordering}, backwards={backwards}, получено {len(results)}")
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset, view):
+        """
+        Определяет поле сортировки по уже упорядоченному queryset
+        (OrderingFilter/RankedOrderingFilter). Учитывается только первое поле,
+        порядок при равных значениях задается id
+        """
+        allowed = set(getattr(view, 'ordering_fields', None) or ()) | set(self.extra_ordering_fields)
+        order_by = queryset.query.order_by
+        if order_by and isinstance(order_by[0], str) and order_by[0].lstrip('-') in allowed:
+            return order_by[0]
+        return self.default_ordering
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], previous=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self.page[0], previous=True)
+
+    def encode_cursor(self, item, previous):
+        value = getattr(item, self.field)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        return signing.dumps(
+            {'o': self.ordering, 'v': value, 'i': item.pk, 'p': previous},
+            salt=self.signing_salt, compress=True
+        )
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+
+        try:
+            payload = signing.loads(token, salt=self.signing_salt)
+            if payload['o'] != self.ordering:
+                raise ValueError('курсор создан для другой сортировки')
+            value = payload['v']
+            if self._is_datetime_field(model):
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError('некорректная дата')
+            return {'value': value, 'id': int(payload['i']), 'previous': bool(payload['p'])}
+        except (signing.BadSignature, KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Получен неверный курсор пагинации: {e}")
+            raise NotFound(self.invalid_cursor_message)
+
+    def _is_datetime_field(self, model):
+        try:
+            return model._meta.get_field(self.field).get_internal_type() == 'DateTimeField'
+        except FieldDoesNotExist:
+            return False
+
+    def _after(self, descending, value, pk):
+        """Условие «строго после позиции курсора» для пары (поле, id)"""
+        lookup = 'lt' if descending else 'gt'
+        return Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'id__{lookup}': pk})
+
+    def _link(self, item, previous):
+        url = remove_query_param(self.base_url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(item, previous))
@@ -0,0 +1,545 @@
+"""
+Полнотекстовый поиск по каталогу предметов.
+
+Вместо icontains-сканирования по title/description и JOIN с таблицей тегов
+используется инвертированный индекс:
+
+- SQLite: виртуальная таблица FTS5 (rowid = id предмета, ранжирование bm25);
+- PostgreSQL: таблица с колонкой tsvector и GIN-индексом (ранжирование ts_rank).
+
+Текст нормализуется на стороне Python одинаково для обеих СУБД: слова
+приводятся к основе русским стеммером (Snowball), а для каждой основы в
+индекс дополнительно пишется транслитерация по CYRILLIC_TO_LATIN. Благодаря
+этому запрос "kniga" находит предметы со словом "книги".
+"""
+import logging
+import re
+import threading
+
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import Expression
+from django.db.models.sql.constants import INNER, LOUTER
+
+from .serializers import CYRILLIC_TO_LATIN
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'item_search_index'
+
+# Веса полей при ранжировании: заголовок, описание, теги
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+TAGS_WEIGHT = 5.0
+
+_WORD_RE = re.compile(r'[^\W_]+', re.UNICODE)
+_CYRILLIC_RE = re.compile(r'[а-яё]')
+
+# Обратная транслитерация: сначала самые длинные сочетания
+_LATIN_TO_CYRILLIC = sorted(
+    (
+        (latin, cyrillic)
+        for cyrillic, latin in CYRILLIC_TO_LATIN.items()
+        if latin and cyrillic not in ('й', 'э')
+    ),
+    key=lambda pair: len(pair[0]),
+    reverse=True,
+)
+
+
+# --- Русский стеммер (алгоритм Snowball) ------------------------------------
+
+_VOWELS = 'аеиоуыэюя'
+
+_PERFECTIVE_GERUND = re.compile(
+    r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$'
+)
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = (
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|'
+    r'ую|юю|ая|яя|ою|ею)$'
+)
+_PARTICIPLE = r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))'
+_ADJECTIVAL = re.compile(_PARTICIPLE + r'?' + _ADJECTIVE)
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|'
+    r'ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)|'
+    r'((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|'
+    r'ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+_DERIVATIONAL = re.compile(r'(ост|ость)$')
+
+
+def _region_start(word, start=0):
+    """Начало региона R1/R2: позиция после первой согласной, следующей за гласной"""
+    for i in range(start + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+def stem_russian(word):
+    """
+    Возвращает основу русского слова по алгоритму Snowball
+    """
+    word = word.replace('ё', 'е')
+
+    rv_start = next((i + 1 for i, char in enumerate(word) if char in _VOWELS), None)
+    if rv_start is None:
+        return word
+
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1: деепричастие, иначе возвратная частица + прилагательное/глагол/существительное
+    stripped = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        stripped = _ADJECTIVAL.sub('', rv, 1)
+        if stripped == rv:
+            stripped = _VERB.sub('', rv, 1)
+            if stripped == rv:
+                stripped = _NOUN.sub('', rv, 1)
+    rv = stripped
+
+    # Шаг 2: окончание "и"
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс в регионе R2
+    r2_start = _region_start(word, _region_start(word))
+    match = _DERIVATIONAL.search(rv)
+    if match and len(prefix) + match.start() >= r2_start:
+        rv = rv[:match.start()]
+
+    # Шаг 4: превосходная степень, двойное "н", мягкий знак
+    stripped = _SUPERLATIVE.sub('', rv, 1)
+    if stripped != rv:
+        rv = stripped
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    elif rv.endswith('нн'):
+        rv = rv[:-1]
+    elif rv.endswith('ь'):
+        rv = rv[:-1]
+
+    return prefix + rv
+
+
+# --- Нормализация текста ----------------------------------------------------
+
+def transliterate(text):
+    """Транслитерация кириллицы в латиницу по CYRILLIC_TO_LATIN"""
+    return ''.join(CYRILLIC_TO_LATIN.get(char, char) for char in text)
+
+
+def detransliterate(text):
+    """Приблизительная обратная транслитерация латиницы в кириллицу"""
+    result = []
+    position = 0
+    while position < len(text):
+        for latin, cyrillic in _LATIN_TO_CYRILLIC:
+            if text.startswith(latin, position):
+                result.append(cyrillic)
+                position += len(latin)
+                break
+        else:
+            result.append(text[position])
+            position += 1
+    return ''.join(result)
+
+
+def tokenize(text):
+    """Разбивает текст на слова в нижнем регистре"""
+    if not text:
+        return []
+    return _WORD_RE.findall(text.lower())
+
+
+def analyze(text):
+    """
+    Преобразует текст в список терминов для индекса.
+
+    Для русских слов в индекс попадает основа и её транслитерация,
+    остальные слова индексируются как есть.
+    """
+    terms = []
+    for token in tokenize(text):
+        if _CYRILLIC_RE.search(token):
+            stem = stem_russian(token)
+            terms.append(stem)
+            terms.append(transliterate(stem))
+        else:
+            terms.append(token)
+    return terms
+
+
+def query_terms(text):
+    """
+    Разбирает поисковый запрос на группы альтернативных терминов.
+
+    Каждая группа соответствует одному слову запроса и ищется как префикс:
+    для кириллицы это основа и её транслитерация, для латиницы - само слово
+    и основа его обратной транслитерации.
+    """
+    groups = []
+    for token in tokenize(text):
+        if _CYRILLIC_RE.search(token):
+            stem = stem_russian(token)
+            alternatives = {stem, transliterate(stem)}
+        else:
+            alternatives = {token}
+            if token.isalpha():
+                alternatives.add(transliterate(stem_russian(detransliterate(token))))
+        alternatives = sorted(term for term in alternatives if term)
+        if alternatives:
+            groups.append(alternatives)
+    return groups
+
+
+def iter_documents(item_model, tag_relation_model, item_ids=None, batch_size=1000):
+    """
+    Генерирует документы индекса (id, title, description, tags) пачками.
+
+    Модели передаются явно, чтобы функцию можно было вызывать из миграций
+    с историческими моделями.
+    """
+    items = item_model.objects.order_by('id')
+    if item_ids is not None:
+        items = items.filter(id__in=list(item_ids))
+
+    last_id = 0
+    while True:
+        batch = list(
+            items.filter(id__gt=last_id).values_list('id', 'title', 'description')[:batch_size]
+        )
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+        tags = {}
+        relations = tag_relation_model.objects.filter(
+            item_id__in=[row[0] for row in batch]
+        ).values_list('item_id', 'tag__name')
+        for item_id, tag_name in relations:
+            tags.setdefault(item_id, []).append(tag_name)
+
+        for item_id, title, description in batch:
+            yield (
+                item_id,
+                ' '.join(analyze(title)),
+                ' '.join(analyze(description)),
+                ' '.join(analyze(' '.join(tags.get(item_id, [])))),
+            )
+
+
+# --- Совпадения в SQL-запросе каталога ---------------------------------------
+
+class SearchMatchJoin:
+    """
+    Соединение queryset с производной таблицей совпадений
+    (SELECT item_id, search_rank ... MATCH): полнотекстовый запрос выполняется
+    один раз, а фильтры, ранжирование и количество для пагинации считаются в
+    том же SQL-запросе. Совместим с элементами Query.alias_map
+    (см. django.db.models.sql.datastructures.Join)
+    """
+    table_name = 'item_search_match'
+    filtered_relation = None
+    nullable = False
+
+    def __init__(self, sql, params, parent_alias, parent_column, table_alias=None, join_type=INNER):
+        self.sql = sql
+        self.params = tuple(params)
+        self.parent_alias = parent_alias
+        self.parent_column = parent_column
+        self.table_alias = table_alias
+        self.join_type = join_type
+
+    def as_sql(self, compiler, connection):
+        qn = compiler.quote_name_unless_alias
+        alias = qn(self.table_alias)
+        parent = f'{qn(self.parent_alias)}.{connection.ops.quote_name(self.parent_column)}'
+        return f'{self.join_type} ({self.sql}) {alias} ON ({alias}.item_id = {parent})', self.params
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(
+            self.sql,
+            self.params,
+            change_map.get(self.parent_alias, self.parent_alias),
+            self.parent_column,
+            change_map.get(self.table_alias, self.table_alias),
+            self.join_type,
+        )
+
+    @property
+    def identity(self):
+        return self.__class__, self.sql, self.params, self.parent_alias, self.parent_column
+
+    def __eq__(self, other):
+        if not isinstance(other, SearchMatchJoin):
+            return NotImplemented
+        return self.identity == other.identity
+
+    def __hash__(self):
+        return hash(self.identity)
+
+    def demote(self):
+        new = self.relabeled_clone({})
+        new.join_type = INNER
+        return new
+
+    def promote(self):
+        new = self.relabeled_clone({})
+        new.join_type = LOUTER
+        return new
+
+
+class SearchRank(Expression):
+    """Колонка search_rank присоединенной таблицы совпадений (см. SearchMatchJoin)"""
+    output_field = FloatField()
+
+    def __init__(self, alias):
+        super().__init__()
+        self.alias = alias
+
+    def as_sql(self, compiler, connection):
+        return f'{compiler.quote_name_unless_alias(self.alias)}.search_rank', []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(change_map.get(self.alias, self.alias))
+
+    def get_group_by_cols(self):
+        return [self]
+
+
+# --- Бэкенды ----------------------------------------------------------------
+
+class BaseItemSearchBackend:
+    """Базовый класс поискового бэкенда"""
+    vendor = None
+
+    def __init__(self, db_connection=None):
+        self.connection = db_connection or connection
+
+    def create_index(self):
+        raise NotImplementedError
+
+    def drop_index(self):
+        raise NotImplementedError
+
+    def index_documents(self, documents):
+        raise NotImplementedError
+
+    def remove_items(self, item_ids):
+        raise NotImplementedError
+
+    def _match_expression(self, query):
+        raise NotImplementedError
+
+    def _match_sql(self, expression):
+        """SQL производной таблицы совпадений с колонками item_id и search_rank"""
+        raise NotImplementedError
+
+    def match_queryset(self, queryset, query):
+        """
+        Ограничивает queryset предметами, подходящими под запрос, и добавляет
+        аннотацию search_rank (меньше - релевантнее). Совпадения ищутся в
+        индексе в том же SQL-запросе, что и остальные фильтры queryset, поэтому
+        фильтры и количество для пагинации учитывают все совпадения
+        """
+        expression = self._match_expression(query)
+        if expression is None:
+            return queryset.none()
+        queryset = queryset.all()
+        sql, params = self._match_sql(expression)
+        alias = queryset.query.join(SearchMatchJoin(
+            sql, params, queryset.query.get_initial_alias(), queryset.model._meta.pk.column
+        ))
+        return queryset.annotate(search_rank=SearchRank(alias))
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+
+
+class SQLiteFTS5Backend(BaseItemSearchBackend):
+    """Поиск через виртуальную таблицу SQLite FTS5"""
+    vendor = 'sqlite'
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+                f"USING fts5(title, description, tags, tokenize='unicode61 remove_diacritics 0')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    def index_documents(self, documents):
+        documents = list(documents)
+        if not documents:
+            return 0
+        with self.connection.cursor() as cursor:
+            self._delete(cursor, [doc[0] for doc in documents])
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, title, description, tags) VALUES (%s, %s, %s, %s)',
+                documents
+            )
+        return len(documents)
+
+    def remove_items(self, item_ids):
+        item_ids = list(item_ids)
+        if item_ids:
+            with self.connection.cursor() as cursor:
+                self._delete(cursor, item_ids)
+
+    def _delete(self, cursor, item_ids):
+        # Ограничение SQLite на количество параметров в одном запросе
+        for start in range(0, len(item_ids), 500):
+            chunk = item_ids[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', chunk)
+
+    def _match_expression(self, query):
+        groups = query_terms(query)
+        if not groups:
+            return None
+        return ' AND '.join(
+            '(' + ' OR '.join(f'"{term}"*' for term in group) + ')' for group in groups
+        )
+
+    def _match_sql(self, expression):
+        # bm25 отрицательна и тем меньше, чем релевантнее документ
+        return (
+            f'SELECT rowid AS item_id, bm25({SEARCH_TABLE}, %s, %s, %s) AS search_rank '
+            f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s',
+            [TITLE_WEIGHT, DESCRIPTION_WEIGHT, TAGS_WEIGHT, expression]
+        )
+
+
+class PostgresTsvectorBackend(BaseItemSearchBackend):
+    """Поиск через колонку tsvector с GIN-индексом в PostgreSQL"""
+    vendor = 'postgresql'
+
+    # Веса tsvector: A - заголовок, B - теги, C - описание
+    DOCUMENT_SQL = (
+        "setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'C') || "
+        "setweight(to_tsvector('simple', %s), 'B')"
+    )
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                f'item_id bigint PRIMARY KEY REFERENCES items (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                f'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx '
+                f'ON {SEARCH_TABLE} USING GIN (document)'
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    def index_documents(self, documents):
+        documents = list(documents)
+        if not documents:
+            return 0
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (item_id, document) VALUES (%s, {self.DOCUMENT_SQL}) '
+                f'ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document',
+                documents
+            )
+        return len(documents)
+
+    def remove_items(self, item_ids):
+        item_ids = list(item_ids)
+        if item_ids:
+            with self.connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE item_id = ANY(%s)', [item_ids])
+
+    def _match_expression(self, query):
+        groups = query_terms(query)
+        if not groups:
+            return None
+        return ' & '.join(
+            '(' + ' | '.join(f'{term}:*' for term in group) + ')' for group in groups
+        )
+
+    def _match_sql(self, expression):
+        # ts_rank тем больше, чем релевантнее документ: знак меняется для сортировки по возрастанию
+        return (
+            "SELECT item_id, -ts_rank(document, query) AS search_rank "
+            f"FROM {SEARCH_TABLE}, to_tsquery('simple', %s) query WHERE document @@ query",
+            [expression]
+        )
+
+
+BACKENDS = {
+    backend.vendor: backend
+    for backend in (SQLiteFTS5Backend, PostgresTsvectorBackend)
+}
+
+
+def get_search_backend(db_connection=None):
+    """
+    Возвращает поисковый бэкенд для текущей СУБД или None,
+    если СУБД не поддерживается (тогда используется icontains-поиск)
+    """
+    db_connection = db_connection or connection
+    backend_class = BACKENDS.get(db_connection.vendor)
+    if backend_class is None:
+        return None
+    return backend_class(db_connection)
+
+
+# --- Инкрементальное обновление индекса ---------------------------------------
+
+_pending = threading.local()
+
+
+def index_items(item_ids):
+    """Переиндексирует указанные предметы (удаленные из БД убираются из индекса)"""
+    from .models import Item, ItemTagRelation
+
+    backend = get_search_backend()
+    if backend is None:
+        return
+    item_ids = set(item_ids)
+    documents = list(iter_documents(Item, ItemTagRelation, item_ids))
+    backend.index_documents(documents)
+    backend.remove_items(item_ids - {doc[0] for doc in documents})
+    logger.debug(f"Поисковый индекс обновлен: {len(documents)} предметов")
+
+
+def _flush_pending():
+    item_ids = getattr(_pending, 'item_ids', None)
+    if not item_ids:
+        return
+    _pending.item_ids = set()
+    try:
+        index_items(item_ids)
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении поискового индекса: {e}")
+
+
+def schedule_reindex(item_ids):
+    """
+    Откладывает переиндексацию предметов до фиксации транзакции.
+
+    Идентификаторы копятся в рамках потока, поэтому изменение предмета
+    вместе с десятком тегов приводит к одной переиндексации.
+    """
+    if not hasattr(_pending, 'item_ids'):
+        _pending.item_ids = set()
+    _pending.item_ids.update(item_ids)
+    transaction.on_commit(_flush_pending)
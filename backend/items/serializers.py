@@ -6,6 +6,8 @@ from .models import (
 )
 from categories.serializers import CategoryNestedSerializer
 from profiles.serializers import LocationSerializer
+from common import lookups
+from common.images import derivative_urls, schedule_derivatives
 from django.contrib.auth import get_user_model
 import logging
 from django.conf import settings
@@ -48,11 +50,21 @@ def custom_slugify(text):
     return result
 
 
+def serialize_item_tags(item):
+    """
+    Сериализует теги предмета по связям tag_relations.
+    При подгруженных через prefetch_related связях запросов к БД не выполняется
+    """
+    tags = [relation.tag for relation in item.tag_relations.all()]
+    return ItemTagSerializer(tags, many=True).data
+
+
 class UserSerializer(serializers.ModelSerializer):
     """
     Сериализатор для отображения информации о пользователе в контексте товаров
     """
     avatar_url = serializers.SerializerMethodField()
+    avatar_urls = serializers.SerializerMethodField()
     full_name = serializers.SerializerMethodField()
     rating = serializers.SerializerMethodField()
     total_reviews = serializers.SerializerMethodField()
@@ -62,7 +74,7 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = [
             'id', 'username', 'first_name', 'last_name', 'full_name',
-            'avatar_url', 'rating', 'total_reviews', 'successful_trades'
+            'avatar_url', 'avatar_urls', 'rating', 'total_reviews', 'successful_trades'
         ]
     
     def get_avatar_url(self, obj):
@@ -80,6 +92,15 @@ class UserSerializer(serializers.ModelSerializer):
             pass
         return None
     
+    def get_avatar_urls(self, obj):
+        """
+        Получает URL уменьшенных копий аватара по размерам
+        """
+        try:
+            return derivative_urls(obj.profile.avatar_derivatives)
+        except Exception:
+            return None
+    
     def get_full_name(self, obj):
         """
         Возвращает полное имя пользователя
@@ -153,12 +174,19 @@ class ItemTagSerializer(serializers.ModelSerializer):
 
 class ItemImageSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
+    image_urls = serializers.SerializerMethodField()
     
     class Meta:
         model = ItemImage
-        fields = ['id', 'image', 'image_url', 'is_primary', 'order', 'created_at']
+        fields = ['id', 'image', 'image_url', 'image_urls', 'is_primary', 'order', 'created_at']
         read_only_fields = ['created_at']
     
+    def get_image_urls(self, obj):
+        """
+        Получает URL уменьшенных копий изображения по размерам IMAGE_SIZES
+        """
+        return derivative_urls(obj.derivatives)
+    
     def get_image_url(self, obj):
         """
         Получает прямой URL для изображения предмета
@@ -225,6 +253,7 @@ class ItemListSerializer(serializers.ModelSerializer):
     """
     category_details = CategoryNestedSerializer(source='category', read_only=True)
     primary_image = serializers.SerializerMethodField()
+    primary_image_urls = serializers.SerializerMethodField()
     owner_details = UserSerializer(source='owner', read_only=True)
     condition_name = serializers.CharField(source='condition.name', read_only=True)
     status_name = serializers.CharField(source='status.name', read_only=True)
@@ -237,41 +266,42 @@ class ItemListSerializer(serializers.ModelSerializer):
             'id', 'title', 'slug', 'description', 'owner', 'owner_details',
             'category', 'category_details', 'condition', 'condition_name',
             'estimated_value', 'status', 'status_name', 'location', 'location_details',
-            'primary_image', 'tags', 'created_at', 'updated_at'
+            'primary_image', 'primary_image_urls', 'tags', 'created_at', 'updated_at'
         ]
     
+    def _primary_image(self, obj):
+        """
+        Выбирает основное изображение из подгруженных, чтобы не делать запросов на каждую строку
+        """
+        images = list(obj.images.all())
+        primary_image = next((image for image in images if image.is_primary), None)
+        if primary_image is None and images:
+            primary_image = images[0]
+        return primary_image
+    
     def get_primary_image(self, obj):
         """
         Получает URL первичного изображения предмета
         """
-        primary_image = obj.images.filter(is_primary=True).first() or obj.images.first()
+        primary_image = self._primary_image(obj)
         if primary_image:
             # Возвращаем прямой URL с S3
             image_path = str(primary_image.image)
             return f"{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}/{settings.MEDIA_LOCATION}/{image_path}"
         return None
+    
+    def get_primary_image_urls(self, obj):
+        """
+        Получает URL уменьшенных копий первичного изображения по размерам
+        """
+        primary_image = self._primary_image(obj)
+        return derivative_urls(primary_image.derivatives) if primary_image else None
         
     def get_tags(self, obj):
         """
         Получает список тегов предмета
         """
-        logger.info(f"=== DEBUG: get_tags для предмета id={obj.id}, title='{obj.title}' ===")
-        
-        # Получаем все связи тегов для этого предмета
-        tag_relations = obj.tag_relations.all()
-        logger.info(f"Найдено связей с тегами: {tag_relations.count()}")
-        
-        tags = []
-        for relation in tag_relations:
-            tag = relation.tag
-            logger.info(f"Тег: id={tag.id}, name='{tag.name}', slug='{tag.slug}'")
-            tags.append(tag)
-        
-        # Сериализуем теги
-        serialized_tags = ItemTagSerializer(tags, many=True).data
-        logger.info(f"Сериализованные теги: {serialized_tags}")
-        
-        return serialized_tags
+        return serialize_item_tags(obj)
 
 
 class ItemDetailSerializer(serializers.ModelSerializer):
@@ -302,23 +332,7 @@ class ItemDetailSerializer(serializers.ModelSerializer):
         """
         Получает список тегов предмета
         """
-        logger.info(f"=== DEBUG: get_tags для предмета id={obj.id}, title='{obj.title}' ===")
-        
-        # Получаем все связи тегов для этого предмета
-        tag_relations = obj.tag_relations.all()
-        logger.info(f"Найдено связей с тегами: {tag_relations.count()}")
-        
-        tags = []
-        for relation in tag_relations:
-            tag = relation.tag
-            logger.info(f"Тег: id={tag.id}, name='{tag.name}', slug='{tag.slug}'")
-            tags.append(tag)
-        
-        # Сериализуем теги
-        serialized_tags = ItemTagSerializer(tags, many=True).data
-        logger.info(f"Сериализованные теги: {serialized_tags}")
-        
-        return serialized_tags
+        return serialize_item_tags(obj)
     
     def get_is_favorited(self, obj):
         """
@@ -384,7 +398,7 @@ class ItemCreateSerializer(serializers.ModelSerializer):
         
         # Если статус не указан, устанавливаем статус "Доступен"
         if 'status' not in validated_data:
-            default_status = ItemStatus.objects.filter(name='Доступен').first()
+            default_status = lookups.find(ItemStatus, 'Доступен')
             if default_status:
                 validated_data['status'] = default_status
                 logger.info(f"Автоматически установлен статус 'Доступен' для нового предмета")
@@ -475,6 +489,7 @@ class ItemCreateSerializer(serializers.ModelSerializer):
                         
                         # Обновляем объект в памяти
                         image_obj.refresh_from_db()
+                        schedule_derivatives(image_obj)
                 else:
                     logger.warning(f"Не удалось загрузить изображение через S3Storage")
             else:
@@ -0,0 +1,40 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from common.images import schedule_derivatives
+from .models import Item, ItemImage, ItemTag, ItemTagRelation
+from .search import schedule_reindex
+
+
+@receiver(post_save, sender=Item)
+def reindex_item_on_save(sender, instance, **kwargs):
+    """Обновляет поисковый индекс при изменении предмета"""
+    schedule_reindex([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def reindex_item_on_delete(sender, instance, **kwargs):
+    """Убирает удаленный предмет из поискового индекса"""
+    schedule_reindex([instance.pk])
+
+
+@receiver(post_save, sender=ItemTagRelation)
+@receiver(post_delete, sender=ItemTagRelation)
+def reindex_item_on_tag_relation_change(sender, instance, **kwargs):
+    """Обновляет поисковый индекс при добавлении или удалении тега у предмета"""
+    schedule_reindex([instance.item_id])
+
+
+@receiver(post_save, sender=ItemTag)
+def reindex_items_on_tag_rename(sender, instance, created, **kwargs):
+    """Переиндексирует предметы с тегом при его переименовании"""
+    if created:
+        return
+    item_ids = ItemTagRelation.objects.filter(tag=instance).values_list('item_id', flat=True)
+    schedule_reindex(list(item_ids))
+
+
+@receiver(post_save, sender=ItemImage)
+def create_item_image_derivatives(sender, instance, **kwargs):
+    """Ставит в очередь создание уменьшенных копий изображения предмета"""
+    schedule_derivatives(instance)
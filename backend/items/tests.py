@@ -1,3 +1,396 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Item, ItemCondition, ItemImage, ItemStatus, ItemTag, ItemTagRelation
+from .search import stem_russian, query_terms
+from .counters import item_counters
+from categories.models import Category
+from common.images import get_image_storage
+from profiles.models import Location
+
+User = get_user_model()
+
+
+class ItemSearchAPITest(APITestCase):
+    """Тесты полнотекстового поиска предметов"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='searcher', email='searcher@test.com', password='testpass123'
+        )
+        self.owner = User.objects.create_user(
+            username='owner', email='owner@test.com', password='testpass123'
+        )
+        self.category = Category.objects.create(name='Книги', slug='books')
+        self.condition, _ = ItemCondition.objects.get_or_create(name='Новый')
+        self.status, _ = ItemStatus.objects.get_or_create(name='Доступен')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book = self._create_item('Книга про космос', 'Твердый переплет')
+            self.bike = self._create_item('Велосипед горный', 'Почти новый, есть книга инструкций')
+            self.lamp = self._create_item('Лампа настольная', 'Светодиодная')
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        self.url = reverse('item-list')
+
+    def _create_item(self, title, description):
+        return Item.objects.create(
+            title=title, description=description, owner=self.owner,
+            category=self.category, condition=self.condition, status=self.status
+        )
+
+    def _search(self, query, **params):
+        response = self.client.get(self.url, {'search': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data['results']]
+
+    def test_stemmer(self):
+        """Тест приведения словоформ к общей основе"""
+        self.assertEqual(stem_russian('книги'), stem_russian('книгой'))
+        self.assertEqual(stem_russian('велосипедами'), 'велосипед')
+        self.assertEqual(query_terms('kniga'), [['knig', 'kniga']])
+
+    def test_search_ranks_title_matches_first(self):
+        """Тест поиска по словоформе с ранжированием по заголовку"""
+        self.assertEqual(self._search('книгу'), [self.book.id, self.bike.id])
+
+    def test_search_transliteration(self):
+        """Тест поиска латиницей по русскому тексту"""
+        self.assertEqual(self._search('lampa'), [self.lamp.id])
+
+    def test_search_combines_with_filters(self):
+        """Тест совместной работы поиска и фильтров ItemFilter"""
+        other_category = Category.objects.create(name='Спорт', slug='sport')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bike.category = other_category
+            self.bike.save()
+
+        self.assertEqual(self._search('книга', category=other_category.id), [self.bike.id])
+
+    def test_search_filters_all_matches(self):
+        """Фильтры и количество учитывают все совпадения, а не только лучшие"""
+        other_category = Category.objects.create(name='Архив', slug='archive')
+        with self.captureOnCommitCallbacks(execute=True):
+            # Совпадения в заголовке ранжируются выше предмета в другой категории
+            for i in range(5):
+                self._create_item(f'Книга {i}', 'Книга книги книгой')
+            archived = Item.objects.create(
+                title='Коробка', description='Старая книга', owner=self.owner,
+                category=other_category, condition=self.condition, status=self.status
+            )
+
+        response = self.client.get(self.url, {'search': 'книга', 'category': other_category.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual([item['id'] for item in response.data['results']], [archived.id])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'search': 'книга'})
+        self.assertEqual(response.data['count'], 8)
+        # Полнотекстовый запрос выполняется один раз на SQL-запрос, а не для каждой строки
+        for query in queries.captured_queries:
+            self.assertLessEqual(query['sql'].count(' MATCH '), 1)
+
+    def test_index_follows_tag_changes(self):
+        """Тест обновления индекса при изменении тегов"""
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = ItemTag.objects.create(name='туризм', slug='turizm')
+            ItemTagRelation.objects.create(item=self.lamp, tag=tag)
+        self.assertEqual(self._search('туристический'), [])
+        self.assertEqual(self._search('туризм'), [self.lamp.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.name = 'кемпинг'
+            tag.save()
+        self.assertEqual(self._search('туризм'), [])
+        self.assertEqual(self._search('кемпинга'), [self.lamp.id])
+
+
+class ItemListQueryCountTest(APITestCase):
+    """Тесты числа запросов при выдаче списка предметов"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='viewer', email='viewer@test.com', password='testpass123'
+        )
+        self.category = Category.objects.create(name='Электроника', slug='electronics')
+        self.condition, _ = ItemCondition.objects.get_or_create(name='Новый')
+        self.status, _ = ItemStatus.objects.get_or_create(name='Доступен')
+        self.tags = [
+            ItemTag.objects.create(name=f'тег {i}', slug=f'tag-{i}') for i in range(3)
+        ]
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        self.url = reverse('item-list')
+
+    def _create_items(self, count):
+        """Создает предметы разных владельцев с изображениями, тегами и адресом"""
+        start = Item.objects.count()
+        for i in range(start, start + count):
+            owner = User.objects.create_user(username=f'owner{i}', password='testpass123')
+            location = Location.objects.create(
+                user=owner, title='Дом', address='ул. Ленина, 1', city='Москва'
+            )
+            item = Item.objects.create(
+                title=f'Предмет {i}', description='Описание', owner=owner,
+                category=self.category, condition=self.condition,
+                status=self.status, location=location
+            )
+            ItemImage.objects.create(item=item, image=f'items/{i}-1.jpg', order=1)
+            ItemImage.objects.create(item=item, image=f'items/{i}-0.jpg', order=0, is_primary=True)
+            for tag in self.tags[:i % 3 + 1]:
+                ItemTagRelation.objects.create(item=item, tag=tag)
+
+    def _list_queries(self, expected_count):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, {'page_size': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), expected_count)
+        return response, len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        """Тест фиксированного числа запросов для 20 и 100 предметов"""
+        self._create_items(20)
+        _, queries_for_20 = self._list_queries(20)
+
+        self._create_items(80)
+        response, queries_for_100 = self._list_queries(100)
+
+        self.assertEqual(queries_for_20, queries_for_100)
+
+        item = response.data['results'][0]
+        self.assertTrue(item['primary_image'].endswith('-0.jpg'))
+        self.assertTrue(item['tags'])
+        self.assertEqual(item['location_details']['city'], 'Москва')
+
+
+class ItemCursorPaginationTest(APITestCase):
+    """Тесты курсорной пагинации списка предметов"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='scroller', email='scroller@test.com', password='testpass123'
+        )
+        category = Category.objects.create(name='Дом', slug='home')
+        condition, _ = ItemCondition.objects.get_or_create(name='Новый')
+        item_status, _ = ItemStatus.objects.get_or_create(name='Доступен')
+        # Повторяющиеся значения views_count проверяют порядок по id при равенстве
+        self.items = [
+            Item.objects.create(
+                title=f'Предмет {i}', description='Описание', owner=self.user,
+                category=category, condition=condition, status=item_status, views_count=i % 3
+            )
+            for i in range(7)
+        ]
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        self.url = reverse('item-list')
+
+    def _walk(self, **params):
+        ids = []
+        response = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 3, **params})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return ids, response
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_walks_all_orderings(self):
+        """Тест обхода всех предметов без пропусков и повторов"""
+        for ordering in ['-created_at', 'views_count', '-views_count', 'favorites_count', 'updated_at']:
+            ids, _ = self._walk(ordering=ordering)
+            field = ordering.lstrip('-')
+            expected = sorted(
+                self.items, key=lambda item: (getattr(item, field), item.id),
+                reverse=ordering.startswith('-')
+            )
+            self.assertEqual(ids, [item.id for item in expected], ordering)
+
+    def test_previous_link(self):
+        """Тест возврата на предыдущую страницу"""
+        first = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 3})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [item['id'] for item in back.data['results']],
+            [item['id'] for item in first.data['results']]
+        )
+
+    def test_invalid_cursor(self):
+        """Тест отказа для поддельного курсора и курсора другой сортировки"""
+        response = self.client.get(self.url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        first = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 3})
+        cursor = parse_qs(urlparse(first.data['next']).query)['cursor'][0]
+        response = self.client.get(self.url, {'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url, {'cursor': cursor, 'ordering': 'views_count'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(ITEM_COUNTERS_FLUSH_INTERVAL=0, ITEM_VIEW_DEDUPE_WINDOW=600)
+class ItemCountersTest(APITestCase):
+    """Тесты отложенной записи счетчиков просмотров и избранного"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        cache.clear()
+        self.owner = User.objects.create_user(username='seller', password='testpass123')
+        self.viewers = [
+            User.objects.create_user(username=f'viewer{i}', password='testpass123') for i in range(2)
+        ]
+        condition, _ = ItemCondition.objects.get_or_create(name='Новый')
+        item_status, _ = ItemStatus.objects.get_or_create(name='Доступен')
+        self.item = Item.objects.create(
+            title='Гитара', description='Акустическая', owner=self.owner,
+            category=Category.objects.create(name='Музыка', slug='music'),
+            condition=condition, status=item_status
+        )
+        self.url = reverse('item-detail', args=[self.item.id])
+
+    def _as(self, user):
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}'
+        )
+
+    def test_views_are_deduplicated_and_flushed_in_batch(self):
+        """Тест дедупликации просмотров и пакетного сброса"""
+        for user in self.viewers + [self.viewers[0], self.owner]:
+            self._as(user)
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Ответ учитывает несброшенные приращения, а в БД они еще не записаны
+        self.assertEqual(response.data['views_count'], 2)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.views_count, 0)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(item_counters.flush(), 1)
+        self.assertEqual(
+            len([q for q in context.captured_queries if q['sql'].startswith('UPDATE')]), 1
+        )
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.views_count, 2)
+        self.assertEqual(item_counters.flush(), 0)
+
+    def test_favorite_toggle(self):
+        """Тест счетчика избранного при добавлении и удалении"""
+        self._as(self.viewers[0])
+        favorite_url = reverse('item-favorite', args=[self.item.id])
+        self.client.post(favorite_url)
+        self._as(self.viewers[1])
+        self.client.post(favorite_url)
+        item_counters.flush()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.favorites_count, 2)
+
+        self.client.post(favorite_url)
+        self.assertEqual(self.client.get(self.url).data['favorites_count'], 1)
+        item_counters.flush()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.favorites_count, 1)
+
+    def test_flush_command_requires_shared_cache(self):
+        """Команда не сбрасывает счетчики из LocMemCache: это кэш другого процесса"""
+        with self.assertRaises(CommandError):
+            call_command('flush_item_counters')
+
+
+class ItemImageDerivativesTest(APITestCase):
+    """Тесты генерации уменьшенных копий изображений"""
+
+    def setUp(self):
+        """Настройка локального хранилища вместо S3"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            MEDIA_URL='/media/',
+            IMAGE_DERIVATIVES_STORAGE='django.core.files.storage.FileSystemStorage',
+            IMAGE_DERIVATIVES_ENABLED=True,
+            IMAGE_DERIVATIVES_ASYNC=False,
+            IMAGE_PROCESSING_WORKERS=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='photographer', password='testpass123')
+        condition, _ = ItemCondition.objects.get_or_create(name='Новый')
+        item_status, _ = ItemStatus.objects.get_or_create(name='Доступен')
+        self.item = Item.objects.create(
+            title='Фотоаппарат', description='Зеркальный', owner=self.user,
+            category=Category.objects.create(name='Фото', slug='photo'),
+            condition=condition, status=item_status
+        )
+
+    def _jpeg_with_orientation(self, size, orientation):
+        from PIL import Image
+
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif[0x010F] = 'Camera'
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (200, 30, 30)).save(buffer, 'JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def test_derivatives_are_generated_and_exposed(self):
+        """Тест создания производных с поворотом по EXIF и их URL в API"""
+        from PIL import Image
+
+        self.assertIsInstance(get_image_storage(), FileSystemStorage)
+        name = get_image_storage().save(
+            'item_images/photo.jpg', ContentFile(self._jpeg_with_orientation((800, 400), 6))
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ItemImage.objects.create(item=self.item, image=name, is_primary=True)
+
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives['source'], name)
+        # Ориентация 6 - поворот на 90°: 800x400 отображается как 400x800
+        self.assertEqual((image.derivatives['medium']['width'], image.derivatives['medium']['height']), (250, 500))
+        self.assertEqual((image.derivatives['thumbnail']['width'], image.derivatives['thumbnail']['height']), (150, 150))
+
+        with get_image_storage().open(image.derivatives['large']['jpeg']) as derivative:
+            rendered = Image.open(derivative)
+            self.assertEqual(rendered.size, (400, 800))
+            self.assertFalse(rendered.getexif())
+        self.assertTrue(image.derivatives['large']['webp'].startswith('item_images/'))
+        self.assertTrue(image.derivatives['large']['webp'].endswith('.webp'))
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        response = self.client.get(reverse('item-list'))
+        urls = response.data['results'][0]['primary_image_urls']
+        self.assertEqual(set(urls), {'thumbnail', 'medium', 'large'})
+        self.assertEqual(urls['thumbnail']['webp'], f"/media/{image.derivatives['thumbnail']['webp']}")
@@ -3,13 +3,15 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import F
+from django.db.models import Prefetch
 import logging
 from django.conf import settings
 
+from common.images import schedule_derivatives
+from common.instrumentation import span
 from .models import (
     Item, ItemImage, ItemCondition, 
-    ItemStatus, ItemTag, Favorite
+    ItemStatus, ItemTag, ItemTagRelation, Favorite
 )
 from .serializers import (
     ItemListSerializer, ItemDetailSerializer, ItemCreateSerializer, 
@@ -17,13 +19,32 @@ from .serializers import (
     ItemTagSerializer, ItemImageSerializer, FavoriteSerializer
 )
 from .permissions import IsOwnerOrReadOnly, IsOwner
-from .filters import ItemFilter
+from .filters import ItemFilter, ItemSearchFilter, RankedOrderingFilter
+from .pagination import ItemPagination, ItemCursorPagination
+from .counters import item_counters
 
 # Настраиваем логгер
 logger = logging.getLogger(__name__)
 
 # Create your views here.
 
+# Действия, отдающие список предметов через ItemListSerializer
+LIST_ACTIONS = ('list', 'my', 'favorites')
+
+
+def prefetch_item_list(queryset):
+    """
+    Подгружает все данные, нужные ItemListSerializer, фиксированным числом запросов
+    независимо от размера страницы
+    """
+    return queryset.select_related(
+        'owner', 'owner__profile', 'category', 'condition', 'status', 'location'
+    ).prefetch_related(
+        Prefetch('images', queryset=ItemImage.objects.order_by('order', 'id')),
+        Prefetch('tag_relations', queryset=ItemTagRelation.objects.select_related('tag').order_by('id')),
+    )
+
+
 class ItemConditionViewSet(viewsets.ReadOnlyModelViewSet):
     """
     ViewSet для состояний предметов (только чтение)
@@ -74,29 +95,36 @@ class ItemViewSet(viewsets.ModelViewSet):
     """
     queryset = Item.objects.filter(is_deleted=False).select_related('owner', 'owner__profile', 'category', 'condition', 'status')
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ItemSearchFilter, RankedOrderingFilter]
     filterset_class = ItemFilter
     search_fields = ['title', 'description', 'tag_relations__tag__name']
     ordering_fields = ['created_at', 'updated_at', 'views_count', 'favorites_count']
     ordering = ['-created_at']
+    pagination_class = ItemPagination
     parser_classes = [MultiPartParser, FormParser, parsers.JSONParser]
     
     def get_queryset(self):
         """
-        Переопределяем get_queryset для логирования
+        Для списков подгружаем связанные объекты заранее
         """
         queryset = super().get_queryset()
-        logger.info(f"=== GET QUERYSET ===")
-        logger.info(f"Base queryset count: {queryset.count()}")
-        logger.info(f"Action: {self.action}")
-        logger.info(f"User: {self.request.user.username if hasattr(self, 'request') else 'No request'}")
-        
-        # Логируем первые несколько товаров из базового queryset
-        for item in queryset[:5]:
-            logger.info(f"Base item: ID={item.id}, title='{item.title}', owner='{item.owner.username}', is_deleted={item.is_deleted}")
+        if self.action in LIST_ACTIONS:
+            queryset = prefetch_item_list(queryset)
         
         return queryset
     
+    @property
+    def paginator(self):
+        """
+        Выбирает курсорную пагинацию, если клиент запросил ее явно
+        """
+        if not hasattr(self, '_paginator'):
+            if ItemCursorPagination.is_requested(self.request):
+                self._paginator = ItemCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+    
     def get_permissions(self):
         """
         Переопределяем права доступа для разных действий
@@ -123,45 +151,40 @@ class ItemViewSet(viewsets.ModelViewSet):
         """
         Переопределяем метод, чтобы передать запрос в фильтр
         """
-        logger.info(f"=== FILTER QUERYSET ===")
-        logger.info(f"Initial queryset count: {queryset.count()}")
-        logger.info(f"Filter params: {dict(self.request.GET)}")
-        
-        filterset = self.filterset_class(
-            self.request.GET,
-            queryset=queryset,
-            request=self.request  # Передаем request в фильтр
-        )
-        
-        # Проверяем, валиден ли фильтр
-        if not filterset.is_valid():
-            logger.warning(f"Невалидные параметры фильтра: {filterset.errors}")
+        logger.debug(f"Filter params: {dict(self.request.GET)}")
         
-        queryset = filterset.qs
-        logger.info(f"Queryset count after DjangoFilterBackend: {queryset.count()}")
+        with span('filter.ItemFilter'):
+            filterset = self.filterset_class(
+                self.request.GET,
+                queryset=queryset,
+                request=self.request  # Передаем request в фильтр
+            )
+            
+            # Проверяем, валиден ли фильтр
+            if not filterset.is_valid():
+                logger.warning(f"Невалидные параметры фильтра: {filterset.errors}")
+            
+            queryset = filterset.qs
         
         # Применяем остальные бэкенды фильтрации
         for backend in list(self.filter_backends):
-            if not isinstance(backend(), DjangoFilterBackend):  # Пропускаем DjangoFilterBackend, так как уже использовали его
-                backend_name = backend.__name__
-                queryset_before = queryset.count()
-                queryset = backend().filter_queryset(self.request, queryset, self)
-                queryset_after = queryset.count()
-                logger.info(f"After {backend_name}: {queryset_before} -> {queryset_after} items")
-        
-        logger.info(f"Final queryset count: {queryset.count()}")
+            if not issubclass(backend, DjangoFilterBackend):  # Пропускаем DjangoFilterBackend, так как уже использовали его
+                with span(f'filter.{backend.__name__}'):
+                    queryset = backend().filter_queryset(self.request, queryset, self)
+        
         return queryset
     
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        # Увеличиваем счетчик просмотров только если запрос от другого пользователя
-        if instance.owner != request.user:
-            instance.views_count = F('views_count') + 1
-            instance.save(update_fields=['views_count'])
-            instance.refresh_from_db()
-        
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        # Увеличиваем счетчик просмотров только если запрос от другого пользователя.
+        # Приращение копится в буфере счетчиков и сбрасывается в БД пакетно
+        if instance.owner_id != request.user.id:
+            item_counters.record_view(instance.id, request.user.id)
+        item_counters.apply_pending([instance])
+        
+        with span('serialize'):
+            data = self.get_serializer(instance).data
+        return Response(data)
     
     def list(self, request, *args, **kwargs):
         """
@@ -179,65 +202,36 @@ class ItemViewSet(viewsets.ModelViewSet):
         - is_favorite: фильтр по избранному (true/false) (напр. ?is_favorite=true)
         
         Поиск:
-        - search: поиск по названию, описанию и тегам (напр. ?search=книга)
+        - search: полнотекстовый поиск по названию, описанию и тегам с учетом
+          словоформ и транслитерации (напр. ?search=книга или ?search=kniga);
+          без явной сортировки результаты упорядочены по релевантности
         
         Сортировка:
         - ordering: сортировка по полям (created_at, updated_at, views_count, favorites_count)
           (напр. ?ordering=-created_at для сортировки по убыванию даты создания)
-        """
-        # Логируем параметры запроса
-        logger.info(f"=== ITEMS LIST REQUEST ===")
-        logger.info(f"User: {request.user.username} (ID: {request.user.id})")
-        logger.info(f"Query params: {dict(request.GET)}")
         
-        # Получаем базовый queryset
+        Пагинация:
+        - page, page_size: постраничная пагинация с общим количеством (по умолчанию)
+        - pagination=cursor: курсорная пагинация для бесконечной прокрутки без подсчета
+          общего количества; следующая страница запрашивается по ссылке next (?cursor=...)
+        """
+        # Количество запросов и время этапов собирает common.instrumentation
+        # (заголовок Server-Timing), отладочные запросы к БД здесь не нужны
         queryset = self.filter_queryset(self.get_queryset())
         
-        # Логируем информацию о queryset до пагинации
-        logger.info(f"Queryset count after filtering: {queryset.count()}")
-        
-        # Логируем детали каждого товара
-        for item in queryset[:10]:  # Логируем первые 10 товаров
-            logger.info(f"Item: ID={item.id}, title='{item.title}', owner_id={item.owner_id}, owner='{item.owner.username}', is_deleted={item.is_deleted}")
-        
-        if queryset.count() > 10:
-            logger.info(f"... и еще {queryset.count() - 10} товаров")
-        
-        # Если фильтруем по владельцу, добавляем дополнительную информацию
-        owner_filter = request.GET.get('owner')
-        if owner_filter:
-            logger.info(f"Фильтр по владельцу: {owner_filter}")
-            try:
-                from django.contrib.auth import get_user_model
-                User = get_user_model()
-                owner_user = User.objects.get(id=owner_filter)
-                logger.info(f"Владелец: {owner_user.username} (ID: {owner_user.id})")
-                
-                # Проверяем все товары этого владельца в БД
-                all_owner_items = Item.objects.filter(owner_id=owner_filter)
-                logger.info(f"Всего товаров у владельца в БД: {all_owner_items.count()}")
-                
-                # Проверяем товары без учета is_deleted
-                all_owner_items_with_deleted = Item.objects.filter(owner_id=owner_filter, is_deleted=False)
-                logger.info(f"Товаров у владельца (не удаленных): {all_owner_items_with_deleted.count()}")
-                
-                # Логируем все товары владельца
-                for item in all_owner_items_with_deleted:
-                    logger.info(f"Owner's item: ID={item.id}, title='{item.title}', is_deleted={item.is_deleted}, created_at={item.created_at}")
-                    
-            except Exception as e:
-                logger.error(f"Ошибка при получении информации о владельце: {e}")
-        
         # Выполняем стандартную логику list
-        page = self.paginate_queryset(queryset)
+        with span('paginate'):
+            page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            logger.info(f"Возвращаем пагинированный результат: {len(page)} товаров на странице")
-            return self.get_paginated_response(serializer.data)
+            with span('serialize'):
+                data = self.get_serializer(page, many=True).data
+            logger.debug(f"Возвращаем пагинированный результат: {len(page)} товаров на странице")
+            return self.get_paginated_response(data)
 
-        serializer = self.get_serializer(queryset, many=True)
-        logger.info(f"Возвращаем все товары без пагинации: {len(serializer.data)} товаров")
-        return Response(serializer.data)
+        with span('serialize'):
+            data = self.get_serializer(queryset, many=True).data
+        logger.debug(f"Возвращаем все товары без пагинации: {len(data)} товаров")
+        return Response(data)
     
     @action(detail=True, methods=['post'])
     def favorite(self, request, pk=None):
@@ -259,17 +253,13 @@ class ItemViewSet(viewsets.ModelViewSet):
         
         if created:
             # Увеличиваем счетчик избранного
-            item.favorites_count = F('favorites_count') + 1
-            item.save(update_fields=['favorites_count'])
-            item.refresh_from_db()
+            item_counters.record_favorite(item.id, added=True)
             logger.info(f"Предмет добавлен в избранное: item_id={item.id}, user={user.username}")
             return Response({'status': 'added to favorites'}, status=status.HTTP_201_CREATED)
         else:
             # Удаляем из избранного и уменьшаем счетчик
             favorite.delete()
-            item.favorites_count = F('favorites_count') - 1
-            item.save(update_fields=['favorites_count'])
-            item.refresh_from_db()
+            item_counters.record_favorite(item.id, added=False)
             logger.info(f"Предмет удален из избранного: item_id={item.id}, user={user.username}")
             return Response({'status': 'removed from favorites'}, status=status.HTTP_200_OK)
     
@@ -363,6 +353,7 @@ class ItemViewSet(viewsets.ModelViewSet):
                     
                     # Обновляем объект в памяти
                     image_obj.refresh_from_db()
+                    schedule_derivatives(image_obj)
                     
                     # Возвращаем данные созданного изображения
                     serializer = ItemImageSerializer(image_obj, context={'request': request})
@@ -448,8 +439,7 @@ class ItemViewSet(viewsets.ModelViewSet):
         """
         Получить список избранных предметов пользователя
         """
-        favorites = Favorite.objects.filter(user=request.user).select_related('item')
-        items = [favorite.item for favorite in favorites]
+        items = prefetch_item_list(Item.objects.filter(favorited_by__user=request.user))
         
         page = self.paginate_queryset(items)
         if page is not None:
@@ -464,7 +454,7 @@ class ItemViewSet(viewsets.ModelViewSet):
         """
         Получить список предметов текущего пользователя
         """
-        items = Item.objects.filter(owner=request.user, is_deleted=False)
+        items = prefetch_item_list(Item.objects.filter(owner=request.user, is_deleted=False))
         
         # Применяем фильтры, если есть
         items = self.filter_queryset(items)
@@ -593,6 +583,7 @@ class ItemImageViewSet(viewsets.ModelViewSet):
                             
                             # Обновляем объект в памяти
                             instance.refresh_from_db()
+                            schedule_derivatives(instance)
                         return
                 
             # Стандартное сохранение, если не используем S3 напрямую
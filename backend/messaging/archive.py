@@ -0,0 +1,142 @@
+"""
+Архивация старых сообщений чатов.
+
+Сообщения старше MESSAGE_ARCHIVE_AFTER_DAYS и мягко удаленные сообщения
+переносятся из таблицы messages в archived_messages пачками по
+MESSAGE_ARCHIVE_CHUNK_SIZE, каждая пачка - в отдельной транзакции. Горячая
+таблица и ее индексы остаются небольшими, а история чата читается прозрачно:
+Chat.archived_until хранит время самого нового архивного сообщения чата, и
+keyset-пагинация истории обращается к архиву, только когда курсор выходит за
+горячее окно.
+
+В горячей таблице остаются сообщения, на которые ссылаются Chat.last_message
+и ChatParticipantStatus.last_read_message: от них зависят список чатов и
+отметки прочтения. Записи поискового индекса архивных сообщений сохраняются.
+Для мягко удаленных сообщений остается запись об удалении (SyncTombstone):
+клиенты, не синхронизировавшиеся с момента удаления, получат его в дельте.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedMessage, Chat, ChatParticipantStatus, Message, MessageAttachment
+from .sync import record_removed_messages
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENT_FIELDS = ('id', 'file', 'file_name', 'file_size', 'file_type', 'derivatives', 'content_hash', 'created_at')
+
+
+def archive_candidates(cutoff):
+    """Сообщения, которые можно перенести в архив"""
+    return Message.objects.filter(
+        Q(created_at__lt=cutoff) | Q(is_deleted=True)
+    ).exclude(
+        pk__in=Chat.objects.filter(last_message__isnull=False).values('last_message')
+    ).exclude(
+        pk__in=ChatParticipantStatus.objects.filter(last_read_message__isnull=False).values('last_read_message')
+    )
+
+
+def _snapshot_attachments(message_ids):
+    attachments = {}
+    for values in MessageAttachment.objects.filter(message_id__in=message_ids).order_by('id').values(
+        'message_id', *ATTACHMENT_FIELDS
+    ):
+        message_id = values.pop('message_id')
+        values['created_at'] = values['created_at'].isoformat()
+        attachments.setdefault(message_id, []).append(values)
+    return attachments
+
+
+def archive_chunk(cutoff, chunk_size):
+    """
+    Переносит в архив одну пачку сообщений. Возвращает количество
+    перенесенных сообщений (0 - переносить больше нечего)
+    """
+    with transaction.atomic():
+        messages = list(
+            archive_candidates(cutoff).select_for_update().order_by('id').only(
+                'id', 'chat_id', 'sender_id', 'content', 'is_deleted', 'deleted_at', 'created_at', 'updated_at'
+            )[:chunk_size]
+        )
+        if not messages:
+            return 0
+        message_ids = [message.id for message in messages]
+        attachments = _snapshot_attachments(message_ids)
+
+        ArchivedMessage.objects.bulk_create([
+            ArchivedMessage(
+                id=message.id,
+                chat_id=message.chat_id,
+                sender_id=message.sender_id,
+                content=message.content,
+                attachments=attachments.get(message.id, []),
+                is_deleted=message.is_deleted,
+                deleted_at=message.deleted_at,
+                created_at=message.created_at,
+                updated_at=message.updated_at,
+            )
+            for message in messages
+        ])
+
+        # Удаление без сигналов post_delete: архивные сообщения не бывают последними
+        # в чате, а их записи в поисковом индексе должны остаться. Файлы вложений
+        # в хранилище не трогаем - на них ссылается снимок в архиве
+        MessageAttachment.objects.filter(message_id__in=message_ids)._raw_delete(MessageAttachment.objects.db)
+        Message.objects.filter(pk__in=message_ids)._raw_delete(Message.objects.db)
+        record_removed_messages([
+            (message.id, message.chat_id) for message in messages if message.is_deleted
+        ])
+
+        newest = {}
+        for message in messages:
+            if message.is_deleted:
+                continue
+            if message.chat_id not in newest or message.created_at > newest[message.chat_id]:
+                newest[message.chat_id] = message.created_at
+        for chat_id, created_at in newest.items():
+            Chat.objects.filter(pk=chat_id).filter(
+                Q(archived_until__isnull=True) | Q(archived_until__lt=created_at)
+            ).update(archived_until=created_at)
+
+    return len(messages)
+
+
+def archive_messages(older_than=None, chunk_size=None, limit=None):
+    """
+    Переносит в архив сообщения старше older_than (timedelta) и мягко удаленные.
+    Возвращает общее количество перенесенных сообщений
+    """
+    if older_than is None:
+        older_than = timedelta(days=settings.MESSAGE_ARCHIVE_AFTER_DAYS)
+    chunk_size = chunk_size or settings.MESSAGE_ARCHIVE_CHUNK_SIZE
+    cutoff = timezone.now() - older_than
+
+    total = 0
+    while limit is None or total < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - total)
+        try:
+            archived = archive_chunk(cutoff, size)
+        except IntegrityError as e:
+            # На сообщение пачки успели сослаться (например, отметка прочтения):
+            # пачка откатывается и будет перенесена при следующем запуске
+            logger.warning(f"Пачка сообщений не перенесена в архив: {e}")
+            break
+        if not archived:
+            break
+        total += archived
+        logger.info(f"Перенесено в архив сообщений: {archived} (всего {total})")
+    return total
+
+
+def archived_history(chat_id, queryset_filter, order, limit):
+    """Архивные неудаленные сообщения чата в виде экземпляров Message"""
+    archived = ArchivedMessage.objects.filter(
+        queryset_filter, chat_id=chat_id, is_deleted=False
+    ).select_related('sender').order_by(*order)[:limit]
+    return [message.as_message() for message in archived]
@@ -0,0 +1,153 @@
+"""
+Сохранение вложений сообщений.
+
+Загруженный файл читается один раз по частям: по ходу чтения считается SHA-256
+и запоминаются первые байты для определения MIME-типа по сигнатуре (тип от
+клиента не используется). Если файл с таким хешем уже загружался в любой чат,
+новое вложение ссылается на тот же объект хранилища (и его производные
+изображения) без повторной загрузки. Новые файлы передаются в хранилище
+потоком под именем из хеша содержимого.
+"""
+import hashlib
+import logging
+import mimetypes
+import posixpath
+
+from .models import MessageAttachment
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'message_attachments'
+
+# Сколько первых байтов нужно для определения типа
+SNIFF_BYTES = 512
+
+DEFAULT_MIME_TYPE = 'application/octet-stream'
+
+# Сигнатуры форматов: (смещение, байты, MIME-тип)
+MAGIC_NUMBERS = (
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'\x1aE\xdf\xa3', 'video/webm'),
+)
+
+# Подтипы контейнеров RIFF и ISO BMFF (ftyp)
+RIFF_TYPES = {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}
+FTYP_TYPES = {
+    b'heic': 'image/heic', b'heix': 'image/heic', b'mif1': 'image/heif',
+    b'avif': 'image/avif', b'qt  ': 'video/quicktime', b'M4A ': 'audio/mp4',
+}
+
+# Форматы-контейнеры, для которых уточняем тип по расширению файла
+# (документы Office хранятся в ZIP и OLE)
+CONTAINER_TYPES = {'application/zip', 'application/x-ole-storage'}
+
+
+def sniff_mime_type(head, file_name=''):
+    """Определяет MIME-тип по первым байтам файла"""
+    mime_type = None
+    for offset, signature, candidate in MAGIC_NUMBERS:
+        if head[offset:offset + len(signature)] == signature:
+            mime_type = candidate
+            break
+
+    if mime_type is None and head[:4] == b'RIFF':
+        mime_type = RIFF_TYPES.get(head[8:12])
+    if mime_type is None and head[4:8] == b'ftyp':
+        mime_type = FTYP_TYPES.get(head[8:12], 'video/mp4')
+
+    if mime_type in CONTAINER_TYPES:
+        guessed, _ = mimetypes.guess_type(file_name)
+        if guessed and guessed.startswith('application/'):
+            return guessed
+        return 'application/zip' if mime_type == 'application/zip' else DEFAULT_MIME_TYPE
+
+    if mime_type is None:
+        mime_type = 'text/plain' if _is_text(head) else DEFAULT_MIME_TYPE
+    return mime_type
+
+
+def _is_text(head):
+    if not head or b'\x00' in head:
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Обрезанный многобайтовый символ в конце фрагмента допустим
+        return e.start >= len(head) - 3
+    return True
+
+
+def _inspect(uploaded_file):
+    """Один проход по файлу: хеш содержимого и первые байты"""
+    digest = hashlib.sha256()
+    head = b''
+    for chunk in uploaded_file.chunks():
+        if len(head) < SNIFF_BYTES:
+            head += chunk[:SNIFF_BYTES - len(head)]
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest(), head
+
+
+def _storage_name(content_hash, mime_type):
+    # Расширение - по определенному типу, а не по имени от клиента: хранилище
+    # отдает файл с Content-Type по расширению
+    extension = mimetypes.guess_extension(mime_type) if mime_type != DEFAULT_MIME_TYPE else None
+    return posixpath.join(UPLOAD_DIR, content_hash[:2], f'{content_hash}{extension or ".bin"}')
+
+
+def build_attachments(message, uploaded_files):
+    """
+    Подготавливает (не сохраняя в БД) вложения сообщения для bulk_create.
+    Одинаковые файлы загружаются в хранилище один раз
+    """
+    inspected = []
+    for uploaded_file in uploaded_files:
+        content_hash, head = _inspect(uploaded_file)
+        inspected.append((uploaded_file, content_hash, sniff_mime_type(head, uploaded_file.name)))
+
+    # Уже загруженные файлы с тем же содержимым - одним запросом
+    known = {}
+    for content_hash, name, derivatives in MessageAttachment.objects.filter(
+        content_hash__in={content_hash for _, content_hash, _ in inspected}
+    ).exclude(file='').values_list('content_hash', 'file', 'derivatives'):
+        known.setdefault(content_hash, (name, derivatives))
+
+    storage = MessageAttachment._meta.get_field('file').storage
+    attachments = []
+    for uploaded_file, content_hash, mime_type in inspected:
+        if content_hash in known:
+            name, derivatives = known[content_hash]
+            logger.info(f"Вложение {uploaded_file.name} уже загружено как {name}, повторная загрузка пропущена")
+        else:
+            name = _storage_name(content_hash, mime_type)
+            if not storage.exists(name):
+                name = storage.save(name, uploaded_file)
+            derivatives = {}
+            known[content_hash] = (name, derivatives)
+
+        attachments.append(MessageAttachment(
+            message=message,
+            file=name,
+            file_name=uploaded_file.name,
+            file_size=uploaded_file.size,
+            file_type=mime_type,
+            content_hash=content_hash,
+            derivatives=derivatives or {},
+        ))
+    return attachments
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Error, register
+from django.utils.module_loading import import_string
+
+
+@register()
+def check_realtime_broker(app_configs, **kwargs):
+    """Брокер в памяти процесса не доставит события между процессами ASGI-сервера"""
+    broker_class = import_string(settings.MESSAGING_REALTIME_BROKER)
+    if getattr(broker_class, 'single_process', False) and settings.ASGI_WORKERS > 1:
+        return [Error(
+            f"{settings.MESSAGING_REALTIME_BROKER} работает в пределах одного процесса, "
+            f"а ASGI-сервер запускается с {settings.ASGI_WORKERS} процессами (WEB_CONCURRENCY)",
+            hint="Запустите один процесс или укажите в MESSAGING_REALTIME_BROKER межпроцессный брокер",
+            id='messaging.E001',
+        )]
+    return []
@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from messaging.archive import archive_messages
+from messaging.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит старые и мягко удаленные сообщения в архивную таблицу и удаляет '
+        'устаревшие записи об удалениях для синхронизации. '
+        'Запускается по расписанию (cron) или с --interval как постоянный процесс'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Возраст сообщений для архивации, дней (по умолчанию MESSAGE_ARCHIVE_AFTER_DAYS)'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help='Сообщений в одной транзакции (по умолчанию MESSAGE_ARCHIVE_CHUNK_SIZE)'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Максимум сообщений за один запуск'
+        )
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Повторять архивацию каждые N секунд (0 - однократный запуск)'
+        )
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else settings.MESSAGE_ARCHIVE_AFTER_DAYS
+
+        while True:
+            archived = archive_messages(
+                older_than=timedelta(days=days),
+                chunk_size=options['chunk_size'],
+                limit=options['limit'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'Перенесено в архив сообщений: {archived}'))
+            purged = purge_tombstones()
+            self.stdout.write(self.style.SUCCESS(f'Удалено записей об удалениях: {purged}'))
+
+            if not options['interval']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,74 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from items.search import analyze
+from messaging.search import get_search_backend
+
+WORDS = (
+    'обмен велосипед книга телефон ноутбук куртка диван гитара самокат часы '
+    'встреча завтра вечером метро адрес фото состояние новый торг доставка '
+    'bike phone laptop guitar book watch meeting tomorrow photo'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку поиска по сообщениям на синтетическом индексе. '
+        'Документы пишутся прямо в индекс внутри транзакции, которая затем откатывается'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000000, help='Количество документов в индексе')
+        parser.add_argument('--chats', type=int, default=50000, help='Количество чатов')
+        parser.add_argument('--user-chats', type=int, default=30, help='Чатов у пользователя, по которым идет поиск')
+        parser.add_argument('--queries', type=int, default=200, help='Количество поисковых запросов')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Размер пачки при заполнении индекса')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if backend is None:
+            raise CommandError('Текущая СУБД не поддерживает поисковый индекс')
+        if backend.vendor == 'postgresql':
+            # Синтетические id не ссылаются на реальные сообщения
+            raise CommandError('Бенчмарк на синтетических данных поддерживается только для SQLite')
+
+        with transaction.atomic():
+            self._run(backend, options)
+            transaction.set_rollback(True)
+
+    def _run(self, backend, options):
+        rng = random.Random(42)
+        backend.create_index()
+        backend.clear()
+
+        total = options['messages']
+        started = time.perf_counter()
+        for start in range(1, total + 1, options['batch_size']):
+            batch = [
+                (message_id, rng.randint(1, options['chats']), ' '.join(analyze(' '.join(rng.choices(WORDS, k=8)))))
+                for message_id in range(start, min(start + options['batch_size'], total + 1))
+            ]
+            backend.index_documents(batch)
+        self.stdout.write(f'Проиндексировано {total} документов за {time.perf_counter() - started:.1f} с')
+
+        latencies = []
+        found = 0
+        for _ in range(options['queries']):
+            chat_ids = rng.sample(range(1, options['chats'] + 1), options['user_chats'])
+            query = ' '.join(rng.sample(WORDS, rng.randint(1, 2)))
+            started = time.perf_counter()
+            found += len(backend.search(query, chat_ids, limit=20))
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        latencies.sort()
+        self.stdout.write(
+            f'Поиск ({options["queries"]} запросов, {options["user_chats"]} чатов): '
+            f'p50={statistics.median(latencies):.1f} мс, '
+            f'p95={latencies[int(len(latencies) * 0.95) - 1]:.1f} мс, '
+            f'max={latencies[-1]:.1f} мс, найдено в среднем {found / len(latencies):.1f}'
+        )
+        self.stdout.write(self.style.SUCCESS('Бенчмарк завершен, данные откачены'))
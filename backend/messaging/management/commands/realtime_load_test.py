@@ -0,0 +1,147 @@
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from messaging.models import Chat
+from messaging.realtime import chat_group, get_broker, websocket_application
+
+User = get_user_model()
+
+
+class FakeConnection:
+    """Соединение WebSocket, подключенное к ASGI-приложению напрямую, без сети"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.inbox = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.closed = None
+        self.received = 0
+        self.on_message = None
+        self.task = None
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, event):
+        if event['type'] == 'websocket.accept':
+            self.accepted.set()
+        elif event['type'] == 'websocket.close':
+            self.closed = event.get('code')
+            self.accepted.set()
+        elif event['type'] == 'websocket.send':
+            self.received += 1
+            if self.on_message is not None:
+                self.on_message(event['text'])
+
+    async def open(self):
+        self.task = asyncio.ensure_future(websocket_application(self.scope, self.receive, self.send))
+        await self.inbox.put({'type': 'websocket.connect'})
+        await self.accepted.wait()
+
+    async def close(self):
+        await self.inbox.put({'type': 'websocket.disconnect', 'code': 1000})
+        await self.task
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест WebSocket-чатов: открывает тысячи простаивающих соединений '
+        'в процессе, замеряет время подключения, память на соединение и задержку рассылки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=5000, help='Количество соединений')
+        parser.add_argument('--batch', type=int, default=500, help='Сколько соединений открывать одновременно')
+        parser.add_argument('--events', type=int, default=20, help='Количество рассылаемых событий')
+        parser.add_argument('--idle', type=float, default=1.0, help='Время простоя соединений перед рассылкой, секунд')
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        users = [
+            User.objects.create_user(
+                username=f'loadtest_{suffix}_{i}', email=f'loadtest_{suffix}_{i}@example.com',
+                password=uuid.uuid4().hex
+            )
+            for i in range(2)
+        ]
+        chat = Chat.objects.create()
+        chat.participants.set(users)
+        token = str(RefreshToken.for_user(users[0]).access_token)
+
+        try:
+            async_to_sync(self._run)(chat.id, token, options)
+        finally:
+            chat.delete()
+            for user in users:
+                user.delete()
+
+    async def _run(self, chat_id, token, options):
+        scope = {
+            'type': 'websocket',
+            'path': f'/ws/chats/{chat_id}/',
+            'query_string': b'',
+            'headers': [(b'authorization', f'Bearer {token}'.encode())],
+        }
+        count = options['connections']
+        connections = [FakeConnection(scope) for _ in range(count)]
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        for start in range(0, count, options['batch']):
+            await asyncio.gather(*(connection.open() for connection in connections[start:start + options['batch']]))
+        connect_time = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+
+        rejected = sum(1 for connection in connections if connection.closed is not None)
+        self.stdout.write(
+            f'Подключено {count - rejected} из {count} за {connect_time:.2f} с '
+            f'({count / connect_time:.0f} подключений/с), '
+            f'память ~{memory / count / 1024:.1f} КБ на соединение, '
+            f'подписок в брокере: {get_broker().subscriber_count(chat_group(chat_id))}'
+        )
+
+        await asyncio.sleep(options['idle'])
+
+        latencies = []
+        broker = get_broker()
+        for number in range(options['events']):
+            done = asyncio.Event()
+            remaining = [count - rejected]
+
+            def on_message(text):
+                remaining[0] -= 1
+                if not remaining[0]:
+                    done.set()
+
+            for connection in connections:
+                connection.on_message = on_message
+            payload = json.dumps({'type': 'message.created', 'chat': chat_id, 'message': {'id': number}})
+            sent = time.perf_counter()
+            broker.publish(chat_group(chat_id), payload)
+            await done.wait()
+            latencies.append((time.perf_counter() - sent) * 1000)
+
+        if latencies:
+            self.stdout.write(
+                f'Рассылка события на {count - rejected} соединений: '
+                f'p50={statistics.median(latencies):.1f} мс, max={max(latencies):.1f} мс'
+            )
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connection.close() for connection in connections if connection.closed is None))
+        self.stdout.write(
+            f'Отключение за {time.perf_counter() - started:.2f} с, '
+            f'осталось подписок: {get_broker().subscriber_count()}'
+        )
+        self.stdout.write(self.style.SUCCESS('Нагрузочный тест завершен'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from messaging.models import ArchivedMessage, Message
+from messaging.search import get_search_backend, iter_documents
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает поисковый индекс сообщений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество сообщений, индексируемых за один запрос'
+        )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if backend is None:
+            raise CommandError('Текущая СУБД не поддерживает поисковый индекс')
+
+        batch_size = options['batch_size']
+        self.stdout.write(self.style.SUCCESS('Перестраиваем поисковый индекс сообщений...'))
+
+        indexed = 0
+        with transaction.atomic():
+            backend.create_index()
+            backend.clear()
+
+            # Архивные сообщения остаются доступными для поиска
+            for model in (Message, ArchivedMessage):
+                batch = []
+                for document in iter_documents(model, batch_size=batch_size):
+                    batch.append(document)
+                    if len(batch) >= batch_size:
+                        indexed += backend.index_documents(batch)
+                        batch = []
+                indexed += backend.index_documents(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано сообщений: {indexed}'))
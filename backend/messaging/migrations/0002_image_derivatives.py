@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messageattachment',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict, help_text='Уменьшенные копии изображения по размерам IMAGE_SIZES', verbose_name='Производные изображения'),
+        ),
+    ]
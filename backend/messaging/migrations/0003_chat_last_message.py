@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_last_messages(apps, schema_editor):
+    """Заполняет указатель на последнее неудаленное сообщение существующих чатов"""
+    Chat = apps.get_model('messaging', 'Chat')
+    Message = apps.get_model('messaging', 'Message')
+    latest = Message.objects.filter(
+        chat=OuterRef('pk'), is_deleted=False
+    ).order_by('-created_at', '-id')
+    Chat.objects.update(last_message=Subquery(latest.values('pk')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0002_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_message',
+            field=models.ForeignKey(blank=True, help_text='Последнее неудаленное сообщение в чате', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='messaging.message', verbose_name='Последнее сообщение'),
+        ),
+        migrations.RunPython(fill_last_messages, migrations.RunPython.noop),
+    ]
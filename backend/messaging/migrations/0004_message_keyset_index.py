@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0003_chat_last_message'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['chat', 'created_at', 'id'], name='message_chat_created_id_idx'),
+        ),
+    ]
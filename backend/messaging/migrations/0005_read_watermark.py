@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:33
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_read_watermarks(apps, schema_editor):
+    """
+    Переносит состояние прочтения из флагов сообщений в отметки участников:
+    отметка - последнее прочитанное сообщение собеседников в чате
+    """
+    ChatParticipantStatus = apps.get_model('messaging', 'ChatParticipantStatus')
+    Message = apps.get_model('messaging', 'Message')
+    last_read = Message.objects.filter(
+        chat_id=OuterRef('chat_id'), is_read=True
+    ).exclude(sender_id=OuterRef('user_id')).order_by('-id')
+    ChatParticipantStatus.objects.filter(last_read_message__isnull=True).update(
+        last_read_message=Subquery(last_read.values('pk')[:1]),
+        last_read_at=Subquery(last_read.values('read_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0004_message_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatparticipantstatus',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, help_text='Когда пользователь последний раз отметил сообщения прочитанными', null=True, verbose_name='Время прочтения'),
+        ),
+        migrations.RunPython(fill_read_watermarks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:36
+
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def participants_key(user_ids):
+    # Копия Chat.make_participants_key: методы моделей в миграциях недоступны
+    key = ':'.join(str(user_id) for user_id in sorted(set(user_ids)))
+    if len(key) > 64:
+        key = 'sha256:' + hashlib.sha256(key.encode()).hexdigest()
+    return key
+
+
+def fill_participants_keys(apps, schema_editor):
+    """
+    Заполняет ключи участников чатов вне сделок. Если для набора участников
+    уже есть несколько чатов, ключ получает самый активный из них
+    """
+    Chat = apps.get_model('messaging', 'Chat')
+    Through = Chat.participants.through
+
+    members = {}
+    for chat_id, user_id in Through.objects.values_list('chat_id', 'user_id').iterator():
+        members.setdefault(chat_id, []).append(user_id)
+
+    chats = Chat.objects.filter(trade_offer__isnull=True, is_deleted=False).order_by(
+        models.F('last_message_time').desc(nulls_last=True), '-created_at', '-id'
+    )
+    taken = set()
+    updated = []
+    for chat in chats.only('id'):
+        user_ids = members.get(chat.id)
+        if not user_ids:
+            continue
+        key = participants_key(user_ids)
+        if key in taken:
+            continue
+        taken.add(key)
+        chat.participants_key = key
+        updated.append(chat)
+
+    Chat.objects.bulk_update(updated, ['participants_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0005_read_watermark'),
+        ('trades', '0002_tradeoffer_location'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='participants_key',
+            field=models.CharField(blank=True, editable=False, help_text='Канонический ключ набора участников для чатов вне сделок', max_length=80, null=True, verbose_name='Ключ участников'),
+        ),
+        migrations.RunPython(fill_participants_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chat',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False), ('trade_offer__isnull', True)), fields=('participants_key',), name='chat_participants_key_uniq'),
+        ),
+    ]
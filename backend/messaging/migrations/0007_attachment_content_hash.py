@@ -0,0 +1,22 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0006_chat_participants_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messageattachment',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 содержимого файла для дедупликации', max_length=64, verbose_name='Хеш содержимого'),
+        ),
+        migrations.AddIndex(
+            model_name='messageattachment',
+            index=models.Index(condition=models.Q(('content_hash', ''), _negated=True), fields=['content_hash'], name='attachment_content_hash_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Создает поисковый индекс сообщений для текущей СУБД и заполняет его
+    """
+    from messaging.search import get_search_backend, iter_documents
+
+    backend = get_search_backend(schema_editor.connection)
+    if backend is None:
+        return
+
+    backend.create_index()
+
+    Message = apps.get_model('messaging', 'Message')
+    batch = []
+    for document in iter_documents(Message):
+        batch.append(document)
+        if len(batch) >= 1000:
+            backend.index_documents(batch)
+            batch = []
+    backend.index_documents(batch)
+
+
+def drop_search_index(apps, schema_editor):
+    from messaging.search import get_search_backend
+
+    backend = get_search_backend(schema_editor.connection)
+    if backend is not None:
+        backend.drop_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0007_attachment_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def drop_search_index_foreign_key(apps, schema_editor):
+    """
+    Записи поискового индекса архивных сообщений должны пережить удаление
+    строки из messages: внешний ключ на messages в PostgreSQL убираем
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE message_search_index DROP CONSTRAINT IF EXISTS message_search_index_message_id_fkey'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0008_message_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='archived_until',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Время самого нового сообщения чата, перенесенного в архив', null=True, verbose_name='Архив до'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('content', models.TextField(verbose_name='Содержание')),
+                ('attachments', models.JSONField(blank=True, default=list, help_text='Поля вложений сообщения на момент архивации', verbose_name='Вложения')),
+                ('is_deleted', models.BooleanField(default=False, verbose_name='Удален')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата удаления')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(verbose_name='Дата обновления')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='messaging.chat', verbose_name='Чат')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Отправитель')),
+            ],
+            options={
+                'verbose_name': 'Архивное сообщение',
+                'verbose_name_plural': 'Архивные сообщения',
+                'db_table': 'archived_messages',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(condition=models.Q(('is_deleted', False)), fields=['chat', 'created_at', 'id'], name='archived_chat_created_id_idx')],
+            },
+        ),
+        migrations.RunPython(drop_search_index_foreign_key, migrations.RunPython.noop),
+    ]
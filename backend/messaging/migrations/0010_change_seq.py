@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0009_message_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Название')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Счетчик изменений',
+                'verbose_name_plural': 'Счетчики изменений',
+                'db_table': 'sync_counters',
+            },
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, help_text='Номер последнего изменения для дельта-синхронизации (messaging.sync)', verbose_name='Номер изменения'),
+        ),
+        migrations.AddField(
+            model_name='chatparticipantstatus',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, help_text='Номер последнего изменения для дельта-синхронизации (messaging.sync)', verbose_name='Номер изменения'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, help_text='Номер последнего изменения для дельта-синхронизации (messaging.sync)', verbose_name='Номер изменения'),
+        ),
+    ]
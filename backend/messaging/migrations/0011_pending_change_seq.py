@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-17 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0010_change_seq'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chat',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=None, editable=False, help_text='Номер последнего изменения для дельта-синхронизации (messaging.sync); NULL - номер еще не присвоен', null=True, verbose_name='Номер изменения'),
+        ),
+        migrations.AlterField(
+            model_name='chatparticipantstatus',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=None, editable=False, help_text='Номер последнего изменения для дельта-синхронизации (messaging.sync); NULL - номер еще не присвоен', null=True, verbose_name='Номер изменения'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=None, editable=False, help_text='Номер последнего изменения для дельта-синхронизации (messaging.sync); NULL - номер еще не присвоен', null=True, verbose_name='Номер изменения'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-17 04:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0011_pending_change_seq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('chat', 'Чат'), ('message', 'Сообщение')], max_length=10, verbose_name='Тип')),
+                ('object_id', models.BigIntegerField(verbose_name='ID удаленного объекта')),
+                ('chat_id', models.BigIntegerField(verbose_name='ID чата')),
+                ('change_seq', models.BigIntegerField(blank=True, db_index=True, null=True, verbose_name='Номер изменения')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')),
+                ('user', models.ForeignKey(blank=True, help_text='Кому адресовано удаление чата; для сообщений - всем участникам чата', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Запись об удалении',
+                'verbose_name_plural': 'Записи об удалении',
+                'db_table': 'sync_tombstones',
+            },
+        ),
+    ]
@@ -1,7 +1,13 @@
-from django.db import models
+import hashlib
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from common.models import TimeStampedModel, SoftDeleteModel
+from .sync import schedule_flush
 
 User = settings.AUTH_USER_MODEL
 
@@ -35,16 +41,108 @@ class Chat(TimeStampedModel, SoftDeleteModel):
         blank=True,
         help_text=_("Время отправки последнего сообщения в чате")
     )
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name=_("Последнее сообщение"),
+        help_text=_("Последнее неудаленное сообщение в чате")
+    )
+    participants_key = models.CharField(
+        _("Ключ участников"),
+        max_length=80,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_("Канонический ключ набора участников для чатов вне сделок")
+    )
+    archived_until = models.DateTimeField(
+        _("Архив до"),
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_("Время самого нового сообщения чата, перенесенного в архив")
+    )
+    change_seq = models.BigIntegerField(
+        _("Номер изменения"),
+        null=True,
+        default=None,
+        db_index=True,
+        editable=False,
+        help_text=_("Номер последнего изменения для дельта-синхронизации (messaging.sync); NULL - номер еще не присвоен")
+    )
 
     class Meta:
         db_table = 'chats'
         verbose_name = _("Чат")
         verbose_name_plural = _("Чаты")
         ordering = ['-last_message_time', '-created_at']
+        constraints = [
+            # Один активный чат вне сделок на каждый набор участников
+            models.UniqueConstraint(
+                fields=['participants_key'],
+                condition=Q(trade_offer__isnull=True, is_deleted=False),
+                name='chat_participants_key_uniq'
+            ),
+        ]
 
     def __str__(self):
         return f"Чат #{self.id}"
 
+    @staticmethod
+    def make_participants_key(user_ids):
+        """
+        Канонический ключ набора участников: отсортированные id через двоеточие,
+        для длинных наборов - SHA-256 от такой строки
+        """
+        key = ':'.join(str(user_id) for user_id in sorted({int(user_id) for user_id in user_ids}))
+        if len(key) > 64:
+            key = 'sha256:' + hashlib.sha256(key.encode()).hexdigest()
+        return key
+
+    @classmethod
+    def get_or_create_private(cls, user_ids):
+        """
+        Находит чат вне сделок с точно таким набором участников или создает его.
+        Поиск - один запрос по уникальному индексу; при одновременном создании
+        побеждает одна транзакция, остальные получают уже созданный чат.
+        Возвращает (чат, создан)
+        """
+        user_ids = sorted({int(user_id) for user_id in user_ids})
+        key = cls.make_participants_key(user_ids)
+        lookup = {'participants_key': key, 'trade_offer__isnull': True, 'is_deleted': False}
+
+        chat = cls.objects.filter(**lookup).first()
+        if chat is not None:
+            return chat, False
+
+        try:
+            with transaction.atomic():
+                chat = cls.objects.create(participants_key=key)
+                chat.participants.set(user_ids)
+                ChatParticipantStatus.objects.bulk_create([
+                    ChatParticipantStatus(chat=chat, user_id=user_id) for user_id in user_ids
+                ])
+        except IntegrityError:
+            return cls.objects.get(**lookup), False
+        return chat, True
+
+    @classmethod
+    def refresh_last_message(cls, chat_ids):
+        """
+        Пересчитывает указатель на последнее сообщение одним UPDATE
+        с подзапросом (после удаления сообщений)
+        """
+        latest = Message.objects.filter(
+            chat=OuterRef('pk'), is_deleted=False
+        ).order_by('-created_at', '-id')
+        cls.objects.filter(pk__in=chat_ids).update(
+            last_message=Subquery(latest.values('pk')[:1]),
+            last_message_time=Subquery(latest.values('created_at')[:1]),
+        )
+
 
 class Message(TimeStampedModel, SoftDeleteModel):
     """
@@ -79,17 +177,105 @@ class Message(TimeStampedModel, SoftDeleteModel):
         blank=True,
         help_text=_("Время, когда сообщение было прочитано")
     )
+    change_seq = models.BigIntegerField(
+        _("Номер изменения"),
+        null=True,
+        default=None,
+        db_index=True,
+        editable=False,
+        help_text=_("Номер последнего изменения для дельта-синхронизации (messaging.sync); NULL - номер еще не присвоен")
+    )
 
     class Meta:
         db_table = 'messages'
         verbose_name = _("Сообщение")
         verbose_name_plural = _("Сообщения")
         ordering = ['created_at']
+        indexes = [
+            # История чата с keyset-пагинацией по (created_at, id) без удаленных сообщений
+            models.Index(
+                fields=['chat', 'created_at', 'id'],
+                name='message_chat_created_id_idx',
+                condition=Q(is_deleted=False)
+            ),
+        ]
 
     def __str__(self):
         return f"Сообщение от {self.sender.username} в чате #{self.chat.id}"
 
 
+class ArchivedMessage(models.Model):
+    """
+    Сообщение, перенесенное из таблицы messages в архив (см. messaging.archive).
+    Сохраняет id исходного сообщения, вложения хранятся снимком в JSON
+    """
+    id = models.BigIntegerField(primary_key=True)
+    chat = models.ForeignKey(
+        Chat,
+        on_delete=models.CASCADE,
+        related_name='archived_messages',
+        verbose_name=_("Чат")
+    )
+    sender = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_("Отправитель")
+    )
+    content = models.TextField(_("Содержание"))
+    attachments = models.JSONField(
+        _("Вложения"),
+        default=list,
+        blank=True,
+        help_text=_("Поля вложений сообщения на момент архивации")
+    )
+    is_deleted = models.BooleanField(_("Удален"), default=False)
+    deleted_at = models.DateTimeField(_("Дата удаления"), null=True, blank=True)
+    created_at = models.DateTimeField(_("Дата создания"))
+    updated_at = models.DateTimeField(_("Дата обновления"))
+    archived_at = models.DateTimeField(_("Дата архивации"), auto_now_add=True)
+
+    class Meta:
+        db_table = 'archived_messages'
+        verbose_name = _("Архивное сообщение")
+        verbose_name_plural = _("Архивные сообщения")
+        ordering = ['created_at']
+        indexes = [
+            models.Index(
+                fields=['chat', 'created_at', 'id'],
+                name='archived_chat_created_id_idx',
+                condition=Q(is_deleted=False)
+            ),
+        ]
+
+    def __str__(self):
+        return f"Архивное сообщение #{self.id} в чате #{self.chat_id}"
+
+    def as_message(self):
+        """
+        Несохраняемый экземпляр Message с вложениями из снимка: архивные
+        сообщения отдаются тем же сериализатором, что и обычные
+        """
+        message = Message(
+            id=self.id,
+            chat_id=self.chat_id,
+            sender_id=self.sender_id,
+            content=self.content,
+            is_deleted=self.is_deleted,
+            deleted_at=self.deleted_at,
+            created_at=self.created_at,
+            updated_at=self.updated_at,
+        )
+        if 'sender' in self._state.fields_cache:
+            message.sender = self.sender
+        message._prefetched_objects_cache = {
+            'attachments': [
+                MessageAttachment(message=message, **attachment) for attachment in self.attachments
+            ]
+        }
+        return message
+
+
 class MessageAttachment(TimeStampedModel):
     """
     Модель для вложений к сообщениям
@@ -120,11 +306,31 @@ class MessageAttachment(TimeStampedModel):
         max_length=100,
         help_text=_("MIME-тип файла")
     )
+    derivatives = models.JSONField(
+        _("Производные изображения"),
+        default=dict,
+        blank=True,
+        help_text=_("Уменьшенные копии изображения по размерам IMAGE_SIZES")
+    )
+    content_hash = models.CharField(
+        _("Хеш содержимого"),
+        max_length=64,
+        blank=True,
+        default='',
+        help_text=_("SHA-256 содержимого файла для дедупликации")
+    )
 
     class Meta:
         db_table = 'message_attachments'
         verbose_name = _("Вложение к сообщению")
         verbose_name_plural = _("Вложения к сообщениям")
+        indexes = [
+            models.Index(
+                fields=['content_hash'],
+                name='attachment_content_hash_idx',
+                condition=~Q(content_hash='')
+            ),
+        ]
 
     def __str__(self):
         return f"Вложение {self.file_name} к сообщению #{self.message.id}"
@@ -154,6 +360,12 @@ class ChatParticipantStatus(models.Model):
         related_name='+',
         verbose_name=_("Последнее прочитанное сообщение")
     )
+    last_read_at = models.DateTimeField(
+        _("Время прочтения"),
+        null=True,
+        blank=True,
+        help_text=_("Когда пользователь последний раз отметил сообщения прочитанными")
+    )
     unread_count = models.PositiveIntegerField(
         _("Непрочитанных сообщений"), 
         default=0,
@@ -164,6 +376,14 @@ class ChatParticipantStatus(models.Model):
         default=False,
         help_text=_("Отключены ли уведомления для этого чата")
     )
+    change_seq = models.BigIntegerField(
+        _("Номер изменения"),
+        null=True,
+        default=None,
+        db_index=True,
+        editable=False,
+        help_text=_("Номер последнего изменения для дельта-синхронизации (messaging.sync); NULL - номер еще не присвоен")
+    )
     
     class Meta:
         db_table = 'chat_participant_statuses'
@@ -173,3 +393,107 @@ class ChatParticipantStatus(models.Model):
 
     def __str__(self):
         return f"Статус {self.user.username} в чате #{self.chat.id}"
+
+    @classmethod
+    def increment_unread(cls, chat_id, sender_id):
+        """Увеличивает счетчик непрочитанных всем участникам, кроме отправителя, одним UPDATE"""
+        updated = cls.objects.filter(chat_id=chat_id).exclude(user_id=sender_id).update(
+            unread_count=F('unread_count') + 1, change_seq=None
+        )
+        schedule_flush()
+        return updated
+
+    @classmethod
+    def mark_read(cls, chat_id, user_id, message_id):
+        """
+        Сдвигает отметку прочтения пользователя до сообщения message_id
+        (все сообщения до него включительно считаются прочитанными) и
+        пересчитывает счетчик непрочитанных. Строки сообщений не изменяются.
+        Возвращает True, если отметка сдвинулась
+        """
+        if message_id is None:
+            # В чате нет сообщений
+            cls.objects.get_or_create(chat_id=chat_id, user_id=user_id)
+            updated = cls.objects.filter(chat_id=chat_id, user_id=user_id, unread_count__gt=0).update(
+                unread_count=0, change_seq=None
+            )
+            if updated:
+                schedule_flush()
+            return bool(updated)
+
+        unread = Message.objects.filter(
+            chat_id=chat_id, id__gt=message_id, is_deleted=False
+        ).exclude(sender_id=user_id).order_by().values('chat_id').annotate(total=Count('id')).values('total')
+
+        def advance():
+            # Отметка только сдвигается вперед: устаревший запрос ее не откатит
+            return cls.objects.filter(chat_id=chat_id, user_id=user_id).filter(
+                Q(last_read_message__isnull=True) | Q(last_read_message__lt=message_id)
+            ).update(
+                last_read_message_id=message_id,
+                last_read_at=timezone.now(),
+                unread_count=Coalesce(Subquery(unread), 0),
+                change_seq=None,
+            )
+
+        updated = advance()
+        if not updated:
+            _, created = cls.objects.get_or_create(chat_id=chat_id, user_id=user_id)
+            if created:
+                updated = advance()
+        if updated:
+            schedule_flush()
+        return bool(updated)
+
+
+class SyncCounter(models.Model):
+    """
+    Монотонный счетчик изменений чатов для дельта-синхронизации (messaging.sync)
+    """
+    name = models.CharField(_("Название"), max_length=50, primary_key=True)
+    value = models.BigIntegerField(_("Значение"), default=0)
+
+    class Meta:
+        db_table = 'sync_counters'
+        verbose_name = _("Счетчик изменений")
+        verbose_name_plural = _("Счетчики изменений")
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class SyncTombstone(models.Model):
+    """
+    Удаление, которое дельта-синхронизация не может прочитать из самих строк
+    (messaging.sync): чат, из которого пользователь удален или который удален
+    из БД, и сообщение, удаленное из БД или перенесенное в архив мягко удаленным
+    """
+    KIND_CHAT = 'chat'
+    KIND_MESSAGE = 'message'
+    KIND_CHOICES = (
+        (KIND_CHAT, _("Чат")),
+        (KIND_MESSAGE, _("Сообщение")),
+    )
+
+    kind = models.CharField(_("Тип"), max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField(_("ID удаленного объекта"))
+    chat_id = models.BigIntegerField(_("ID чата"))
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name=_("Пользователь"),
+        help_text=_("Кому адресовано удаление чата; для сообщений - всем участникам чата")
+    )
+    change_seq = models.BigIntegerField(_("Номер изменения"), null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(_("Дата создания"), auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'sync_tombstones'
+        verbose_name = _("Запись об удалении")
+        verbose_name_plural = _("Записи об удалении")
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id}: {self.change_seq}"
@@ -0,0 +1,396 @@
+"""
+Доставка событий чатов в реальном времени через WebSocket (ASGI).
+
+Клиент подключается к /ws/chats/<id>/ и передает JWT-токен доступа в
+заголовке Authorization: Bearer ... или, если заголовок задать нельзя
+(браузер), первым сообщением после подключения:
+
+    {"type": "auth", "token": "..."}         ->  {"type": "auth.ok", "chat": 1}
+
+Токен не передается в URL, чтобы не попадать в журналы прокси и веб-сервера.
+После проверки токена и участия в чате соединение подписывается на группы:
+
+- chat.<id> - новые сообщения и отметки о прочтении в чате;
+- user.<id> - изменения статуса пользователя в его чатах (ChatParticipantStatus);
+- chat.<id>.member.<user_id> - отзыв доступа: пользователя удалили из чата или
+  чат удален. Соединение получает {"type": "chat.removed", "chat": 1} и
+  закрывается с кодом 4403.
+
+События - JSON-объекты с полем type:
+
+    {"type": "message.created", "chat": 1, "message": {...}}
+    {"type": "chat.read", "chat": 1, "user": 2, "read_at": "..."}
+    {"type": "message.read", "chat": 1, "message": 10, "user": 2, "read_at": "..."}
+    {"type": "status.updated", "chat": 1, "user": 2, "unread_count": 0, "is_muted": false}
+
+Доставкой между соединениями занимается брокер из MESSAGING_REALTIME_BROKER.
+InMemoryBroker работает в пределах одного процесса: HTTP-запросы и WebSocket
+обслуживает один процесс uvicorn (start.sh), а запуск с несколькими
+процессами запрещает проверка messaging.E001 (messaging.checks). Для
+нескольких процессов или узлов подключается брокер с тем же интерфейсом,
+что у BaseBroker, и single_process = False.
+"""
+import asyncio
+import functools
+import json
+import logging
+import re
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CHAT_PATH = re.compile(r'^/ws/chats/(?P<chat_id>\d+)/?$')
+
+# Коды закрытия соединения
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def chat_group(chat_id):
+    return f'chat.{chat_id}'
+
+
+def user_group(user_id):
+    return f'user.{user_id}'
+
+
+def member_group(chat_id, user_id):
+    return f'chat.{chat_id}.member.{user_id}'
+
+
+class BaseBroker:
+    """
+    Интерфейс брокера событий.
+
+    publish вызывается из синхронного кода в любом потоке и не должен блокировать;
+    subscribe вызывается в цикле событий ASGI-сервера.
+    single_process - события доходят только до соединений того же процесса.
+    """
+    single_process = False
+
+    def subscribe(self, groups):
+        """Возвращает подписку (Subscription) на события групп"""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        """Отменяет подписку"""
+        raise NotImplementedError
+
+    def publish(self, group, payload):
+        """Рассылает подписчикам группы событие - JSON-строку"""
+        raise NotImplementedError
+
+
+class Subscription:
+    """Очередь событий одного соединения, привязанная к его циклу событий"""
+
+    def __init__(self, groups, queue_size):
+        self.groups = tuple(groups)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def deliver(self, payload):
+        """Ставит событие в очередь; вызывается в цикле событий подписчика"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: закрываем соединение, он восстановит состояние через REST
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        """Ожидает следующее событие; None означает переполнение очереди"""
+        return await self.queue.get()
+
+
+class InMemoryBroker(BaseBroker):
+    """Брокер в памяти процесса: для одного процесса и тестов"""
+    single_process = True
+
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, groups):
+        subscription = Subscription(groups, getattr(settings, 'MESSAGING_REALTIME_QUEUE_SIZE', 100))
+        with self._lock:
+            for group in subscription.groups:
+                self._groups.setdefault(group, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for group in subscription.groups:
+                subscribers = self._groups.get(group)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._groups[group]
+
+    def publish(self, group, payload):
+        with self._lock:
+            subscribers = list(self._groups.get(group, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, payload)
+            except RuntimeError:
+                # Цикл событий подписчика уже закрыт
+                self.unsubscribe(subscription)
+        return len(subscribers)
+
+    def subscriber_count(self, group=None):
+        """Количество подписок (всего или в группе)"""
+        with self._lock:
+            if group is not None:
+                return len(self._groups.get(group, ()))
+            return len({sub for subscribers in self._groups.values() for sub in subscribers})
+
+
+@functools.lru_cache(maxsize=None)
+def get_broker():
+    """Возвращает брокер событий процесса"""
+    return import_string(settings.MESSAGING_REALTIME_BROKER)()
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    if setting == 'MESSAGING_REALTIME_BROKER':
+        get_broker.cache_clear()
+
+
+# ---------------------------------------------------------------------- публикация
+
+def publish_event(groups, event):
+    """
+    Публикует событие в группы после фиксации текущей транзакции.
+    Событие кодируется в JSON один раз для всех получателей
+    """
+    def send():
+        payload = json.dumps(event, cls=DjangoJSONEncoder, ensure_ascii=False)
+        broker = get_broker()
+        for group in groups:
+            try:
+                broker.publish(group, payload)
+            except Exception:
+                logger.exception(f"Ошибка публикации события {event.get('type')} в группу {group}")
+
+    transaction.on_commit(send)
+
+
+def publish_message_created(message):
+    """Новое сообщение для участников чата"""
+    def send():
+        from .serializers import MessageSerializer
+        publish_event([chat_group(message.chat_id)], {
+            'type': 'message.created',
+            'chat': message.chat_id,
+            'message': MessageSerializer(message).data,
+        })
+
+    # Сериализуем после фиксации, когда вложения сообщения уже сохранены
+    transaction.on_commit(send)
+
+
+def publish_status(status):
+    """Изменение статуса пользователя в чате - только самому пользователю"""
+    publish_event([user_group(status.user_id)], {
+        'type': 'status.updated',
+        'chat': status.chat_id,
+        'user': status.user_id,
+        'unread_count': status.unread_count,
+        'is_muted': status.is_muted,
+        'last_read_message': status.last_read_message_id,
+    })
+
+
+def publish_statuses(statuses):
+    """Публикует статусы после массового изменения через QuerySet.update"""
+    for status in statuses:
+        publish_status(status)
+
+
+def publish_read_receipt(chat_id, user_id, read_at, message_id=None):
+    """Отметка о прочтении чата или отдельного сообщения"""
+    event = {'type': 'chat.read', 'chat': chat_id, 'user': user_id, 'read_at': read_at}
+    if message_id is not None:
+        event.update(type='message.read', message=message_id)
+    publish_event([chat_group(chat_id)], event)
+
+
+def publish_membership_revoked(chat_id, user_ids):
+    """Закрывает соединения пользователей, потерявших доступ к чату"""
+    user_ids = list(user_ids)
+    if user_ids:
+        publish_event(
+            [member_group(chat_id, user_id) for user_id in user_ids],
+            {'type': 'chat.removed', 'chat': chat_id}
+        )
+
+
+# ---------------------------------------------------------------------- соединения
+
+def _authenticate(token):
+    """Возвращает пользователя по JWT-токену доступа или None"""
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+
+    if not token:
+        return None
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(token))
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+
+
+def _is_participant(chat_id, user):
+    from .models import Chat
+    return Chat.objects.filter(pk=chat_id, participants=user, is_deleted=False).exists()
+
+
+def _connect(token):
+    """Проверяет токен; возвращает активного пользователя или None"""
+    close_old_connections()
+    try:
+        user = _authenticate(token)
+        return user if user is not None and user.is_active else None
+    finally:
+        close_old_connections()
+
+
+def _check_participant(chat_id, user):
+    close_old_connections()
+    try:
+        return _is_participant(chat_id, user)
+    finally:
+        close_old_connections()
+
+
+def _get_header_token(scope):
+    """Токен из заголовка Authorization: Bearer ..."""
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0].lower() == 'bearer':
+                return parts[1]
+    return None
+
+
+async def _receive_auth_token(receive):
+    """Ожидает первое сообщение {"type": "auth", "token": ...}; None - нет токена или отключение"""
+    timeout = getattr(settings, 'MESSAGING_REALTIME_AUTH_TIMEOUT', 10)
+    try:
+        event = await asyncio.wait_for(receive(), timeout)
+    except asyncio.TimeoutError:
+        return None
+    if event['type'] != 'websocket.receive':
+        return None
+    try:
+        frame = json.loads(event.get('text') or '')
+    except ValueError:
+        return None
+    if not isinstance(frame, dict) or frame.get('type') != 'auth' or not isinstance(frame.get('token'), str):
+        return None
+    return frame['token']
+
+
+def _is_ping(text):
+    try:
+        return json.loads(text or '').get('type') == 'ping'
+    except (ValueError, AttributeError):
+        return False
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI-приложение WebSocket-соединений чатов"""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    match = CHAT_PATH.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+
+    chat_id = int(match['chat_id'])
+    token = _get_header_token(scope)
+    accepted = False
+    if token is None:
+        # Токен придет первым сообщением: для обмена сообщениями соединение нужно принять
+        await send({'type': 'websocket.accept'})
+        accepted = True
+        token = await _receive_auth_token(receive)
+
+    user = await sync_to_async(_connect)(token) if token else None
+    if user is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    # Подписка до проверки участия: удаление из чата после проверки не будет пропущено
+    broker = get_broker()
+    subscription = broker.subscribe([chat_group(chat_id), user_group(user.pk)])
+    revocation = broker.subscribe([member_group(chat_id, user.pk)])
+    if not await sync_to_async(_check_participant)(chat_id, user):
+        broker.unsubscribe(subscription)
+        broker.unsubscribe(revocation)
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    if accepted:
+        await send({'type': 'websocket.send', 'text': json.dumps({'type': 'auth.ok', 'chat': chat_id})})
+    else:
+        await send({'type': 'websocket.accept'})
+    logger.debug(f"WebSocket подключен: chat={chat_id}, user={user.pk}")
+
+    async def forward():
+        while True:
+            payload = await subscription.get()
+            if payload is None:
+                logger.warning(f"Очередь событий WebSocket переполнена: chat={chat_id}, user={user.pk}")
+                await send({'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+                return
+            await send({'type': 'websocket.send', 'text': payload})
+
+    async def revoke():
+        payload = await revocation.get()
+        logger.debug(f"Доступ к чату отозван: chat={chat_id}, user={user.pk}")
+        if payload is not None:
+            await send({'type': 'websocket.send', 'text': payload})
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+
+    forwarder = asyncio.ensure_future(forward())
+    revoker = asyncio.ensure_future(revoke())
+    try:
+        while True:
+            receiver_task = asyncio.ensure_future(receive())
+            done, _ = await asyncio.wait(
+                {receiver_task, forwarder, revoker}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if forwarder in done or revoker in done:
+                receiver_task.cancel()
+                return
+            event = receiver_task.result()
+            if event['type'] == 'websocket.disconnect':
+                return
+            if event['type'] == 'websocket.receive' and _is_ping(event.get('text')):
+                await send({'type': 'websocket.send', 'text': '{"type": "pong"}'})
+    finally:
+        forwarder.cancel()
+        revoker.cancel()
+        broker.unsubscribe(subscription)
+        broker.unsubscribe(revocation)
+        logger.debug(f"WebSocket отключен: chat={chat_id}, user={user.pk}")
@@ -0,0 +1,261 @@
+"""
+Полнотекстовый поиск по сообщениям чатов.
+
+Используется та же нормализация текста, что и в поиске предметов
+(items.search.analyze/query_terms: русский стеммер и транслитерация).
+Индекс хранит только неудаленные сообщения (включая перенесенные в архив,
+см. messaging.archive) и обновляется инкрементально после фиксации транзакции:
+
+- SQLite: виртуальная таблица FTS5 (rowid = id сообщения) с колонкой чата,
+  по которой поиск ограничивается чатами пользователя прямо в MATCH;
+- PostgreSQL: таблица с колонкой tsvector (GIN-индекс) и id чата (B-tree).
+
+Результаты упорядочены от новых сообщений к старым, следующая страница
+запрашивается по id последнего найденного сообщения, поэтому выдача
+страницы не требует ранжирования всех совпадений.
+"""
+import logging
+import threading
+
+from django.db import connection, transaction
+
+from items.search import analyze, query_terms
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'message_search_index'
+
+
+def chat_token(chat_id):
+    """Термин колонки чата в индексе FTS5"""
+    return f'c{chat_id}'
+
+
+def iter_documents(message_model, message_ids=None, batch_size=1000):
+    """
+    Генерирует документы индекса (id, chat_id, текст) пачками.
+    Модель передается явно, чтобы функцию можно было вызывать из миграций
+    """
+    messages = message_model.objects.filter(is_deleted=False).order_by('id')
+    if message_ids is not None:
+        messages = messages.filter(id__in=list(message_ids))
+
+    last_id = 0
+    while True:
+        batch = list(messages.filter(id__gt=last_id).values_list('id', 'chat_id', 'content')[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        for message_id, chat_id, content in batch:
+            yield message_id, chat_id, ' '.join(analyze(content))
+
+
+class BaseMessageSearchBackend:
+    """Базовый класс поискового бэкенда сообщений"""
+    vendor = None
+
+    def __init__(self, db_connection=None):
+        self.connection = db_connection or connection
+
+    def create_index(self):
+        raise NotImplementedError
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+
+    def index_documents(self, documents):
+        raise NotImplementedError
+
+    def remove_messages(self, message_ids):
+        raise NotImplementedError
+
+    def search(self, query, chat_ids, before_id=None, limit=20):
+        """Возвращает id сообщений из chat_ids, подходящих под запрос, от новых к старым"""
+        raise NotImplementedError
+
+
+class SQLiteFTS5Backend(BaseMessageSearchBackend):
+    """Поиск через виртуальную таблицу SQLite FTS5"""
+    vendor = 'sqlite'
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+                f"USING fts5(content, chat, tokenize='unicode61 remove_diacritics 0')"
+            )
+
+    def index_documents(self, documents):
+        documents = [
+            (message_id, content, chat_token(chat_id)) for message_id, chat_id, content in documents
+        ]
+        if not documents:
+            return 0
+        with self.connection.cursor() as cursor:
+            self._delete(cursor, [doc[0] for doc in documents])
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, content, chat) VALUES (%s, %s, %s)', documents
+            )
+        return len(documents)
+
+    def remove_messages(self, message_ids):
+        message_ids = list(message_ids)
+        if message_ids:
+            with self.connection.cursor() as cursor:
+                self._delete(cursor, message_ids)
+
+    def _delete(self, cursor, message_ids):
+        # Ограничение SQLite на количество параметров в одном запросе
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', chunk)
+
+    def search(self, query, chat_ids, before_id=None, limit=20):
+        groups = query_terms(query)
+        chat_ids = list(chat_ids)
+        if not groups or not chat_ids:
+            return []
+        terms = ' AND '.join(
+            '(' + ' OR '.join(f'"{term}"*' for term in group) + ')' for group in groups
+        )
+        chats = ' OR '.join(f'"{chat_token(chat_id)}"' for chat_id in chat_ids)
+        expression = f'{{content}} : ({terms}) AND {{chat}} : ({chats})'
+
+        sql = f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s'
+        params = [expression]
+        if before_id is not None:
+            sql += ' AND rowid < %s'
+            params.append(before_id)
+        sql += ' ORDER BY rowid DESC LIMIT %s'
+        params.append(limit)
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresTsvectorBackend(BaseMessageSearchBackend):
+    """Поиск через колонку tsvector с GIN-индексом в PostgreSQL"""
+    vendor = 'postgresql'
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                f'message_id bigint PRIMARY KEY, '
+                f'chat_id bigint NOT NULL, '
+                f'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx '
+                f'ON {SEARCH_TABLE} USING GIN (document)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_chat_idx '
+                f'ON {SEARCH_TABLE} (chat_id, message_id)'
+            )
+
+    def index_documents(self, documents):
+        documents = list(documents)
+        if not documents:
+            return 0
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (message_id, chat_id, document) "
+                f"VALUES (%s, %s, to_tsvector('simple', %s)) "
+                f"ON CONFLICT (message_id) DO UPDATE SET chat_id = EXCLUDED.chat_id, document = EXCLUDED.document",
+                documents
+            )
+        return len(documents)
+
+    def remove_messages(self, message_ids):
+        message_ids = list(message_ids)
+        if message_ids:
+            with self.connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE message_id = ANY(%s)', [message_ids])
+
+    def search(self, query, chat_ids, before_id=None, limit=20):
+        groups = query_terms(query)
+        chat_ids = list(chat_ids)
+        if not groups or not chat_ids:
+            return []
+        expression = ' & '.join(
+            '(' + ' | '.join(f'{term}:*' for term in group) + ')' for group in groups
+        )
+
+        sql = (
+            f"SELECT message_id FROM {SEARCH_TABLE} "
+            f"WHERE chat_id = ANY(%s) AND document @@ to_tsquery('simple', %s)"
+        )
+        params = [chat_ids, expression]
+        if before_id is not None:
+            sql += ' AND message_id < %s'
+            params.append(before_id)
+        sql += ' ORDER BY message_id DESC LIMIT %s'
+        params.append(limit)
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    backend.vendor: backend
+    for backend in (SQLiteFTS5Backend, PostgresTsvectorBackend)
+}
+
+
+def get_search_backend(db_connection=None):
+    """
+    Возвращает поисковый бэкенд сообщений для текущей СУБД или None,
+    если СУБД не поддерживается (тогда используется icontains-поиск)
+    """
+    db_connection = db_connection or connection
+    backend_class = BACKENDS.get(db_connection.vendor)
+    if backend_class is None:
+        return None
+    return backend_class(db_connection)
+
+
+# --- Инкрементальное обновление индекса ---------------------------------------
+
+_pending = threading.local()
+
+
+def index_messages(message_ids):
+    """Переиндексирует сообщения (удаленные и мягко удаленные убираются из индекса)"""
+    from .models import Message
+
+    backend = get_search_backend()
+    if backend is None:
+        return
+    message_ids = set(message_ids)
+    documents = list(iter_documents(Message, message_ids))
+    backend.index_documents(documents)
+    backend.remove_messages(message_ids - {doc[0] for doc in documents})
+    logger.debug(f"Поисковый индекс сообщений обновлен: {len(documents)} сообщений")
+
+
+def _flush_pending():
+    message_ids = getattr(_pending, 'message_ids', None)
+    if not message_ids:
+        return
+    _pending.message_ids = set()
+    try:
+        index_messages(message_ids)
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении поискового индекса сообщений: {e}")
+
+
+def schedule_reindex(message_ids):
+    """Откладывает переиндексацию сообщений до фиксации транзакции"""
+    if not hasattr(_pending, 'message_ids'):
+        _pending.message_ids = set()
+    _pending.message_ids.update(message_ids)
+    transaction.on_commit(_flush_pending)
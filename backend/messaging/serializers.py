@@ -1,7 +1,11 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from django.db.models import Q, Max, Count
+from django.db.models import Q, Max
 from .models import Chat, Message, MessageAttachment, ChatParticipantStatus
+from django.db import transaction
+from common.images import derivative_urls, schedule_derivatives
+from .attachments import build_attachments
+from .realtime import publish_statuses
 from authentication.serializers import UserSerializer
 
 User = get_user_model()
@@ -9,20 +13,42 @@ User = get_user_model()
 
 class MessageAttachmentSerializer(serializers.ModelSerializer):
     """Сериализатор для вложений к сообщениям"""
+    image_urls = serializers.SerializerMethodField()
     
     class Meta:
         model = MessageAttachment
         fields = [
             'id', 'file', 'file_name', 'file_size', 
-            'file_type', 'created_at'
+            'file_type', 'image_urls', 'created_at'
         ]
         read_only_fields = ['id', 'created_at']
+    
+    def get_image_urls(self, obj):
+        """URL уменьшенных копий для вложений-изображений"""
+        return derivative_urls(obj.derivatives)
+
+
+def read_watermarks(statuses):
+    """Отметки прочтения участников чата: {user_id: (last_read_message_id, last_read_at)}"""
+    return {
+        status.user_id: (status.last_read_message_id, status.last_read_at)
+        for status in statuses
+    }
 
 
 class MessageSerializer(serializers.ModelSerializer):
-    """Сериализатор для сообщений"""
+    """
+    Сериализатор для сообщений.
+
+    Состояние прочтения вычисляется по отметкам ChatParticipantStatus.last_read_message:
+    сообщение прочитано, если его прочитал кто-то из участников, кроме отправителя.
+    Отметки чата загружаются один раз и кэшируются в контексте сериализатора
+    (context['read_watermarks'] = {chat_id: {...}})
+    """
     sender_details = UserSerializer(source='sender', read_only=True)
     attachments = MessageAttachmentSerializer(many=True, read_only=True)
+    is_read = serializers.SerializerMethodField()
+    read_at = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
@@ -30,7 +56,29 @@ class MessageSerializer(serializers.ModelSerializer):
             'id', 'chat', 'sender', 'sender_details', 'content',
             'is_read', 'read_at', 'attachments', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'sender', 'is_read', 'read_at', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'sender', 'created_at', 'updated_at']
+
+    def _read_by(self, obj):
+        """Время прочтения участников (кроме отправителя), прочитавших сообщение"""
+        by_chat = self.context.setdefault('read_watermarks', {})
+        if obj.chat_id not in by_chat:
+            by_chat[obj.chat_id] = read_watermarks(
+                ChatParticipantStatus.objects.filter(chat_id=obj.chat_id).only(
+                    'user_id', 'last_read_message_id', 'last_read_at'
+                )
+            )
+        return [
+            read_at for user_id, (message_id, read_at) in by_chat[obj.chat_id].items()
+            if user_id != obj.sender_id and message_id is not None and message_id >= obj.id
+        ]
+
+    def get_is_read(self, obj):
+        return bool(self._read_by(obj))
+
+    def get_read_at(self, obj):
+        """Самая ранняя отметка прочтения среди прочитавших"""
+        times = [read_at for read_at in self._read_by(obj) if read_at is not None]
+        return serializers.DateTimeField().to_representation(min(times)) if times else None
 
     def create(self, validated_data):
         validated_data['sender'] = self.context['request'].user
@@ -50,26 +98,32 @@ class CreateMessageSerializer(serializers.ModelSerializer):
         fields = ['chat', 'content', 'attachments']
 
     def create(self, validated_data):
+        """
+        Отправка сообщения в одной транзакции фиксированным числом запросов:
+        вставка сообщения, обновление последнего сообщения чата (сигнал post_save),
+        пакетная вставка вложений и один UPDATE счетчиков непрочитанных
+        """
         attachments_data = validated_data.pop('attachments', [])
         validated_data['sender'] = self.context['request'].user
         
-        message = super().create(validated_data)
-        
-        # Создаем вложения
-        for attachment_file in attachments_data:
-            MessageAttachment.objects.create(
-                message=message,
-                file=attachment_file,
-                file_name=attachment_file.name,
-                file_size=attachment_file.size,
-                file_type=getattr(attachment_file, 'content_type', 'application/octet-stream')
+        with transaction.atomic():
+            message = super().create(validated_data)
+            
+            # Файлы передаются в хранилище потоком, одинаковые - один раз
+            attachments = MessageAttachment.objects.bulk_create(
+                build_attachments(message, attachments_data)
             )
+            
+            ChatParticipantStatus.increment_unread(message.chat_id, message.sender_id)
         
-        # Обновляем время последнего сообщения в чате
-        chat = message.chat
-        chat.last_message_time = message.created_at
-        chat.save(update_fields=['last_message_time'])
+        # bulk_create не вызывает post_save: производные изображений ставим в очередь явно
+        for attachment in attachments:
+            if attachment.file_type.startswith('image/'):
+                schedule_derivatives(attachment, file_field='file')
         
+        publish_statuses(
+            ChatParticipantStatus.objects.filter(chat_id=message.chat_id).exclude(user_id=message.sender_id)
+        )
         return message
 
 
@@ -79,8 +133,8 @@ class ChatParticipantStatusSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatParticipantStatus
         fields = [
-            'user', 'last_read_message', 'unread_count', 
-            'is_muted'
+            'chat', 'user', 'last_read_message', 'last_read_at',
+            'unread_count', 'is_muted'
         ]
 
 
@@ -101,33 +155,39 @@ class ChatSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'last_message_time', 'created_at']
 
     def get_last_message(self, obj):
-        """Получает последнее сообщение в чате"""
-        last_message = obj.messages.filter(is_deleted=False).last()
-        if last_message:
-            return MessageSerializer(last_message).data
-        return None
+        """Получает последнее сообщение в чате по указателю Chat.last_message"""
+        if obj.last_message_id is None:
+            return None
+        if 'participant_statuses' in getattr(obj, '_prefetched_objects_cache', {}):
+            # Отметки прочтения берем из загруженных статусов участников
+            self.context.setdefault('read_watermarks', {})[obj.id] = read_watermarks(obj.participant_statuses.all())
+        return MessageSerializer(obj.last_message, context=self.context).data
 
-    def get_unread_count(self, obj):
-        """Получает количество непрочитанных сообщений для текущего пользователя"""
+    def _current_status(self, obj):
+        """
+        Статус текущего пользователя в чате. В списке чатов поля статуса уже
+        аннотированы (ChatViewSet.get_queryset), иначе выполняется запрос
+        """
+        if hasattr(obj, 'current_unread_count'):
+            return obj.current_unread_count, obj.current_is_muted
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            try:
-                status = obj.participant_statuses.get(user=request.user)
-                return status.unread_count
-            except ChatParticipantStatus.DoesNotExist:
-                return 0
-        return 0
+            status = obj.participant_statuses.filter(user=request.user).values_list(
+                'unread_count', 'is_muted'
+            ).first()
+            if status:
+                return status
+        return None, None
+
+    def get_unread_count(self, obj):
+        """Получает количество непрочитанных сообщений для текущего пользователя"""
+        unread_count, _ = self._current_status(obj)
+        return unread_count or 0
 
     def get_is_muted(self, obj):
         """Проверяет отключены ли уведомления для текущего пользователя"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            try:
-                status = obj.participant_statuses.get(user=request.user)
-                return status.is_muted
-            except ChatParticipantStatus.DoesNotExist:
-                return False
-        return False
+        _, is_muted = self._current_status(obj)
+        return bool(is_muted)
 
 
 class CreateChatSerializer(serializers.ModelSerializer):
@@ -177,24 +237,16 @@ class CreateChatSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         participants_ids = validated_data.pop('participants')
         
-        # Проверяем есть ли уже чат между этими пользователями
-        if validated_data.get('trade_offer'):
-            # Для чата сделки проверяем по trade_offer
-            existing_chat = Chat.objects.filter(
-                trade_offer=validated_data['trade_offer'],
-                is_deleted=False
-            ).first()
-        else:
-            # Для обычного чата проверяем по участникам
-            existing_chat = Chat.objects.filter(
-                participants__in=participants_ids,
-                trade_offer__isnull=True,
-                is_deleted=False
-            ).annotate(
-                participant_count=Count('participants')
-            ).filter(
-                participant_count=len(participants_ids)
-            ).first()
+        if not validated_data.get('trade_offer'):
+            # Обычный чат ищется по ключу набора участников одним запросом по индексу
+            chat, _ = Chat.get_or_create_private(participants_ids)
+            return chat
+        
+        # Для чата сделки проверяем по trade_offer
+        existing_chat = Chat.objects.filter(
+            trade_offer=validated_data['trade_offer'],
+            is_deleted=False
+        ).first()
         
         if existing_chat:
             # Если такой чат уже существует, возвращаем его
@@ -211,4 +263,4 @@ class CreateChatSerializer(serializers.ModelSerializer):
                 user_id=user_id
             )
         
-        return chat 
\ No newline at end of file
+        return chat
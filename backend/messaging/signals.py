@@ -0,0 +1,168 @@
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from common.images import schedule_derivatives
+from .models import Chat, Message, MessageAttachment, ChatParticipantStatus
+from .realtime import publish_membership_revoked, publish_message_created, publish_status
+from .search import schedule_reindex
+from .sync import mark_changed, mark_saved, record_removed_chat, record_removed_messages
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Message)
+def update_chat_last_message(sender, instance, created, **kwargs):
+    """
+    Поддерживает указатель Chat.last_message: новое сообщение становится
+    последним, если оно не старше текущего; удаленное - пересчитывается
+    """
+    if created and not instance.is_deleted:
+        Chat.objects.filter(pk=instance.chat_id).filter(
+            Q(last_message_time__isnull=True) | Q(last_message_time__lte=instance.created_at)
+        ).update(last_message=instance, last_message_time=instance.created_at)
+        publish_message_created(instance)
+    elif instance.is_deleted:
+        Chat.refresh_last_message([instance.chat_id])
+
+
+@receiver(post_delete, sender=Message)
+def refresh_chat_last_message(sender, instance, **kwargs):
+    """Пересчитывает последнее сообщение чата после удаления сообщения"""
+    Chat.refresh_last_message([instance.chat_id])
+
+
+@receiver(post_delete, sender=Message)
+def record_deleted_message(sender, instance, **kwargs):
+    """Удаленное из БД сообщение попадает в дельту синхронизации как удаление"""
+    record_removed_messages([(instance.pk, instance.chat_id)])
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def reindex_message(sender, instance, **kwargs):
+    """Обновляет поисковый индекс сообщений (удаленные сообщения убираются из него)"""
+    schedule_reindex([instance.pk])
+
+
+@receiver(pre_save, sender=Chat)
+@receiver(pre_save, sender=Message)
+@receiver(pre_save, sender=ChatParticipantStatus)
+def reset_change_seq(sender, instance, **kwargs):
+    """Сохраняемая строка получит новый номер изменения после фиксации (messaging.sync)"""
+    instance.change_seq = None
+
+
+@receiver(post_save, sender=Chat)
+def track_chat_change(sender, instance, update_fields=None, **kwargs):
+    """Присваивает номер изменения чату для дельта-синхронизации"""
+    mark_saved(instance, update_fields)
+
+
+@receiver(post_save, sender=Message)
+def track_message_change(sender, instance, update_fields=None, **kwargs):
+    """Новое, измененное или удаленное сообщение меняет и свой чат (последнее сообщение)"""
+    mark_saved(instance, update_fields, chats=[instance.chat_id])
+
+
+@receiver(post_save, sender=ChatParticipantStatus)
+def track_status_change(sender, instance, update_fields=None, **kwargs):
+    """Присваивает номер изменения статусу участника"""
+    mark_saved(instance, update_fields)
+
+
+@receiver(m2m_changed, sender=Chat.participants.through)
+def track_participants_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Изменение состава участников меняет чат"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Изменение со стороны пользователя: instance - пользователь, pk_set - чаты
+        mark_changed(chats=pk_set or ())
+    else:
+        mark_changed(chats=[instance.pk])
+
+
+def _participants_removed(chat_id, user_ids):
+    # Соединения удаленных закрываются, а чат попадает в их дельту синхронизации как удаленный
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    publish_membership_revoked(chat_id, user_ids)
+    record_removed_chat(chat_id, user_ids)
+
+
+@receiver(m2m_changed, sender=Chat.participants.through)
+def revoke_removed_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    """Отзывает доступ пользователей, удаленных из чата"""
+    if action == 'pre_clear':
+        # После очистки удаленных уже не узнать: запоминаем их до нее
+        if reverse:
+            instance._cleared_chat_ids = list(instance.chats.values_list('id', flat=True))
+        else:
+            instance._cleared_participant_ids = list(instance.participants.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        if reverse:
+            for chat_id in getattr(instance, '_cleared_chat_ids', ()):
+                _participants_removed(chat_id, [instance.pk])
+        else:
+            _participants_removed(instance.pk, getattr(instance, '_cleared_participant_ids', ()))
+        return
+    if action == 'post_remove':
+        if reverse:
+            for chat_id in pk_set or ():
+                _participants_removed(chat_id, [instance.pk])
+        else:
+            _participants_removed(instance.pk, pk_set or ())
+
+
+@receiver(post_save, sender=Chat)
+def revoke_deleted_chat(sender, instance, **kwargs):
+    """Мягко удаленный чат закрывает соединения всех участников"""
+    if instance.is_deleted:
+        publish_membership_revoked(instance.pk, instance.participants.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Chat)
+def revoke_removed_chat(sender, instance, **kwargs):
+    """Удаленный из БД чат отзывает доступ всех участников (после фиксации)"""
+    _participants_removed(instance.pk, instance.participants.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=MessageAttachment)
+def create_attachment_derivatives(sender, instance, **kwargs):
+    """Ставит в очередь создание уменьшенных копий для вложений-изображений"""
+    if instance.file_type and instance.file_type.startswith('image/'):
+        schedule_derivatives(instance, file_field='file')
+
+
+@receiver(post_save, sender=ChatParticipantStatus)
+def push_participant_status(sender, instance, **kwargs):
+    """Отправляет пользователю измененный статус чата через WebSocket"""
+    publish_status(instance)
+
+
+@receiver(m2m_changed, sender=Chat.participants.through)
+def update_participants_key(sender, instance, action, reverse, **kwargs):
+    """Пересчитывает ключ набора участников чата вне сделок при изменении участников"""
+    if reverse or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if instance.trade_offer_id is not None:
+        return
+
+    key = Chat.make_participants_key(instance.participants.values_list('id', flat=True))
+    if key == instance.participants_key:
+        return
+    try:
+        with transaction.atomic():
+            Chat.objects.filter(pk=instance.pk).update(participants_key=key)
+        instance.participants_key = key
+    except IntegrityError:
+        # Чат с таким набором участников уже есть: этот чат остается без ключа
+        logger.warning(f"Чат с участниками {key} уже существует, ключ чата #{instance.pk} сброшен")
+        Chat.objects.filter(pk=instance.pk).update(participants_key=None)
+        instance.participants_key = None
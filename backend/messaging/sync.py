@@ -0,0 +1,180 @@
+"""
+Последовательность изменений чатов для дельта-синхронизации клиентов.
+
+Каждое изменение Chat, Message и ChatParticipantStatus получает номер
+change_seq из монотонного счетчика SyncCounter. Запись, изменившая строку,
+сама сбрасывает ее change_seq в NULL ("изменение без номера"): новые строки
+создаются с NULL, save() сбрасывает номер в pre_save, массовые UPDATE
+включают change_seq=None. Номер присваивается после фиксации транзакции - в
+отдельной короткой транзакции, держащей блокировку строки счетчика, одним
+UPDATE по всем строкам без номера. Поэтому номера фиксируются в порядке
+возрастания: клиент, получивший токен N, увидит все последующие изменения с
+change_seq > N и не пропустит изменение, зафиксированное позже с меньшим
+номером.
+
+Если присвоение номера не удалось, ошибка не скрывается, а строки остаются
+без номера: их пронумерует следующее присвоение после любой записи, и
+изменение не потеряется для синхронизации.
+
+Удаления, которых не видно по самим строкам (пользователь удален из чата,
+строка удалена из БД, мягко удаленное сообщение перенесено в архив),
+записываются в SyncTombstone и нумеруются так же. Записи старше
+MESSAGING_SYNC_TOMBSTONE_DAYS удаляются (purge_tombstones), а наибольший
+удаленный номер становится горизонтом: клиент с более старым токеном получает
+reset.
+
+Токен синхронизации - значение счетчика на момент запроса.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+COUNTER_NAME = 'messaging'
+HORIZON_NAME = 'messaging_horizon'
+
+_pending = threading.local()
+
+
+def current_change_seq():
+    """Текущее значение счетчика изменений (токен синхронизации)"""
+    from .models import SyncCounter
+
+    return SyncCounter.objects.filter(pk=COUNTER_NAME).values_list('value', flat=True).first() or 0
+
+
+def sync_horizon():
+    """Наименьший токен, от которого еще можно выдать дельту удалений"""
+    from .models import SyncCounter
+
+    return SyncCounter.objects.filter(pk=HORIZON_NAME).values_list('value', flat=True).first() or 0
+
+
+def next_change_seq():
+    """
+    Увеличивает счетчик изменений и возвращает новое значение.
+    Вызывается внутри транзакции: строка счетчика остается заблокированной до ее фиксации
+    """
+    from .models import SyncCounter
+
+    if not SyncCounter.objects.filter(pk=COUNTER_NAME).update(value=F('value') + 1):
+        SyncCounter.objects.get_or_create(pk=COUNTER_NAME)
+        SyncCounter.objects.filter(pk=COUNTER_NAME).update(value=F('value') + 1)
+    return SyncCounter.objects.values_list('value', flat=True).get(pk=COUNTER_NAME)
+
+
+def flush_changes():
+    """
+    Присваивает один новый номер всем строкам без номера. Возвращает номер
+    или None, если нумеровать нечего (тогда счетчик не меняется)
+    """
+    from .models import Chat, ChatParticipantStatus, Message, SyncTombstone
+
+    _pending.scheduled = False
+    with transaction.atomic():
+        seq = next_change_seq()
+        updated = 0
+        for model in (Chat, Message, ChatParticipantStatus, SyncTombstone):
+            updated += model.objects.filter(change_seq__isnull=True).update(change_seq=seq)
+        if not updated:
+            transaction.set_rollback(True)
+            return None
+    return seq
+
+
+def _flush_pending():
+    # Несколько изменений одной транзакции нумеруются одним присвоением
+    if getattr(_pending, 'scheduled', False):
+        flush_changes()
+
+
+def schedule_flush():
+    """Присваивает номера строкам без номера после фиксации текущей транзакции"""
+    _pending.scheduled = True
+    transaction.on_commit(_flush_pending)
+
+
+def mark_changed(chats=(), messages=(), statuses=(), status_chats=()):
+    """
+    Сбрасывает номер изменения строк, измененных без save() или без поля
+    change_seq в UPDATE, и откладывает присвоение номера до фиксации транзакции.
+    status_chats - чаты, в которых изменились статусы всех участников
+    """
+    from .models import Chat, ChatParticipantStatus, Message
+
+    pending = Q(change_seq__isnull=False)
+    if chats:
+        Chat.objects.filter(pending, pk__in=list(chats)).update(change_seq=None)
+    if messages:
+        Message.objects.filter(pending, pk__in=list(messages)).update(change_seq=None)
+    if statuses or status_chats:
+        ChatParticipantStatus.objects.filter(pending).filter(
+            Q(pk__in=list(statuses)) | Q(chat_id__in=list(status_chats))
+        ).update(change_seq=None)
+    schedule_flush()
+
+
+def mark_saved(instance, update_fields=None, **related):
+    """
+    Для post_save: строку уже пометил pre_save, если save() записал change_seq;
+    при сохранении части полей без change_seq она помечается отдельным UPDATE.
+    related - связанные строки для mark_changed (например, чат сообщения)
+    """
+    if update_fields is not None and 'change_seq' not in update_fields:
+        instance.__class__.objects.filter(pk=instance.pk).update(change_seq=None)
+    mark_changed(**related)
+
+
+def record_removed_chat(chat_id, user_ids):
+    """Записывает удаление чата для пользователей, которые его больше не увидят"""
+    from .models import SyncTombstone
+
+    if not user_ids:
+        return
+    SyncTombstone.objects.bulk_create([
+        SyncTombstone(kind=SyncTombstone.KIND_CHAT, object_id=chat_id, chat_id=chat_id, user_id=user_id)
+        for user_id in user_ids
+    ])
+    schedule_flush()
+
+
+def record_removed_messages(messages):
+    """Записывает удаление сообщений; messages - пары (id сообщения, id чата)"""
+    from .models import SyncTombstone
+
+    if not messages:
+        return
+    SyncTombstone.objects.bulk_create([
+        SyncTombstone(kind=SyncTombstone.KIND_MESSAGE, object_id=message_id, chat_id=chat_id)
+        for message_id, chat_id in messages
+    ])
+    schedule_flush()
+
+
+def purge_tombstones(older_than=None):
+    """
+    Удаляет записи об удалениях старше older_than (timedelta) и сдвигает
+    горизонт синхронизации. Возвращает количество удаленных записей
+    """
+    from .models import SyncCounter, SyncTombstone
+
+    if older_than is None:
+        older_than = timedelta(days=settings.MESSAGING_SYNC_TOMBSTONE_DAYS)
+    expired = SyncTombstone.objects.filter(created_at__lt=timezone.now() - older_than, change_seq__isnull=False)
+
+    with transaction.atomic():
+        horizon = expired.aggregate(horizon=Max('change_seq'))['horizon']
+        if horizon is None:
+            return 0
+        SyncCounter.objects.get_or_create(pk=HORIZON_NAME)
+        SyncCounter.objects.filter(pk=HORIZON_NAME, value__lt=horizon).update(value=horizon)
+        deleted, _ = expired.filter(change_seq__lte=horizon).delete()
+
+    logger.info(f"Удалено записей об удалениях: {deleted}, горизонт синхронизации {horizon}")
+    return deleted
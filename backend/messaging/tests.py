@@ -1,3 +1,755 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .attachments import sniff_mime_type
+from .checks import check_realtime_broker
+from .archive import archive_messages
+from .models import ArchivedMessage, Chat, Message, MessageAttachment, ChatParticipantStatus
+from .realtime import CLOSE_FORBIDDEN, CLOSE_UNAUTHORIZED, websocket_application
+from .sync import purge_tombstones
+
+User = get_user_model()
+
+
+class ChatListTest(APITestCase):
+    """Тесты списка чатов"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='reader', email='reader@test.com', password='testpass123'
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        self.url = reverse('messaging:chat-list')
+
+    def _create_chats(self, count, messages_per_chat=5):
+        """Создает чаты текущего пользователя с собеседниками и сообщениями"""
+        chats = []
+        start = Chat.objects.count()
+        for i in range(start, start + count):
+            other = User.objects.create_user(
+                username=f'peer{i}', email=f'peer{i}@test.com', password='testpass123'
+            )
+            chat = Chat.objects.create()
+            chat.participants.set([self.user, other])
+            ChatParticipantStatus.objects.create(chat=chat, user=self.user, unread_count=i, is_muted=bool(i % 2))
+            ChatParticipantStatus.objects.create(chat=chat, user=other)
+            for j in range(messages_per_chat):
+                Message.objects.create(chat=chat, sender=other, content=f'Сообщение {j}')
+            chats.append(chat)
+        return chats
+
+    def _list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_constant_number_of_queries(self):
+        """Число запросов не зависит от количества чатов и сообщений"""
+        self._create_chats(2)
+        _, few = self._list_queries()
+
+        self._create_chats(6, messages_per_chat=20)
+        response, many = self._list_queries()
+
+        self.assertEqual(response.data['count'], 8)
+        self.assertEqual(few, many)
+
+    def test_last_message_and_status(self):
+        """Последнее сообщение и статус текущего пользователя берутся из аннотаций"""
+        chat = self._create_chats(2)[1]
+
+        response = self.client.get(self.url)
+        data = next(row for row in response.data['results'] if row['id'] == chat.id)
+        self.assertEqual(data['last_message']['content'], 'Сообщение 4')
+        self.assertEqual(data['unread_count'], 1)
+        self.assertTrue(data['is_muted'])
+
+    def test_last_message_follows_deletion(self):
+        """После удаления последнего сообщения указатель переходит на предыдущее"""
+        chat = self._create_chats(1)[0]
+        last = chat.messages.order_by('-id').first()
+
+        last.is_deleted = True
+        last.save()
+        chat.refresh_from_db()
+        self.assertEqual(chat.last_message.content, 'Сообщение 3')
+
+        chat.last_message.delete()
+        chat.refresh_from_db()
+        self.assertEqual(chat.last_message.content, 'Сообщение 2')
+
+
+class ChatWebSocketTest(APITestCase):
+    """Тесты доставки событий чата через WebSocket"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.sender = User.objects.create_user(
+            username='sender', email='sender@test.com', password='testpass123'
+        )
+        self.recipient = User.objects.create_user(
+            username='recipient', email='recipient@test.com', password='testpass123'
+        )
+        self.chat = Chat.objects.create()
+        self.chat.participants.set([self.sender, self.recipient])
+        for user in (self.sender, self.recipient):
+            ChatParticipantStatus.objects.create(chat=self.chat, user=user)
+
+    def _communicator(self, user, chat_id=None, header=True):
+        token = RefreshToken.for_user(user).access_token
+        return ApplicationCommunicator(websocket_application, {
+            'type': 'websocket',
+            'path': f'/ws/chats/{chat_id or self.chat.id}/',
+            'query_string': b'',
+            'headers': [(b'authorization', f'Bearer {token}'.encode())] if header else [],
+        })
+
+    def _send_message(self):
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.sender).access_token}'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('messaging:message-list'), {'chat': self.chat.id, 'content': 'Привет'}
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_push_new_message_and_status(self):
+        """Участник получает новое сообщение и обновленный счетчик непрочитанных"""
+        async def scenario():
+            communicator = self._communicator(self.recipient)
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+
+            await sync_to_async(self._send_message)()
+
+            events = [json.loads((await communicator.receive_output(5))['text']) for _ in range(2)]
+            events = {event['type']: event for event in events}
+            self.assertEqual(events['message.created']['message']['content'], 'Привет')
+            self.assertEqual(events['status.updated']['unread_count'], 1)
+
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+
+        async_to_sync(scenario)()
+
+    def test_rejects_non_participant(self):
+        """Пользователь не из чата не может подключиться"""
+        outsider = User.objects.create_user(
+            username='outsider', email='outsider@test.com', password='testpass123'
+        )
+
+        async def scenario():
+            communicator = self._communicator(outsider)
+            await communicator.send_input({'type': 'websocket.connect'})
+            output = await communicator.receive_output(5)
+            self.assertEqual(output, {'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+
+        async_to_sync(scenario)()
+
+
+    def test_auth_frame(self):
+        """Без заголовка токен принимается первым сообщением, а не из URL"""
+        token = str(RefreshToken.for_user(self.recipient).access_token)
+
+        async def scenario():
+            communicator = ApplicationCommunicator(websocket_application, {
+                'type': 'websocket', 'path': f'/ws/chats/{self.chat.id}/',
+                'query_string': f'token={token}'.encode(), 'headers': [],
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+            await communicator.send_input({'type': 'websocket.receive', 'text': '{"type": "ping"}'})
+            output = await communicator.receive_output(5)
+            self.assertEqual(output, {'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+
+            communicator = self._communicator(self.recipient, header=False)
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+            await communicator.send_input({
+                'type': 'websocket.receive', 'text': json.dumps({'type': 'auth', 'token': token})
+            })
+            output = json.loads((await communicator.receive_output(5))['text'])
+            self.assertEqual(output, {'type': 'auth.ok', 'chat': self.chat.id})
+
+            await sync_to_async(self._send_message)()
+            events = {json.loads((await communicator.receive_output(5))['text'])['type'] for _ in range(2)}
+            self.assertEqual(events, {'message.created', 'status.updated'})
+
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+
+        async_to_sync(scenario)()
+
+    def test_removed_participant_is_disconnected(self):
+        """Удаленный из чата участник получает chat.removed, соединение закрывается"""
+        def remove():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.chat.participants.remove(self.recipient)
+
+        async def scenario():
+            communicator = self._communicator(self.recipient)
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+
+            await sync_to_async(remove)()
+
+            output = json.loads((await communicator.receive_output(5))['text'])
+            self.assertEqual(output, {'type': 'chat.removed', 'chat': self.chat.id})
+            output = await communicator.receive_output(5)
+            self.assertEqual(output, {'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+            await communicator.wait(5)
+
+        async_to_sync(scenario)()
+
+
+    def test_in_memory_broker_requires_single_process(self):
+        """Брокер в памяти процесса запрещает запуск нескольких процессов ASGI-сервера"""
+        with override_settings(ASGI_WORKERS=1):
+            self.assertEqual(check_realtime_broker(None), [])
+        with override_settings(ASGI_WORKERS=4):
+            self.assertEqual([error.id for error in check_realtime_broker(None)], ['messaging.E001'])
+
+class MessageKeysetPaginationTest(APITestCase):
+    """Тесты keyset-пагинации истории сообщений"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='history', email='history@test.com', password='testpass123'
+        )
+        self.peer = User.objects.create_user(
+            username='peer', email='peer@test.com', password='testpass123'
+        )
+        self.chat = Chat.objects.create()
+        self.chat.participants.set([self.user, self.peer])
+        self.messages = [
+            Message.objects.create(chat=self.chat, sender=self.peer, content=f'Сообщение {i}')
+            for i in range(25)
+        ]
+        # Одинаковое время у части сообщений: порядок при равенстве задает id
+        Message.objects.filter(pk__in=[m.pk for m in self.messages[5:15]]).update(
+            created_at=self.messages[5].created_at
+        )
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        self.url = reverse('messaging:message-list')
+
+    def _get(self, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'chat_id': self.chat.id, 'page_size': 10, **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if 'OFFSET' in q['sql'].upper()])
+        return response.data
+
+    @staticmethod
+    def _params(link):
+        return {key: values[0] for key, values in parse_qs(urlparse(link).query).items()}
+
+    def test_backfill_history_without_gaps(self):
+        """Обход истории по before_id возвращает все сообщения без повторов"""
+        page = self._get({'pagination': 'cursor'})
+        seen = [row['id'] for row in page['results']]
+
+        # Новое сообщение не сдвигает границы следующих страниц
+        Message.objects.create(chat=self.chat, sender=self.peer, content='Новое')
+
+        while page['next']:
+            page = self._get(self._params(page['next']))
+            seen.extend(row['id'] for row in page['results'])
+
+        self.assertEqual(seen, [m.pk for m in reversed(self.messages)])
+
+    def test_after_id_returns_newer_messages(self):
+        """after_id возвращает только более новые сообщения"""
+        newest = self._get({'pagination': 'cursor'})
+        new_message = Message.objects.create(chat=self.chat, sender=self.peer, content='Новое')
+
+        page = self._get(self._params(newest['previous']))
+        self.assertEqual([row['id'] for row in page['results']], [new_message.pk])
+        self.assertFalse(page['has_newer'])
+
+
+class MessageSendAndReadTest(APITestCase):
+    """Тесты отправки сообщений и отметок прочтения"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.sender = User.objects.create_user(
+            username='author', email='author@test.com', password='testpass123'
+        )
+        self.chat = Chat.objects.create()
+        self._add_participants(self.sender)
+        self.reader = self._add_participants(
+            User.objects.create_user(username='member0', email='member0@test.com', password='testpass123')
+        )
+
+    def _add_participants(self, *users):
+        for user in users:
+            self.chat.participants.add(user)
+            ChatParticipantStatus.objects.create(chat=self.chat, user=user)
+        return users[0]
+
+    def _authenticate(self, user):
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}'
+        )
+
+    def _send(self, content='Сообщение'):
+        self._authenticate(self.sender)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('messaging:message-list'), {'chat': self.chat.id, 'content': content}
+            )
+        self.assertEqual(response.status_code, 201)
+        return response, queries
+
+    def test_send_cost_does_not_depend_on_participants(self):
+        """Отправка выполняет одинаковое число запросов при любом числе участников"""
+        _, few = self._send()
+
+        self._add_participants(*[
+            User.objects.create_user(username=f'member{i}', email=f'member{i}@test.com', password='testpass123')
+            for i in range(1, 6)
+        ])
+        _, many = self._send()
+
+        self.assertEqual(len(few), len(many))
+        statuses = ChatParticipantStatus.objects.filter(chat=self.chat).exclude(user=self.sender)
+        self.assertEqual(
+            sorted(statuses.values_list('unread_count', flat=True)), [1, 1, 1, 1, 1, 2]
+        )
+
+    def test_mark_chat_read_moves_watermark(self):
+        """Отметка чата прочитанным обновляет одну строку статуса и не трогает сообщения"""
+        for i in range(3):
+            self._send(f'Сообщение {i}')
+        self.chat.refresh_from_db()
+
+        self._authenticate(self.reader)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('messaging:chat-mark-as-read', args=[self.chat.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if q['sql'].upper().startswith('UPDATE "MESSAGES"')])
+
+        status = ChatParticipantStatus.objects.get(chat=self.chat, user=self.reader)
+        self.assertEqual(status.last_read_message_id, self.chat.last_message_id)
+        self.assertEqual(status.unread_count, 0)
+
+        self._authenticate(self.sender)
+        response = self.client.get(reverse('messaging:message-list'), {'chat_id': self.chat.id})
+        self.assertTrue(all(row['is_read'] for row in response.data['results']))
+
+    def test_mark_message_read_recounts_unread(self):
+        """Отметка отдельного сообщения пересчитывает непрочитанные после него"""
+        ids = [self._send(f'Сообщение {i}')[0].data['id'] for i in range(4)]
+
+        self._authenticate(self.reader)
+        url = reverse('messaging:message-mark-as-read', args=[ids[1]])
+        response = self.client.post(f'{url}?chat_id={self.chat.id}')
+        self.assertEqual(response.status_code, 200)
+
+        status = ChatParticipantStatus.objects.get(chat=self.chat, user=self.reader)
+        self.assertEqual((status.last_read_message_id, status.unread_count), (ids[1], 2))
+
+
+class PrivateChatLookupTest(APITestCase):
+    """Тесты поиска приватного чата по ключу участников"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@test.com', password='testpass123')
+            for i in range(3)
+        ]
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.users[0]).access_token}'
+        )
+
+    def test_by_user_finds_exact_pair(self):
+        """by_user находит чат именно этой пары, а не групповой чат с тем же пользователем"""
+        group, _ = Chat.get_or_create_private([user.id for user in self.users])
+        pair, _ = Chat.get_or_create_private([self.users[0].id, self.users[1].id])
+
+        response = self.client.get(reverse('messaging:chat-by-user'), {'user_id': self.users[1].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], pair.id)
+        self.assertNotEqual(group.id, pair.id)
+
+    def test_create_returns_existing_chat(self):
+        """Повторное создание чата с теми же участниками возвращает существующий"""
+        url = reverse('messaging:chat-list')
+        payload = {'participants': [self.users[1].id, self.users[0].id]}
+        first = self.client.post(url, payload, format='json')
+        second = self.client.post(url, {'participants': [self.users[0].id, self.users[1].id]}, format='json')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertEqual(ChatParticipantStatus.objects.filter(chat_id=first.data['id']).count(), 2)
+
+    def test_duplicate_key_rejected_by_database(self):
+        """Уникальный индекс не допускает второй активный чат с тем же набором участников"""
+        chat, created = Chat.get_or_create_private([self.users[0].id, self.users[1].id])
+        self.assertTrue(created)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Chat.objects.create(participants_key=chat.participants_key)
+
+
+class MessageAttachmentUploadTest(APITestCase):
+    """Тесты загрузки вложений сообщений"""
+
+    def setUp(self):
+        """Настройка локального хранилища и чатов"""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVES_ENABLED=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(
+            username='uploader', email='uploader@test.com', password='testpass123'
+        )
+        self.chats = []
+        for i in range(2):
+            peer = User.objects.create_user(
+                username=f'friend{i}', email=f'friend{i}@test.com', password='testpass123'
+            )
+            self.chats.append(Chat.get_or_create_private([self.user.id, peer.id])[0])
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+
+    def _png(self):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4), (200, 10, 10)).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def _send(self, chat, files):
+        response = self.client.post(reverse('messaging:message-list'), {
+            'chat': chat.id, 'content': 'Фото', 'attachments': files,
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response
+
+    def test_type_sniffed_and_content_deduplicated(self):
+        """Тип определяется по содержимому, одинаковые файлы хранятся один раз"""
+        data = self._png()
+        self._send(self.chats[0], [SimpleUploadedFile('photo.txt', data, content_type='text/plain')])
+        self._send(self.chats[1], [
+            SimpleUploadedFile('copy.png', data, content_type='image/png'),
+            SimpleUploadedFile('notes.bin', 'заметка'.encode(), content_type='image/png'),
+        ])
+
+        attachments = MessageAttachment.objects.order_by('id')
+        self.assertEqual(
+            [a.file_type for a in attachments], ['image/png', 'image/png', 'text/plain']
+        )
+        self.assertEqual(attachments[0].file.name, attachments[1].file.name)
+        self.assertTrue(attachments[0].file.name.endswith('.png'))
+
+        stored = [name for _, _, names in os.walk(self.media_root) for name in names]
+        self.assertEqual(len(stored), 2)
+
+    def test_sniff_mime_type(self):
+        """Определение типа по сигнатуре"""
+        self.assertEqual(sniff_mime_type(b'%PDF-1.7 ...', 'scan.jpg'), 'application/pdf')
+        self.assertEqual(sniff_mime_type(b'RIFF\x00\x00\x00\x00WEBPVP8 '), 'image/webp')
+        self.assertEqual(
+            sniff_mime_type(b'PK\x03\x04...', 'report.docx'),
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        )
+        self.assertEqual(sniff_mime_type(b'\x00\x01\x02'), 'application/octet-stream')
+
+
+class MessageSearchTest(APITestCase):
+    """Тесты полнотекстового поиска по сообщениям"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='searcher', email='searcher@test.com', password='testpass123'
+        )
+        self.peer = User.objects.create_user(
+            username='search_peer', email='search_peer@test.com', password='testpass123'
+        )
+        self.stranger = User.objects.create_user(
+            username='search_stranger', email='search_stranger@test.com', password='testpass123'
+        )
+        self.chat = Chat.objects.create()
+        self.chat.participants.set([self.user, self.peer])
+        self.other_chat = Chat.objects.create()
+        self.other_chat.participants.set([self.user, self.stranger])
+        self.foreign_chat = Chat.objects.create()
+        self.foreign_chat.participants.set([self.peer, self.stranger])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bike = Message.objects.create(chat=self.chat, sender=self.peer, content='Меняю велосипеды на гитару')
+            self.other = Message.objects.create(chat=self.other_chat, sender=self.stranger, content='Велосипед еще актуален?')
+            Message.objects.create(chat=self.foreign_chat, sender=self.peer, content='Велосипед для тебя')
+            self.deleted = Message.objects.create(chat=self.chat, sender=self.peer, content='Старый велосипед')
+            self.deleted.is_deleted = True
+            self.deleted.save()
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        self.url = reverse('messaging:message-search')
+
+    def test_search_scoped_to_user_chats(self):
+        """Поиск только по чатам пользователя, с учетом словоформ и без удаленных"""
+        response = self.client.get(self.url, {'q': 'велосипед'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['id'] for m in response.data['results']], [self.other.id, self.bike.id])
+        self.assertEqual(response.data['results'][0]['chat'], self.other_chat.id)
+
+        response = self.client.get(self.url, {'q': 'velosiped', 'chat_id': self.chat.id})
+        self.assertEqual([m['id'] for m in response.data['results']], [self.bike.id])
+
+        response = self.client.get(self.url, {'q': 'велосипед', 'chat_id': self.foreign_chat.id})
+        self.assertEqual(response.data['results'], [])
+
+    def test_search_pages_by_before_id(self):
+        """Следующая страница запрашивается по id последнего сообщения"""
+        response = self.client.get(self.url, {'q': 'велосипед', 'page_size': 1})
+        self.assertEqual([m['id'] for m in response.data['results']], [self.other.id])
+        self.assertIsNotNone(response.data['next'])
+
+        next_params = {k: v[0] for k, v in parse_qs(urlparse(response.data['next']).query).items()}
+        response = self.client.get(self.url, next_params)
+        self.assertEqual([m['id'] for m in response.data['results']], [self.bike.id])
+        self.assertIsNone(response.data['next'])
+
+    def test_index_follows_edits(self):
+        """Индекс обновляется при изменении и удалении сообщения"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bike.content = 'Меняю самокат'
+            self.bike.save()
+        response = self.client.get(self.url, {'q': 'велосипед', 'chat_id': self.chat.id})
+        self.assertEqual(response.data['results'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.delete()
+        response = self.client.get(self.url, {'q': 'велосипед'})
+        self.assertEqual(response.data['results'], [])
+
+
+class MessageArchiveTest(APITestCase):
+    """Тесты архивации старых сообщений и чтения истории из архива"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='archive_reader', email='archive_reader@test.com', password='testpass123'
+        )
+        self.peer = User.objects.create_user(
+            username='archive_peer', email='archive_peer@test.com', password='testpass123'
+        )
+        self.chat = Chat.objects.create()
+        self.chat.participants.set([self.user, self.peer])
+        self.messages = [
+            Message.objects.create(chat=self.chat, sender=self.peer, content=f'Сообщение {i}')
+            for i in range(20)
+        ]
+        long_ago = timezone.now() - timedelta(days=400)
+        for i, message in enumerate(self.messages[:12]):
+            Message.objects.filter(pk=message.pk).update(created_at=long_ago + timedelta(minutes=i))
+        self.attachment = MessageAttachment.objects.create(
+            message=self.messages[1], file='message_attachments/ab/abc.pdf', file_name='doc.pdf',
+            file_size=10, file_type='application/pdf', content_hash='abc'
+        )
+        self.deleted = self.messages[15]
+        Message.objects.filter(pk=self.deleted.pk).update(is_deleted=True)
+        # Отметка прочтения на старом сообщении удерживает его в горячей таблице
+        ChatParticipantStatus.objects.create(chat=self.chat, user=self.user, last_read_message=self.messages[5])
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        self.url = reverse('messaging:message-list')
+
+    def _get(self, params):
+        response = self.client.get(self.url, {'chat_id': self.chat.id, 'page_size': 4, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_archive_moves_old_and_deleted_messages(self):
+        """В архив уходят старые и удаленные сообщения, кроме отмеченных прочитанными"""
+        archived = archive_messages(older_than=timedelta(days=180), chunk_size=5)
+
+        self.assertEqual(archived, 12)
+        self.assertEqual(
+            set(Message.objects.values_list('id', flat=True)),
+            {self.messages[5].id} | {m.id for m in self.messages[12:] if m != self.deleted}
+        )
+        self.assertTrue(ArchivedMessage.objects.get(pk=self.deleted.pk).is_deleted)
+        self.assertFalse(MessageAttachment.objects.exists())
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.archived_until, ArchivedMessage.objects.get(pk=self.messages[11].pk).created_at)
+
+    def test_history_falls_back_to_archive(self):
+        """История по before_id/after_id прозрачно продолжается в архиве"""
+        archive_messages(older_than=timedelta(days=180), chunk_size=5)
+        expected = [m.id for m in reversed(self.messages) if m != self.deleted]
+
+        page = self._get({'pagination': 'cursor'})
+        seen = [row['id'] for row in page['results']]
+        while page['next']:
+            page = self._get({key: values[0] for key, values in parse_qs(urlparse(page['next']).query).items()})
+            seen.extend(row['id'] for row in page['results'])
+        self.assertEqual(seen, expected)
+
+        page = self._get({'after_id': self.messages[0].id})
+        self.assertEqual([row['id'] for row in page['results']], [m.id for m in reversed(self.messages[1:5])])
+        self.assertTrue(page['has_newer'])
+
+        attachments = next(row for row in page['results'] if row['id'] == self.messages[1].id)['attachments']
+        self.assertEqual([a['file_name'] for a in attachments], ['doc.pdf'])
+        # Прочтение считается по отметке участника, как и для горячих сообщений
+        self.assertTrue(page['results'][0]['is_read'])
+
+
+class ChatSyncTest(APITestCase):
+    """Тесты дельта-синхронизации чатов"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='sync_user', email='sync_user@test.com', password='testpass123'
+        )
+        self.peer = User.objects.create_user(
+            username='sync_peer', email='sync_peer@test.com', password='testpass123'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chat = Chat.objects.create()
+            self.chat.participants.set([self.user, self.peer])
+            for user in (self.user, self.peer):
+                ChatParticipantStatus.objects.create(chat=self.chat, user=user)
+            self.other_chat = Chat.objects.create()
+            self.other_chat.participants.set([self.peer])
+        self.url = reverse('messaging:chat-sync')
+
+    def _sync(self, user, token=None):
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}'
+        )
+        response = self.client.get(self.url, {} if token is None else {'token': token})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_sync_without_changes_is_cheap(self):
+        """Без токена клиенту выдается текущий токен, повторный запрос без изменений пуст"""
+        data = self._sync(self.user)
+        self.assertTrue(data['reset'])
+
+        # Запрос пользователя при аутентификации и чтение счетчика изменений
+        with self.assertNumQueries(2):
+            empty = self._sync(self.user, data['token'])
+        self.assertFalse(empty['reset'])
+        self.assertEqual(empty['token'], data['token'])
+        self.assertEqual((empty['chats'], empty['messages'], empty['statuses']), ([], [], []))
+
+    def test_sync_returns_changes_since_token(self):
+        """Возвращаются только изменения в чатах пользователя после токена"""
+        token = self._sync(self.user)['token']
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.peer).access_token}'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('messaging:message-list'), {'chat': self.chat.id, 'content': 'Привет'}
+            )
+            Message.objects.create(chat=self.other_chat, sender=self.peer, content='Чужой чат')
+        self.assertEqual(response.status_code, 201)
+
+        data = self._sync(self.user, token)
+        self.assertEqual([m['id'] for m in data['messages']], [response.data['id']])
+        self.assertEqual([c['id'] for c in data['chats']], [self.chat.id])
+        self.assertEqual(data['chats'][0]['unread_count'], 1)
+        self.assertEqual([(s['chat'], s['unread_count']) for s in data['statuses']], [(self.chat.id, 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.get(pk=response.data['id'])
+            message.is_deleted = True
+            message.save()
+            ChatParticipantStatus.mark_read(self.chat.id, self.peer.id, message.id)
+
+        data = self._sync(self.user, data['token'])
+        self.assertEqual(data['messages'], [])
+        self.assertEqual(data['deleted']['messages'], [message.id])
+        self.assertEqual([r['user'] for r in data['read_receipts']], [self.peer.id])
+
+    def test_removals_without_rows_reach_sync(self):
+        """Удаление из чата, удаление из БД и архивация удаленного сообщения попадают в дельту"""
+        token = self._sync(self.user)['token']
+        with self.captureOnCommitCallbacks(execute=True):
+            archived = Message.objects.create(chat=self.chat, sender=self.peer, content='Удалено')
+            removed = Message.objects.create(chat=self.chat, sender=self.peer, content='Стерто')
+            Message.objects.create(chat=self.chat, sender=self.peer, content='Последнее')
+        with self.captureOnCommitCallbacks(execute=True):
+            archived.is_deleted = True
+            archived.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive_messages(), 1)
+            removed_id = removed.id
+            removed.delete()
+
+        data = self._sync(self.user, token)
+        self.assertEqual(sorted(data['deleted']['messages']), [archived.id, removed_id])
+        self.assertEqual(data['deleted']['chats'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chat.participants.remove(self.user)
+        deleted = self._sync(self.user, data['token'])
+        self.assertEqual(deleted['deleted']['chats'], [self.chat.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chat.participants.add(self.user)
+        self.assertEqual(self._sync(self.user, data['token'])['deleted']['chats'], [])
+
+        # Очищенные записи сдвигают горизонт: старый токен получает reset
+        self.assertEqual(purge_tombstones(older_than=timedelta(0)), 3)
+        self.assertTrue(self._sync(self.user, token)['reset'])
+
+    def test_failed_numbering_is_not_lost(self):
+        """Если номер изменения не присвоен, ошибка не скрывается, а изменение нумеруется следующей записью"""
+        token = self._sync(self.user)['token']
+
+        with mock.patch('messaging.sync.next_change_seq', side_effect=DatabaseError('counter is locked')):
+            with self.assertRaises(DatabaseError):
+                with self.captureOnCommitCallbacks(execute=True):
+                    lost = Message.objects.create(chat=self.chat, sender=self.peer, content='Первое')
+        self.assertIsNone(Message.objects.get(pk=lost.pk).change_seq)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            later = Message.objects.create(chat=self.chat, sender=self.peer, content='Второе')
+
+        data = self._sync(self.user, token)
+        self.assertEqual([m['id'] for m in data['messages']], [lost.id, later.id])
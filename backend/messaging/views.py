@@ -1,13 +1,21 @@
+from collections import OrderedDict
+
 from django.shortcuts import render
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q, F, Count, Max
-from django.utils import timezone
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.db.models import Q, Max, OuterRef, Prefetch, Subquery
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
-from .models import Chat, Message, MessageAttachment, ChatParticipantStatus
+from .archive import archived_history
+from .models import ArchivedMessage, Chat, Message, MessageAttachment, ChatParticipantStatus, SyncTombstone
+from .realtime import publish_read_receipt, publish_statuses
+from .search import get_search_backend
+from .sync import current_change_seq, sync_horizon
 from .serializers import (
     ChatSerializer, CreateChatSerializer, MessageSerializer, 
     CreateMessageSerializer, MessageAttachmentSerializer,
@@ -24,6 +32,129 @@ class MessagePagination(PageNumberPagination):
     max_page_size = 100
 
 
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset-пагинация истории сообщений.
+
+    Включается параметрами before_id (более старые сообщения), after_id (более
+    новые) или pagination=cursor (последние сообщения чата). Позиция задается
+    парой (created_at, id) сообщения-якоря, поэтому новые сообщения не сдвигают
+    границы страниц, а стоимость запроса не зависит от глубины истории.
+    Результаты всегда упорядочены от новых к старым
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    before_query_param = 'before_id'
+    after_query_param = 'after_id'
+    mode_query_param = 'pagination'
+    mode_value = 'cursor'
+
+    @classmethod
+    def is_requested(cls, request):
+        """Проверяет, запрошена ли keyset-пагинация"""
+        params = request.query_params
+        return (
+            cls.before_query_param in params
+            or cls.after_query_param in params
+            or params.get(cls.mode_query_param) == cls.mode_value
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        params = request.query_params
+        # Время самого нового архивного сообщения чата (messaging.archive)
+        archived_until = getattr(view, 'archived_until', None)
+        chat_id = params.get('chat_id')
+
+        if self.after_query_param in params:
+            anchor = self._get_anchor(request, params[self.after_query_param])
+            newer = Q(created_at__gt=anchor.created_at) | Q(created_at=anchor.created_at, id__gt=anchor.id)
+            order = ('created_at', 'id')
+            results = list(queryset.filter(newer).order_by(*order)[:page_size + 1])
+            if archived_until is not None and anchor.created_at <= archived_until:
+                results = self._merge(results, archived_history(chat_id, newer, order, page_size + 1), order, page_size)
+            self.has_newer = len(results) > page_size
+            results = results[:page_size]
+            results.reverse()
+            self.has_older = True
+        else:
+            older = Q()
+            if self.before_query_param in params:
+                anchor = self._get_anchor(request, params[self.before_query_param])
+                older = Q(created_at__lt=anchor.created_at) | Q(created_at=anchor.created_at, id__lt=anchor.id)
+            order = ('-created_at', '-id')
+            results = list(queryset.filter(older).order_by(*order)[:page_size + 1])
+            # Курсор вышел за горячее окно: догружаем страницу из архива
+            if archived_until is not None and (
+                len(results) <= page_size or results[-1].created_at <= archived_until
+            ):
+                results = self._merge(results, archived_history(chat_id, older, order, page_size + 1), order, page_size)
+            self.has_older = len(results) > page_size
+            results = results[:page_size]
+            self.has_newer = False
+
+        self.page = results
+        return results
+
+    @staticmethod
+    def _merge(hot, archived, order, page_size):
+        """Объединяет сообщения из горячей таблицы и архива в порядке страницы"""
+        reverse = order[0].startswith('-')
+        merged = sorted(hot + archived, key=lambda message: (message.created_at, message.id), reverse=reverse)
+        return merged[:page_size + 1]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('has_newer', self.has_newer),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        """Ссылка на более старые сообщения"""
+        if not self.has_older or not self.page:
+            return None
+        return self._link(self.before_query_param, self.page[-1].id)
+
+    def get_previous_link(self):
+        """Ссылка на более новые сообщения; для догрузки новых выдается всегда"""
+        if not self.page:
+            return None
+        return self._link(self.after_query_param, self.page[0].id)
+
+    def _get_anchor(self, request, value):
+        """Сообщение-якорь из запрошенного чата (может быть удаленным или архивным)"""
+        try:
+            anchor_id = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({'detail': 'Неверный идентификатор сообщения'})
+        chat_id = request.query_params.get('chat_id')
+        anchor = Message.objects.filter(pk=anchor_id, chat_id=chat_id).only('id', 'created_at').first()
+        if anchor is None:
+            anchor = ArchivedMessage.objects.filter(pk=anchor_id, chat_id=chat_id).only('id', 'created_at').first()
+        if anchor is None:
+            raise NotFound('Сообщение не найдено')
+        return anchor
+
+    def _link(self, param, message_id):
+        url = remove_query_param(self.base_url, self.before_query_param)
+        url = remove_query_param(url, self.after_query_param)
+        url = remove_query_param(url, self.mode_query_param)
+        return replace_query_param(url, param, message_id)
+
+
 class ChatViewSet(viewsets.ModelViewSet):
     """
     ViewSet для работы с чатами
@@ -36,17 +167,27 @@ class ChatViewSet(viewsets.ModelViewSet):
         return ChatSerializer
     
     def get_queryset(self):
+        """
+        Список чатов выполняется за постоянное число запросов: последнее
+        сообщение берется по указателю Chat.last_message, статус текущего
+        пользователя присоединяется подзапросами, сообщения чатов не загружаются
+        """
         user = self.request.user
+        current_status = ChatParticipantStatus.objects.filter(chat=OuterRef('pk'), user=user)
         return Chat.objects.filter(
             participants=user,
             is_deleted=False
         ).select_related(
-            'trade_offer'
+            'trade_offer', 'last_message__sender'
         ).prefetch_related(
-            'participants',
-            'messages',
-            'participant_statuses'
-        ).distinct().order_by('-last_message_time', '-created_at')
+            Prefetch('participants', queryset=User.objects.prefetch_related('roles')),
+            'last_message__sender__roles',
+            'last_message__attachments',
+            'participant_statuses',
+        ).annotate(
+            current_unread_count=Subquery(current_status.values('unread_count')[:1]),
+            current_is_muted=Subquery(current_status.values('is_muted')[:1]),
+        ).order_by('-last_message_time', '-created_at')
     
     def create(self, request, *args, **kwargs):
         """Создание нового чата"""
@@ -64,26 +205,11 @@ class ChatViewSet(viewsets.ModelViewSet):
         chat = self.get_object()
         user = request.user
         
-        # Обновляем статус участника
-        participant_status, created = ChatParticipantStatus.objects.get_or_create(
-            chat=chat,
-            user=user,
-            defaults={'unread_count': 0}
-        )
-        
-        if not created:
-            participant_status.unread_count = 0
-            participant_status.save(update_fields=['unread_count'])
-        
-        # Отмечаем все непрочитанные сообщения как прочитанные
-        Message.objects.filter(
-            chat=chat,
-            is_read=False,
-            is_deleted=False
-        ).exclude(sender=user).update(
-            is_read=True,
-            read_at=timezone.now()
-        )
+        # Сдвигаем отметку прочтения до последнего сообщения: обновляется одна строка статуса
+        if ChatParticipantStatus.mark_read(chat.id, user.id, chat.last_message_id):
+            current = ChatParticipantStatus.objects.get(chat=chat, user=user)
+            publish_read_receipt(chat.id, user.id, current.last_read_at)
+            publish_statuses([current])
         
         return Response({'status': 'success'})
     
@@ -106,6 +232,99 @@ class ChatViewSet(viewsets.ModelViewSet):
             'is_muted': participant_status.is_muted
         })
     
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        Дельта-синхронизация чатов пользователя (messaging.sync).
+        
+        Параметр token - токен из предыдущего ответа. Возвращаются чаты,
+        сообщения, статусы и удаления, изменившиеся после него, и новый токен.
+        reset=true означает, что дельту выдать нельзя (нет токена, токен старше
+        горизонта записей об удалениях или изменений больше
+        MESSAGING_SYNC_MAX_CHANGES): клиент загружает чаты заново
+        обычными запросами и продолжает синхронизацию с выданного токена
+        """
+        current = current_change_seq()
+        data = OrderedDict([
+            ('token', str(current)),
+            ('reset', False),
+            ('chats', []),
+            ('messages', []),
+            ('statuses', []),
+            ('read_receipts', []),
+            ('deleted', {'chats': [], 'messages': []}),
+        ])
+        
+        try:
+            since = int(request.query_params['token'])
+        except (KeyError, ValueError):
+            since = None
+        if since is None or since > current:
+            data['reset'] = True
+            return Response(data)
+        if since == current:
+            # Изменений нет: ответ без обращения к таблицам чатов
+            return Response(data)
+        
+        if since < sync_horizon():
+            # Записи об удалениях после этого токена уже очищены
+            data['reset'] = True
+            return Response(data)
+        
+        user = request.user
+        changed = Q(change_seq__gt=since, change_seq__lte=current)
+        limit = settings.MESSAGING_SYNC_MAX_CHANGES
+        user_chats = Chat.objects.filter(participants=user, is_deleted=False).values('id')
+        
+        messages = list(Message.objects.filter(changed, chat_id__in=user_chats).select_related(
+            'sender'
+        ).prefetch_related('sender__roles', 'attachments').order_by('change_seq', 'id')[:limit + 1])
+        # Удаленные из БД и архивированные удаленные сообщения, а также чаты,
+        # из которых пользователь удален или которые удалены из БД
+        tombstones = list(SyncTombstone.objects.filter(changed).filter(
+            Q(kind=SyncTombstone.KIND_MESSAGE, chat_id__in=user_chats)
+            | Q(kind=SyncTombstone.KIND_CHAT, user=user)
+        ).order_by('change_seq', 'id').values_list('kind', 'object_id')[:limit + 1])
+        if len(messages) + len(tombstones) > limit:
+            data['reset'] = True
+            return Response(data)
+        
+        changed_chats = dict(Chat.objects.filter(changed, participants=user).values_list('id', 'is_deleted'))
+        live_chat_ids = [chat_id for chat_id, is_deleted in changed_chats.items() if not is_deleted]
+        if live_chat_ids:
+            data['chats'] = ChatSerializer(
+                self.get_queryset().filter(id__in=live_chat_ids), many=True, context=self.get_serializer_context()
+            ).data
+        deleted_chats = {chat_id for chat_id, is_deleted in changed_chats.items() if is_deleted}
+        deleted_messages = [message.id for message in messages if message.is_deleted]
+        for kind, object_id in tombstones:
+            if kind == SyncTombstone.KIND_MESSAGE:
+                deleted_messages.append(object_id)
+            elif object_id not in changed_chats:
+                # Пользователя могли снова добавить в чат: тогда чат есть среди измененных
+                deleted_chats.add(object_id)
+        data['deleted']['chats'] = sorted(deleted_chats)
+        
+        context = self.get_serializer_context()
+        data['messages'] = MessageSerializer(
+            [message for message in messages if not message.is_deleted], many=True, context=context
+        ).data
+        data['deleted']['messages'] = deleted_messages
+        
+        for participant_status in ChatParticipantStatus.objects.filter(changed, chat_id__in=user_chats):
+            if participant_status.user_id == user.id:
+                data['statuses'].append(ChatParticipantStatusSerializer(participant_status).data)
+            elif participant_status.last_read_message_id is not None:
+                # Прогресс чтения собеседников - без их счетчиков и настроек
+                data['read_receipts'].append({
+                    'chat': participant_status.chat_id,
+                    'user': participant_status.user_id,
+                    'last_read_message': participant_status.last_read_message_id,
+                    'read_at': participant_status.last_read_at,
+                })
+        
+        return Response(data)
+    
     @action(detail=False, methods=['get'])
     def by_trade(self, request):
         """Получить чат по ID сделки"""
@@ -148,30 +367,27 @@ class ChatViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            # Ищем приватный чат между двумя пользователями
-            chat = Chat.objects.filter(
-                participants__in=[request.user.id, user_id],
-                trade_offer__isnull=True,
-                is_deleted=False
-            ).annotate(
-                participant_count=Count('participants')
-            ).filter(
-                participant_count=2
-            ).first()
-            
-            if chat:
-                serializer = self.get_serializer(chat)
-                return Response(serializer.data)
-            else:
-                return Response(
-                    {'error': 'Chat not found'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
-        except Exception as e:
+            user_id = int(user_id)
+        except ValueError:
             return Response(
-                {'error': str(e)}, 
+                {'error': 'user_id must be an integer'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        # Приватный чат ищется по ключу набора участников одним запросом по индексу
+        chat = Chat.objects.filter(
+            participants_key=Chat.make_participants_key([request.user.id, user_id]),
+            trade_offer__isnull=True,
+            is_deleted=False
+        ).first()
+        
+        if chat:
+            serializer = self.get_serializer(chat)
+            return Response(serializer.data)
+        return Response(
+            {'error': 'Chat not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
 
 
 class MessageViewSet(viewsets.ModelViewSet):
@@ -181,6 +397,19 @@ class MessageViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = MessagePagination
     
+    @property
+    def paginator(self):
+        """
+        Выбирает keyset-пагинацию, если клиент передал before_id/after_id
+        или pagination=cursor
+        """
+        if not hasattr(self, '_paginator'):
+            if MessageKeysetPagination.is_requested(self.request):
+                self._paginator = MessageKeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+    
     def get_serializer_class(self):
         if self.action == 'create':
             return CreateMessageSerializer
@@ -192,12 +421,15 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         if chat_id:
             # Проверяем что пользователь участник чата
-            if not Chat.objects.filter(
+            chat = Chat.objects.filter(
                 id=chat_id, 
                 participants=user,
                 is_deleted=False
-            ).exists():
+            ).values('archived_until').first()
+            if chat is None:
                 return Message.objects.none()
+            # Граница архива нужна пагинации истории
+            self.archived_until = chat['archived_until']
             
             return Message.objects.filter(
                 chat_id=chat_id,
@@ -206,7 +438,7 @@ class MessageViewSet(viewsets.ModelViewSet):
                 'sender', 'chat'
             ).prefetch_related(
                 'attachments'
-            ).order_by('-created_at')
+            ).order_by('-created_at', '-id')
         
         # Если chat_id не указан, возвращаем пустой queryset
         return Message.objects.none()
@@ -224,16 +456,9 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
+        # Сообщение, вложения и счетчики непрочитанных пишутся в одной транзакции
         message = serializer.save()
         
-        # Обновляем счетчик непрочитанных сообщений для других участников
-        other_participants = chat.participants.exclude(id=request.user.id)
-        for participant in other_participants:
-            ChatParticipantStatus.objects.filter(
-                chat=chat,
-                user=participant
-            ).update(unread_count=F('unread_count') + 1)
-        
         # Возвращаем созданное сообщение с полной информацией
         response_serializer = MessageSerializer(message, context={'request': request})
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
@@ -243,22 +468,94 @@ class MessageViewSet(viewsets.ModelViewSet):
         """Отметить сообщение как прочитанное"""
         message = self.get_object()
         
-        # Только получатель может отметить сообщение как прочитанное
-        if message.sender != request.user and not message.is_read:
-            message.is_read = True
-            message.read_at = timezone.now()
-            message.save(update_fields=['is_read', 'read_at'])
-            
-            # Уменьшаем счетчик непрочитанных сообщений
-            ChatParticipantStatus.objects.filter(
-                chat=message.chat,
-                user=request.user,
-                unread_count__gt=0
-            ).update(unread_count=F('unread_count') - 1)
+        # Только получатель может отметить сообщение как прочитанное.
+        # Отметка прочтения сдвигается до этого сообщения, счетчик пересчитывается
+        if message.sender_id != request.user.id and ChatParticipantStatus.mark_read(
+            message.chat_id, request.user.id, message.id
+        ):
+            current = ChatParticipantStatus.objects.get(chat_id=message.chat_id, user=request.user)
+            publish_read_receipt(message.chat_id, request.user.id, current.last_read_at, message_id=message.id)
+            publish_statuses([current])
         
         return Response({'status': 'success'})
 
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Полнотекстовый поиск по сообщениям в чатах пользователя.
+        
+        Параметры:
+        - q: поисковый запрос (словоформы и транслитерация учитываются)
+        - chat_id: искать только в одном чате
+        - before_id: следующая страница - сообщения старше указанного
+        - page_size: размер страницы
+        
+        Результаты упорядочены от новых к старым. Каждый содержит id чата и
+        сообщения: контекст открывается запросом
+        /messages/?chat_id=<chat>&before_id=<id> (или after_id)
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {'error': 'q is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            before_id = request.query_params.get('before_id')
+            before_id = int(before_id) if before_id else None
+            chat_id = request.query_params.get('chat_id')
+            chat_id = int(chat_id) if chat_id else None
+        except ValueError:
+            return Response(
+                {'error': 'chat_id and before_id must be integers'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        page_size = MessageKeysetPagination().get_page_size(request)
+        
+        chats = Chat.objects.filter(participants=request.user, is_deleted=False)
+        if chat_id is not None:
+            chats = chats.filter(id=chat_id)
+        chat_ids = list(chats.values_list('id', flat=True))
+        
+        backend = get_search_backend()
+        if backend is not None:
+            message_ids = backend.search(query, chat_ids, before_id, page_size + 1)
+        else:
+            messages = Message.objects.filter(
+                chat_id__in=chat_ids, is_deleted=False, content__icontains=query
+            )
+            if before_id is not None:
+                messages = messages.filter(id__lt=before_id)
+            message_ids = list(messages.order_by('-id').values_list('id', flat=True)[:page_size + 1])
+        
+        has_more = len(message_ids) > page_size
+        message_ids = message_ids[:page_size]
+        
+        messages = list(Message.objects.filter(
+            id__in=message_ids, chat_id__in=chat_ids, is_deleted=False
+        ).select_related('sender').prefetch_related('sender__roles', 'attachments'))
+        # Остальные найденные сообщения перенесены в архив (messaging.archive)
+        missing = set(message_ids) - {message.id for message in messages}
+        if missing:
+            messages += [
+                archived.as_message() for archived in ArchivedMessage.objects.filter(
+                    id__in=missing, chat_id__in=chat_ids, is_deleted=False
+                ).select_related('sender')
+            ]
+        messages.sort(key=lambda message: message.id, reverse=True)
+        serializer = MessageSerializer(messages, many=True, context=self.get_serializer_context())
+        
+        next_link = None
+        if has_more:
+            next_link = replace_query_param(request.build_absolute_uri(), 'before_id', message_ids[-1])
+        return Response(OrderedDict([
+            ('next', next_link),
+            ('results', serializer.data),
+        ]))
+
+
 class MessageAttachmentViewSet(viewsets.ReadOnlyModelViewSet):
     """
     ViewSet для работы с вложениями сообщений (только чтение)
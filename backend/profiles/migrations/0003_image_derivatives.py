@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0002_alter_location_latitude_alter_location_longitude_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatar_derivatives',
+            field=models.JSONField(blank=True, default=dict, help_text='Уменьшенные копии аватара по размерам IMAGE_SIZES', verbose_name='Производные аватара'),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from common.models import TimeStampedModel, SoftDeleteModel
+from common.images import schedule_derivatives
 import logging
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -38,6 +39,12 @@ class UserProfile(TimeStampedModel):
         blank=True,
         help_text=_("Изображение профиля пользователя")
     )
+    avatar_derivatives = models.JSONField(
+        _("Производные аватара"),
+        default=dict,
+        blank=True,
+        help_text=_("Уменьшенные копии аватара по размерам IMAGE_SIZES")
+    )
     bio = models.TextField(
         _("О себе"), 
         null=True, 
@@ -114,6 +121,15 @@ def create_user_profile(sender, instance, created, **kwargs):
             logger.error(f"Ошибка при создании профиля для пользователя {instance.username}: {str(e)}")
 
 
+# Сигнал для создания уменьшенных копий аватара после загрузки
+@receiver(post_save, sender=UserProfile)
+def create_avatar_derivatives(sender, instance, **kwargs):
+    """
+    Ставит в очередь создание производных аватара по IMAGE_SIZES
+    """
+    schedule_derivatives(instance, file_field='avatar', derivatives_field='avatar_derivatives')
+
+
 class Location(TimeStampedModel):
     """
     Модель для адресов пользователей
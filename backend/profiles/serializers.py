@@ -2,6 +2,7 @@ from rest_framework import serializers
 from .models import UserProfile, Location, UserPreference
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from common.images import derivative_urls
 import logging
 
 # Настраиваем логгер
@@ -14,10 +15,11 @@ class UserProfileSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     email = serializers.EmailField(source='user.email', read_only=True)
     avatar_url = serializers.SerializerMethodField()
+    avatar_urls = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
-        fields = ['id', 'username', 'email', 'avatar', 'avatar_url', 'bio', 'phone_number', 
+        fields = ['id', 'username', 'email', 'avatar', 'avatar_url', 'avatar_urls', 'bio', 'phone_number', 
                  'rating', 'total_reviews', 'successful_trades', 'created_at', 'updated_at']
         read_only_fields = ['id', 'rating', 'total_reviews', 'successful_trades', 
                           'created_at', 'updated_at']
@@ -36,6 +38,12 @@ class UserProfileSerializer(serializers.ModelSerializer):
         if settings.USE_S3:
             return f"{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}/{settings.MEDIA_LOCATION}/{avatar_path}"
         return f"{settings.MEDIA_URL}{avatar_path}"
+
+    def get_avatar_urls(self, obj):
+        """
+        Получает URL уменьшенных копий аватара по размерам IMAGE_SIZES
+        """
+        return derivative_urls(obj.avatar_derivatives)
     
     def validate_avatar(self, value):
         """
@@ -186,13 +194,14 @@ class PublicUserProfileSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField(source='user.first_name', read_only=True)
     last_name = serializers.CharField(source='user.last_name', read_only=True)
     avatar_url = serializers.SerializerMethodField()
+    avatar_urls = serializers.SerializerMethodField()
     full_name = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
         fields = [
             'id', 'username', 'first_name', 'last_name', 'full_name',
-            'avatar', 'avatar_url', 'bio', 'rating', 'total_reviews', 
+            'avatar', 'avatar_url', 'avatar_urls', 'bio', 'rating', 'total_reviews', 
             'successful_trades', 'created_at'
         ]
         read_only_fields = ['id', 'username', 'first_name', 'last_name', 
@@ -212,6 +221,12 @@ class PublicUserProfileSerializer(serializers.ModelSerializer):
         if settings.USE_S3:
             return f"{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}/{settings.MEDIA_LOCATION}/{avatar_path}"
         return f"{settings.MEDIA_URL}{avatar_path}"
+
+    def get_avatar_urls(self, obj):
+        """
+        Получает URL уменьшенных копий аватара по размерам IMAGE_SIZES
+        """
+        return derivative_urls(obj.avatar_derivatives)
     
     def get_full_name(self, obj):
         """
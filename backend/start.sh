@@ -4,10 +4,15 @@
 echo "Waiting for database..."
 sleep 5
 
+# Проверяем настройки сервера (общий кэш и др.); при ошибках не запускаемся
+echo "Checking deployment settings..."
+python manage.py check --deploy --fail-level ERROR || exit 1
+
 # Применяем миграции
 echo "Applying migrations..."
 python manage.py migrate
 
-# Запускаем сервер
+# Запускаем ASGI-сервер: HTTP и WebSocket-соединения чатов (backend.asgi).
+# Число процессов - WEB_CONCURRENCY; с брокером в памяти допустим один (messaging.E001)
 echo "Starting server..."
-python manage.py runserver 0.0.0.0:8000 
\ No newline at end of file
+exec uvicorn backend.asgi:application --host 0.0.0.0 --port 8000 --workers "${WEB_CONCURRENCY:-1}"
\ No newline at end of file
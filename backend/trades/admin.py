@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import TradeStatus, TradeOffer, TradeOfferItem, TradeHistory
+from .models import TradeStatus, TradeOffer, TradeOfferItem, TradeHistory, TradeCycle, TradeCycleMember
 
 
 @admin.register(TradeStatus)
@@ -163,3 +163,23 @@ class TradeHistoryAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         """Запрещаем добавление записей вручную"""
         return False
+
+
+class TradeCycleMemberInline(admin.TabularInline):
+    """Инлайн для участников цикла обмена"""
+    model = TradeCycleMember
+    extra = 0
+    readonly_fields = ['position', 'user', 'item', 'score']
+    fields = ['position', 'user', 'item', 'score']
+    can_delete = False
+
+
+@admin.register(TradeCycle)
+class TradeCycleAdmin(admin.ModelAdmin):
+    """Админка для найденных циклов обмена (только просмотр)"""
+    list_display = ['key', 'length', 'score', 'created_at']
+    list_filter = ['length']
+    search_fields = ['key']
+    readonly_fields = ['key', 'length', 'score', 'created_at']
+    inlines = [TradeCycleMemberInline]
+
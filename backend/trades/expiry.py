@@ -0,0 +1,100 @@
+"""
+Автоматическое истечение ожидающих ответа предложений обмена.
+
+При создании предложению назначается срок ответа expires_at
+(TRADE_OFFER_EXPIRE_AFTER_DAYS). Предложения, не получившие ответа до этого
+срока, переводятся в статус 'expired' пачками по TRADE_OFFER_EXPIRE_BATCH_SIZE:
+одна пачка - одна транзакция с одним UPDATE по списку id и одной вставкой
+записей истории. Поиск идет по частичному индексу expires_at, в котором есть
+только ожидающие предложения (после ответа срок сбрасывается).
+
+Строки пачки блокируются SELECT ... FOR UPDATE SKIP LOCKED, поэтому команду
+можно запускать одновременно на нескольких узлах: пачки не пересекаются, а
+повторный запуск не находит уже истекших предложений.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from common import lookups
+from .models import TradeHistory, TradeOffer, TradeStatus
+from .summary import schedule_summary_invalidation
+
+logger = logging.getLogger(__name__)
+
+EXPIRED_STATUS = 'expired'
+EXPIRED_COMMENT = 'Срок ответа на предложение истек'
+
+
+def offer_expires_at(now=None):
+    """Срок ответа для нового предложения (None - предложения не истекают)"""
+    days = settings.TRADE_OFFER_EXPIRE_AFTER_DAYS
+    if not days:
+        return None
+    return (now or timezone.now()) + timedelta(days=days)
+
+
+def expire_batch(now, batch_size, pending_id, expired_id):
+    """
+    Переводит в статус 'expired' одну пачку просроченных предложений.
+    Возвращает количество истекших предложений (0 - больше нечего обрабатывать)
+    """
+    with transaction.atomic():
+        rows = list(
+            TradeOffer.objects.filter(
+                status_id=pending_id, expires_at__isnull=False, expires_at__lte=now
+            ).select_for_update(skip_locked=True).order_by('expires_at').values_list(
+                'id', 'initiator_id', 'receiver_id'
+            )[:batch_size]
+        )
+        if not rows:
+            return 0
+        offer_ids = [offer_id for offer_id, _, _ in rows]
+
+        TradeOffer.objects.filter(pk__in=offer_ids, status_id=pending_id).update(
+            status_id=expired_id, expires_at=None, updated_at=now
+        )
+        TradeHistory.objects.bulk_create([
+            TradeHistory(
+                trade_offer_id=offer_id,
+                previous_status_id=pending_id,
+                new_status_id=expired_id,
+                changed_by=None,
+                comment=EXPIRED_COMMENT
+            )
+            for offer_id in offer_ids
+        ])
+        # UPDATE не отправляет post_save: сводки участников сбрасываем явно
+        participants = set()
+        for _, initiator_id, receiver_id in rows:
+            participants.update((initiator_id, receiver_id))
+        schedule_summary_invalidation(*participants)
+
+    return len(offer_ids)
+
+
+def expire_trade_offers(batch_size=None, limit=None, now=None):
+    """
+    Переводит просроченные предложения в статус 'expired'. Точка входа для
+    планировщика (команда expire_trade_offers). Возвращает количество истекших
+    """
+    pending = lookups.find(TradeStatus, 'pending')
+    expired_status = lookups.find(TradeStatus, EXPIRED_STATUS)
+    if pending is None or expired_status is None:
+        logger.warning(f"Не найдены статусы 'pending' и '{EXPIRED_STATUS}': предложения не обработаны")
+        return 0
+    batch_size = batch_size or settings.TRADE_OFFER_EXPIRE_BATCH_SIZE
+    now = now or timezone.now()
+
+    total = 0
+    while limit is None or total < limit:
+        size = batch_size if limit is None else min(batch_size, limit - total)
+        expired = expire_batch(now, size, pending.pk, expired_status.pk)
+        if not expired:
+            break
+        total += expired
+        logger.info(f"Истекло предложений обмена: {expired} (всего {total})")
+    return total
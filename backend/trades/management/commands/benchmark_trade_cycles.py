@@ -0,0 +1,84 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from trades.matching import WantsGraph, find_cycles, neighbourhood
+
+
+class Command(BaseCommand):
+    help = 'Замеряет построение графа "хочет" и поиск циклов обмена на синтетических данных без БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--favorites', type=int, default=1000000, help='Количество записей избранного')
+        parser.add_argument('--users', type=int, default=200000, help='Количество пользователей')
+        parser.add_argument('--items-per-user', type=int, default=5, help='Предметов у пользователя')
+        parser.add_argument('--dirty', type=int, default=1000, help='Пользователей для инкрементального пересчета')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = options['users']
+        items_per_user = options['items_per_user']
+
+        # Популярность пользователей неравномерна: часть предметов хотят чаще
+        weights = [1.0 / (rank + 10) for rank in range(users)]
+        owners = rng.choices(range(1, users + 1), weights=weights, k=options['favorites'])
+        rows = [
+            (rng.randint(1, users), owner, owner * items_per_user + rng.randrange(items_per_user))
+            for owner in owners
+        ]
+
+        started = time.perf_counter()
+        graph = WantsGraph.from_edges(rows)
+        build_time = time.perf_counter() - started
+        arrays = (graph.offsets, graph.targets, graph.items, graph.counts, graph.reverse_offsets, graph.reverse_sources)
+        size = sum(len(values) * values.itemsize for values in arrays)
+        self.stdout.write(
+            f'Граф: {len(graph)} пользователей, {graph.edge_count} ребер, '
+            f'построен за {build_time:.1f} с (массивы смежности {size / 1024 / 1024:.0f} МБ)'
+        )
+
+        started = time.perf_counter()
+        cycles = find_cycles(graph)
+        full_time = time.perf_counter() - started
+        lengths = {}
+        for members, _ in cycles.values():
+            lengths[len(members)] = lengths.get(len(members), 0) + 1
+        self.stdout.write(
+            f'Полный поиск (длина до {settings.TRADE_CYCLE_MAX_LENGTH}): {len(cycles)} циклов '
+            f'за {full_time:.1f} с, по длинам: {dict(sorted(lengths.items()))}'
+        )
+
+        nodes = rng.sample(range(len(graph)), min(options['dirty'], len(graph)))
+        started = time.perf_counter()
+        cycles = find_cycles(graph, nodes)
+        incremental_time = time.perf_counter() - started
+        self.stdout.write(
+            f'Инкрементальный поиск для {len(nodes)} пользователей: {len(cycles)} циклов '
+            f'за {incremental_time:.2f} с ({incremental_time / max(len(nodes), 1) * 1000:.1f} мс на пользователя)'
+        )
+        self.stdout.write(
+            f'Загрузка полного графа при инкрементальном пересчете: построение из всех {len(rows)} '
+            f'записей избранного {build_time:.1f} с, не считая их чтения из БД'
+        )
+
+        # Окрестность по тому же графу - как load_graph(user_ids) выбирает ее запросами
+        def step(neighbours):
+            return lambda frontier: {graph.user_ids[other] for user_id in frontier for other in neighbours(graph.index[user_id])}
+
+        user_ids = {graph.user_ids[node] for node in nodes}
+        started = time.perf_counter()
+        area = neighbourhood(
+            user_ids, settings.TRADE_CYCLE_MAX_LENGTH, step(graph.successors), step(graph.predecessors)
+        )
+        area_rows = [row for row in rows if row[0] in area and row[1] in area]
+        subgraph = WantsGraph.from_edges(area_rows)
+        cycles = find_cycles(subgraph, [subgraph.index[user_id] for user_id in sorted(user_ids) if user_id in subgraph.index])
+        area_time = time.perf_counter() - started
+        self.stdout.write(
+            f'Окрестность {len(nodes)} пользователей: {len(subgraph)} пользователей, {subgraph.edge_count} ребер '
+            f'({len(area_rows)} записей избранного, {len(area_rows) / max(len(rows), 1):.0%}), '
+            f'загрузка и поиск за {area_time:.2f} с, {len(cycles)} циклов'
+        )
@@ -31,6 +31,11 @@ class Command(BaseCommand):
                 'name': 'cancelled',
                 'description': 'Отменено',
                 'order': 5
+            },
+            {
+                'name': 'expired',
+                'description': 'Истек срок ответа',
+                'order': 6
             }
         ]
 
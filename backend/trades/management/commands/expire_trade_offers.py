@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from trades.expiry import expire_trade_offers
+
+
+class Command(BaseCommand):
+    help = (
+        'Переводит ожидающие предложения обмена с истекшим сроком ответа в статус expired. '
+        'Запускается по расписанию (cron) или с --interval как постоянный процесс; '
+        'одновременный запуск на нескольких узлах безопасен'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Предложений в одной транзакции (по умолчанию TRADE_OFFER_EXPIRE_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Максимум предложений за один запуск'
+        )
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Повторять каждые N секунд (0 - однократный запуск)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            expired = expire_trade_offers(batch_size=options['batch_size'], limit=options['limit'])
+            self.stdout.write(self.style.SUCCESS(f'Истекло предложений обмена: {expired}'))
+
+            if not options['interval']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from trades.matching import rebuild_trade_cycles, update_trade_cycles
+
+
+class Command(BaseCommand):
+    help = (
+        'Ищет циклы обмена по избранному пользователей. По умолчанию пересчитывает '
+        'только циклы измененных пользователей; --full перестраивает все циклы. '
+        'Запускается по расписанию (cron) или с --interval как постоянный процесс'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Полный пересчет всех циклов')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Повторять инкрементальный пересчет каждые N секунд (0 - однократный запуск)'
+        )
+
+    def handle(self, *args, **options):
+        if options['full']:
+            cycles = rebuild_trade_cycles()
+            self.stdout.write(self.style.SUCCESS(f'Циклы обмена пересчитаны: {cycles}'))
+
+        while True:
+            users, cycles = update_trade_cycles()
+            if users or not options['full']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Обновлены циклы {users} пользователей, найдено циклов: {cycles}'
+                ))
+
+            if not options['interval']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
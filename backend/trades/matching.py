@@ -0,0 +1,402 @@
+"""
+Поиск циклов обмена между несколькими пользователями.
+
+Граф "хочет" строится по избранному: ребро u -> v, если пользователь u добавил
+в избранное доступный предмет пользователя v. Цикл u1 -> u2 -> ... -> uk -> u1
+длиной от 2 до TRADE_CYCLE_MAX_LENGTH - это обмен, в котором каждый участник
+получает желаемый предмет от следующего участника.
+
+Граф хранится компактно: пользователи нумеруются плотными индексами в порядке
+id, исходящие и входящие ребра - массивы смежности (CSR) array('i'). Циклы
+через узел s ищутся встречей на середине: множества узлов, из которых s
+достижим за 1 и 2 шага, строятся по входящим ребрам, а прямой обход идет на
+глубину не больше TRADE_CYCLE_MAX_LENGTH - 2. Каждый цикл находится ровно
+одним путем; обход ограничен TRADE_CYCLE_MAX_EXPANSIONS шагами на узел.
+
+Найденные циклы ранжируются и сохраняются в TradeCycle/TradeCycleMember.
+Полный пересчет перестраивает таблицы целиком; инкрементальный обрабатывает
+только пользователей из TradeCycleDirtyUser (их отмечают сигналы избранного
+и предметов) - удаляет их циклы и ищет заново циклы через них и через
+остальных участников удаленных циклов (цикл мог сохраняться как один из
+лучших только для другого участника). Инкрементальный пересчет загружает не
+весь граф, а только окрестность этих пользователей: тех, кто может быть в
+цикле длиной до TRADE_CYCLE_MAX_LENGTH через одного из них.
+"""
+import logging
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from common import lookups
+
+logger = logging.getLogger(__name__)
+
+# Статус предметов, которые можно получить в обмене
+AVAILABLE_STATUS = 'Доступен'
+
+# Сколько предметов одного владельца в избранном дают максимальный вес ребра
+EDGE_WEIGHT_CAP = 3
+
+# Количество пользователей в одном запросе IN при загрузке окрестности
+NEIGHBOURHOOD_BATCH_SIZE = 500
+
+
+class WantsGraph:
+    """Граф "хочет" в виде массивов смежности"""
+
+    def __init__(self, user_ids, offsets, targets, items, counts):
+        # Плотный индекс -> id пользователя (по возрастанию id)
+        self.user_ids = user_ids
+        self.offsets = offsets
+        self.targets = targets
+        # Для ребра: последний добавленный в избранное предмет и число предметов
+        self.items = items
+        self.counts = counts
+        self.index = {user_id: node for node, user_id in enumerate(user_ids)}
+        self.reverse_offsets, self.reverse_sources = self._reverse()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    @classmethod
+    def from_edges(cls, rows):
+        """
+        Строит граф из (user_id, owner_id, item_id) в порядке добавления в
+        избранное. Петли отбрасываются, параллельные ребра схлопываются
+        """
+        edges = {}
+        nodes = set()
+        for user_id, owner_id, item_id in rows:
+            if user_id == owner_id:
+                continue
+            key = (user_id, owner_id)
+            edge = edges.get(key)
+            if edge is None:
+                edges[key] = [item_id, 1]
+                nodes.add(user_id)
+                nodes.add(owner_id)
+            else:
+                edge[0] = item_id
+                edge[1] += 1
+
+        user_ids = sorted(nodes)
+        index = {user_id: node for node, user_id in enumerate(user_ids)}
+        offsets = array('i', [0]) * (len(user_ids) + 1)
+        for user_id, _ in edges:
+            offsets[index[user_id] + 1] += 1
+        for node in range(len(user_ids)):
+            offsets[node + 1] += offsets[node]
+
+        targets = array('i', [0]) * len(edges)
+        items = array('q', [0]) * len(edges)
+        counts = array('i', [0]) * len(edges)
+        position = array('i', offsets[:-1]) if user_ids else array('i')
+        for (user_id, owner_id), (item_id, count) in edges.items():
+            node = index[user_id]
+            slot = position[node]
+            position[node] += 1
+            targets[slot] = index[owner_id]
+            items[slot] = item_id
+            counts[slot] = count
+        return cls(user_ids, offsets, targets, items, counts)
+
+    def _reverse(self):
+        size = len(self.user_ids)
+        offsets = array('i', [0]) * (size + 1)
+        for target in self.targets:
+            offsets[target + 1] += 1
+        for node in range(size):
+            offsets[node + 1] += offsets[node]
+        sources = array('i', [0]) * len(self.targets)
+        position = array('i', offsets[:-1]) if size else array('i')
+        for node in range(size):
+            for slot in range(self.offsets[node], self.offsets[node + 1]):
+                target = self.targets[slot]
+                sources[position[target]] = node
+                position[target] += 1
+        return offsets, sources
+
+    def successors(self, node):
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def predecessors(self, node):
+        return self.reverse_sources[self.reverse_offsets[node]:self.reverse_offsets[node + 1]]
+
+    def edge(self, source, target):
+        """(item_id, count) ребра source -> target"""
+        for slot in range(self.offsets[source], self.offsets[source + 1]):
+            if self.targets[slot] == target:
+                return self.items[slot], self.counts[slot]
+        raise KeyError((source, target))
+
+    def cycles_through(self, start, max_length, canonical=False, max_expansions=None):
+        """
+        Циклы через узел start длиной 2..max_length - кортежи узлов, начиная
+        со start. canonical=True ищет только циклы, в которых start - наименьший
+        узел: так полный обход находит каждый цикл один раз
+        """
+        lower = start if canonical else -1
+
+        def allowed(node):
+            return node > lower and node != start
+
+        # Узлы, из которых start достижим за 1 шаг, и за 2 шага - с серединами путей
+        back1 = {node for node in self.predecessors(start) if allowed(node)}
+        back2 = {}
+        if max_length >= 3:
+            for middle in back1:
+                for node in self.predecessors(middle):
+                    if allowed(node) and node != middle:
+                        back2.setdefault(node, []).append(middle)
+
+        # Длина k+1 замыкается через back1 на глубине 1..depth, длина depth+2 -
+        # через back2 на глубине depth; так каждый цикл находится одним путем
+        depth_limit = max_length - 2
+        found = []
+        path = [start]
+        on_path = {start}
+        budget = [max_expansions or float('inf')]
+
+        def close(node, depth):
+            if 1 <= depth <= depth_limit and node in back1:
+                found.append(tuple(path))
+            if depth == depth_limit:
+                for middle in back2.get(node, ()):
+                    if middle not in on_path:
+                        found.append(tuple(path) + (middle,))
+
+        def visit(node, depth):
+            close(node, depth)
+            if depth == depth_limit:
+                return
+            for target in self.successors(node):
+                if budget[0] <= 0:
+                    return
+                if not allowed(target) or target in on_path:
+                    continue
+                budget[0] -= 1
+                path.append(target)
+                on_path.add(target)
+                visit(target, depth + 1)
+                path.pop()
+                on_path.discard(target)
+
+        if depth_limit == 0:
+            # Только обмены вдвоем
+            found.extend((start, middle) for middle in back1 if start in self.predecessors(middle))
+            return found
+        visit(start, 0)
+        return found
+
+    def describe(self, cycle):
+        """
+        Участники цикла в id пользователей, начиная с наименьшего id:
+        (ключ, [(user_id, item_id), ...], оценка)
+        """
+        size = len(cycle)
+        members = []
+        weight = 0
+        for position, node in enumerate(cycle):
+            item_id, count = self.edge(node, cycle[(position + 1) % size])
+            members.append((self.user_ids[node], item_id))
+            weight += min(count, EDGE_WEIGHT_CAP)
+        first = min(range(size), key=lambda position: members[position][0])
+        members = members[first:] + members[:first]
+        # Короткие циклы проще довести до обмена; вес ребер - насколько сильно хотят
+        score = round(weight / (EDGE_WEIGHT_CAP * size) / (size - 1), 6)
+        return '-'.join(str(user_id) for user_id, _ in members), members, score
+
+
+def _distances(user_ids, hops, step, allowed=None):
+    """Расстояния до hops шагов от user_ids; step(множество) - соседи множества"""
+    distances = dict.fromkeys(user_ids, 0)
+    frontier = set(user_ids)
+    for depth in range(1, hops + 1):
+        if not frontier:
+            break
+        frontier = {
+            user_id for user_id in step(frontier)
+            if user_id not in distances and (allowed is None or allowed(user_id, depth))
+        }
+        for user_id in frontier:
+            distances[user_id] = depth
+    return distances
+
+
+def neighbourhood(user_ids, max_length, successors, predecessors):
+    """
+    Пользователи, которые могут быть в цикле длиной до max_length через
+    одного из user_ids: путь от user_ids до них и обратно не длиннее max_length.
+    successors/predecessors(множество) - соседи множества по исходящим и входящим ребрам
+    """
+    forward = _distances(user_ids, max_length - 1, successors)
+    # Обратный путь проходит только по участникам цикла, то есть по forward
+    backward = _distances(
+        user_ids, max_length - 1, predecessors,
+        allowed=lambda user_id, depth: user_id in forward and forward[user_id] + depth <= max_length,
+    )
+    return set(backward)
+
+
+def _batches(user_ids):
+    user_ids = sorted(user_ids)
+    for start in range(0, len(user_ids), NEIGHBOURHOOD_BATCH_SIZE):
+        yield user_ids[start:start + NEIGHBOURHOOD_BATCH_SIZE]
+
+
+def _linked(favorites, field, linked_field, user_ids):
+    linked = set()
+    for batch in _batches(user_ids):
+        linked.update(
+            favorites.filter(**{f'{field}__in': batch}).order_by().values_list(linked_field, flat=True).distinct()
+        )
+    return linked
+
+
+def _rows_within(favorites, user_ids):
+    # Все ребра пользователя попадают в одну пачку, порядок добавления внутри ребра сохраняется
+    for batch in _batches(user_ids):
+        rows = favorites.filter(user_id__in=batch).order_by('created_at', 'id').values_list(
+            'user_id', 'item__owner_id', 'item_id'
+        )
+        for row in rows.iterator(chunk_size=10000):
+            if row[1] in user_ids:
+                yield row
+
+
+def load_graph(user_ids=None):
+    """
+    Граф по избранному на доступные предметы. С user_ids - только окрестность
+    этих пользователей (см. neighbourhood): циклы через них в ней те же, что в полном графе
+    """
+    from items.models import Favorite, ItemStatus
+
+    available = lookups.find(ItemStatus, AVAILABLE_STATUS)
+    if available is None:
+        logger.warning(f"Не найден статус '{AVAILABLE_STATUS}': граф обменов пуст")
+        return WantsGraph.from_edges(())
+    favorites = Favorite.objects.filter(
+        item__status_id=available.pk, item__is_deleted=False
+    ).exclude(user_id=F('item__owner_id'))
+    if user_ids is None:
+        rows = favorites.order_by('created_at', 'id').values_list('user_id', 'item__owner_id', 'item_id')
+        return WantsGraph.from_edges(rows.iterator(chunk_size=10000))
+
+    nodes = neighbourhood(
+        user_ids, settings.TRADE_CYCLE_MAX_LENGTH,
+        successors=lambda frontier: _linked(favorites, 'user_id', 'item__owner_id', frontier),
+        predecessors=lambda frontier: _linked(favorites, 'item__owner_id', 'user_id', frontier),
+    )
+    return WantsGraph.from_edges(_rows_within(favorites, nodes))
+
+
+def find_cycles(graph, nodes=None):
+    """
+    Циклы графа: {ключ: (участники, оценка)}. Без nodes - все циклы,
+    иначе только проходящие через указанные узлы
+    """
+    max_length = settings.TRADE_CYCLE_MAX_LENGTH
+    per_node = settings.TRADE_CYCLES_PER_USER
+    max_expansions = settings.TRADE_CYCLE_MAX_EXPANSIONS
+    canonical = nodes is None
+
+    cycles = {}
+    for node in (range(len(graph)) if canonical else nodes):
+        found = [
+            graph.describe(cycle)
+            for cycle in graph.cycles_through(node, max_length, canonical, max_expansions)
+        ]
+        # Лучшие циклы узла: короткие и с сильными ребрами
+        found.sort(key=lambda described: (-described[2], described[0]))
+        for key, members, score in found[:per_node]:
+            cycles[key] = (members, score)
+    return cycles
+
+
+def _save(cycles):
+    from .models import TradeCycle, TradeCycleMember
+
+    batch_size = 1000
+    keys = list(cycles)
+    for start in range(0, len(keys), batch_size):
+        created = TradeCycle.objects.bulk_create([
+            TradeCycle(key=key, length=len(cycles[key][0]), score=cycles[key][1])
+            for key in keys[start:start + batch_size]
+        ])
+        TradeCycleMember.objects.bulk_create([
+            TradeCycleMember(cycle=cycle, user_id=user_id, item_id=item_id, position=position, score=cycle.score)
+            for cycle in created
+            for position, (user_id, item_id) in enumerate(cycles[cycle.key][0])
+        ], batch_size=batch_size)
+
+
+def rebuild_trade_cycles():
+    """Полный пересчет циклов обмена. Возвращает количество циклов"""
+    from .models import TradeCycle, TradeCycleDirtyUser
+
+    graph = load_graph()
+    cycles = find_cycles(graph)
+    with transaction.atomic():
+        TradeCycleDirtyUser.objects.all().delete()
+        TradeCycle.objects.all().delete()
+        _save(cycles)
+    logger.info(
+        f"Циклы обмена пересчитаны: {len(graph)} пользователей, {graph.edge_count} ребер, {len(cycles)} циклов"
+    )
+    return len(cycles)
+
+
+def update_trade_cycles():
+    """
+    Инкрементальный пересчет циклов пользователей из TradeCycleDirtyUser.
+    Возвращает (количество пользователей, количество найденных циклов)
+    """
+    from .models import TradeCycle, TradeCycleDirtyUser, TradeCycleMember
+
+    marks = list(TradeCycleDirtyUser.objects.values_list('user_id', 'marked_at'))
+    if not marks:
+        return 0, 0
+    user_ids = [user_id for user_id, _ in marks]
+    # Участники удаляемых циклов: их лучшие циклы тоже пересчитываются
+    affected = set(user_ids)
+    affected.update(
+        TradeCycleMember.objects.filter(cycle__members__user_id__in=user_ids).values_list('user_id', flat=True)
+    )
+
+    graph = load_graph(affected)
+    nodes = [graph.index[user_id] for user_id in sorted(affected) if user_id in graph.index]
+    cycles = find_cycles(graph, nodes)
+
+    with transaction.atomic():
+        TradeCycle.objects.filter(members__user_id__in=user_ids).delete()
+        existing = set(TradeCycle.objects.filter(key__in=list(cycles)).values_list('key', flat=True))
+        _save({key: value for key, value in cycles.items() if key not in existing})
+        # Отметки, поставленные во время пересчета, остаются до следующего запуска
+        for user_id, marked_at in marks:
+            TradeCycleDirtyUser.objects.filter(user_id=user_id, marked_at=marked_at).delete()
+    logger.info(
+        f"Циклы обмена обновлены для {len(user_ids)} пользователей: {len(cycles)} циклов "
+        f"(окрестность {len(graph)} пользователей, {graph.edge_count} ребер)"
+    )
+    return len(user_ids), len(cycles)
+
+
+def mark_users_dirty(user_ids):
+    """Отмечает пользователей, чьи циклы нужно пересчитать"""
+    from .models import TradeCycleDirtyUser
+
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    # Обновляем время уже поставленных отметок: пересчет, идущий сейчас, их не снимет
+    TradeCycleDirtyUser.objects.filter(user_id__in=user_ids).update(marked_at=timezone.now())
+    TradeCycleDirtyUser.objects.bulk_create(
+        [TradeCycleDirtyUser(user_id=user_id) for user_id in user_ids], ignore_conflicts=True
+    )
@@ -0,0 +1,65 @@
+# Generated by Django 5.1.7 on 2026-10-17 04:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_create_superuser'),
+        ('items', '0005_image_derivatives'),
+        ('trades', '0002_tradeoffer_location'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TradeCycle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='id участников в порядке цикла, начиная с наименьшего', max_length=255, unique=True, verbose_name='Ключ')),
+                ('length', models.PositiveSmallIntegerField(help_text='Количество участников цикла', verbose_name='Длина')),
+                ('score', models.FloatField(help_text='Оценка цикла для ранжирования предложений', verbose_name='Оценка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Цикл обмена',
+                'verbose_name_plural': 'Циклы обмена',
+                'db_table': 'trade_cycles',
+                'ordering': ['-score', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TradeCycleDirtyUser',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('marked_at', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Пользователь для пересчета циклов',
+                'verbose_name_plural': 'Пользователи для пересчета циклов',
+                'db_table': 'trade_cycle_dirty_users',
+            },
+        ),
+        migrations.CreateModel(
+            name='TradeCycleMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(verbose_name='Позиция')),
+                ('score', models.FloatField(help_text='Копия оценки цикла для списка предложений пользователя', verbose_name='Оценка')),
+                ('cycle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='trades.tradecycle', verbose_name='Цикл обмена')),
+                ('item', models.ForeignKey(help_text='Предмет из избранного пользователя, который он получает в цикле', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='items.item', verbose_name='Получаемый предмет')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trade_cycle_memberships', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Участник цикла обмена',
+                'verbose_name_plural': 'Участники циклов обмена',
+                'db_table': 'trade_cycle_members',
+                'ordering': ['position'],
+                'indexes': [models.Index(fields=['user', '-score'], name='cycle_member_user_score_idx')],
+                'unique_together': {('cycle', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-17 04:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0003_image_derivatives'),
+        ('trades', '0003_trade_cycles'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tradeoffer',
+            index=models.Index(fields=['initiator', 'status'], name='trade_offer_initiator_st_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradeoffer',
+            index=models.Index(fields=['receiver', 'status'], name='trade_offer_receiver_st_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-17 04:22
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+from common import lookups
+
+
+def create_expired_status(apps, schema_editor):
+    """Создает статус 'expired' на уже развернутых базах (trades.expiry)"""
+    TradeStatus = apps.get_model('trades', 'TradeStatus')
+
+    _, created = TradeStatus.objects.get_or_create(
+        name='expired', defaults={'description': 'Истек срок ответа', 'order': 6}
+    )
+    if created:
+        lookups.invalidate(TradeStatus)
+
+
+def set_pending_deadlines(apps, schema_editor):
+    """Назначает срок ответа уже ожидающим предложениям (отсчет от даты создания)"""
+    TradeOffer = apps.get_model('trades', 'TradeOffer')
+
+    days = getattr(settings, 'TRADE_OFFER_EXPIRE_AFTER_DAYS', 0)
+    if days:
+        TradeOffer.objects.filter(status__name='pending', expires_at__isnull=True).update(
+            expires_at=F('created_at') + timedelta(days=days)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0003_image_derivatives'),
+        ('trades', '0004_trade_offer_status_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tradeoffer',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, help_text='Ожидающее ответа предложение истекает после этой даты (trades.expiry)', null=True, verbose_name='Срок ответа'),
+        ),
+        migrations.AddIndex(
+            model_name='tradeoffer',
+            index=models.Index(condition=models.Q(('expires_at__isnull', False)), fields=['expires_at'], name='trade_offer_pending_exp_idx'),
+        ),
+        migrations.RunPython(create_expired_status, migrations.RunPython.noop),
+        migrations.RunPython(set_pending_deadlines, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from django.utils import timezone
+from common import lookups
 from common.models import TimeStampedModel
 
 User = settings.AUTH_USER_MODEL
@@ -103,21 +104,44 @@ class TradeOffer(TimeStampedModel):
         blank=True,
         help_text=_("Дата завершения обмена")
     )
+    expires_at = models.DateTimeField(
+        _("Срок ответа"),
+        null=True,
+        blank=True,
+        help_text=_("Ожидающее ответа предложение истекает после этой даты (trades.expiry)")
+    )
 
     class Meta:
         db_table = 'trade_offers'
         verbose_name = _("Предложение обмена")
         verbose_name_plural = _("Предложения обмена")
         ordering = ['-created_at']
+        indexes = [
+            # Сводка и списки предложений по направлению и статусу (trades.summary)
+            models.Index(fields=['initiator', 'status'], name='trade_offer_initiator_st_idx'),
+            models.Index(fields=['receiver', 'status'], name='trade_offer_receiver_st_idx'),
+            # Срок ответа есть только у ожидающих предложений: индекс содержит только их
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(expires_at__isnull=False),
+                name='trade_offer_pending_exp_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Обмен #{self.id}: {self.initiator.username} -> {self.receiver.username}"
     
+    def save(self, *args, **kwargs):
+        # Предложение, получившее ответ, больше не истекает и выходит из индекса сроков
+        if self.expires_at is not None and self.status_id != lookups.get_id(TradeStatus, 'pending'):
+            self.expires_at = None
+        super().save(*args, **kwargs)
+    
     def complete(self, status_name):
         """
         Завершить обмен, установив указанный статус и дату завершения
         """
-        status = TradeStatus.objects.get(name=status_name)
+        status = lookups.get(TradeStatus, status_name)
         self.status = status
         self.completed_at = timezone.now()
         self.save()
@@ -205,3 +229,100 @@ class TradeHistory(TimeStampedModel):
 
     def __str__(self):
         return f"Изменение статуса обмена #{self.trade_offer.id}: {self.previous_status.name} -> {self.new_status.name}"
+
+
+class TradeCycle(models.Model):
+    """
+    Предложенный цикл обмена между несколькими пользователями (trades.matching):
+    каждый участник получает предмет из избранного от следующего участника цикла
+    """
+    key = models.CharField(
+        _("Ключ"),
+        max_length=255,
+        unique=True,
+        help_text=_("id участников в порядке цикла, начиная с наименьшего")
+    )
+    length = models.PositiveSmallIntegerField(
+        _("Длина"),
+        help_text=_("Количество участников цикла")
+    )
+    score = models.FloatField(
+        _("Оценка"),
+        help_text=_("Оценка цикла для ранжирования предложений")
+    )
+    created_at = models.DateTimeField(_("Дата создания"), auto_now_add=True)
+
+    class Meta:
+        db_table = 'trade_cycles'
+        verbose_name = _("Цикл обмена")
+        verbose_name_plural = _("Циклы обмена")
+        ordering = ['-score', 'id']
+
+    def __str__(self):
+        return f"Цикл обмена {self.key}"
+
+
+class TradeCycleMember(models.Model):
+    """
+    Участник цикла обмена и предмет, который он получает
+    """
+    cycle = models.ForeignKey(
+        TradeCycle,
+        on_delete=models.CASCADE,
+        related_name='members',
+        verbose_name=_("Цикл обмена")
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='trade_cycle_memberships',
+        verbose_name=_("Пользователь")
+    )
+    item = models.ForeignKey(
+        'items.Item',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_("Получаемый предмет"),
+        help_text=_("Предмет из избранного пользователя, который он получает в цикле")
+    )
+    position = models.PositiveSmallIntegerField(_("Позиция"))
+    score = models.FloatField(
+        _("Оценка"),
+        help_text=_("Копия оценки цикла для списка предложений пользователя")
+    )
+
+    class Meta:
+        db_table = 'trade_cycle_members'
+        verbose_name = _("Участник цикла обмена")
+        verbose_name_plural = _("Участники циклов обмена")
+        ordering = ['position']
+        unique_together = ('cycle', 'user')
+        indexes = [
+            models.Index(fields=['user', '-score'], name='cycle_member_user_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} в цикле #{self.cycle_id}"
+
+
+class TradeCycleDirtyUser(models.Model):
+    """
+    Пользователь, чьи ребра графа "хочет" изменились после последнего поиска
+    циклов: его циклы пересчитываются инкрементально (match_trade_cycles)
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+',
+        verbose_name=_("Пользователь")
+    )
+    marked_at = models.DateTimeField(_("Дата изменения"), auto_now=True)
+
+    class Meta:
+        db_table = 'trade_cycle_dirty_users'
+        verbose_name = _("Пользователь для пересчета циклов")
+        verbose_name_plural = _("Пользователи для пересчета циклов")
+
+    def __str__(self):
+        return f"Пересчет циклов пользователя {self.user_id}"
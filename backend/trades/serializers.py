@@ -2,7 +2,8 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.conf import settings
-from .models import TradeStatus, TradeOffer, TradeOfferItem, TradeHistory
+from common import lookups
+from .models import TradeStatus, TradeOffer, TradeOfferItem, TradeHistory, TradeCycle, TradeCycleMember
 from items.models import Item
 from profiles.serializers import LocationSerializer
 
@@ -93,8 +94,14 @@ class ItemBasicSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'primary_image']
     
     def get_primary_image(self, obj):
-        """Получаем URL основного изображения предмета"""
-        primary_image = obj.images.filter(is_primary=True).first()
+        """
+        Получаем URL основного изображения предмета. В списке обменов основные
+        изображения предзагружены в primary_images (TradeOfferViewSet.get_queryset)
+        """
+        if hasattr(obj, 'primary_images'):
+            primary_image = obj.primary_images[0] if obj.primary_images else None
+        else:
+            primary_image = obj.images.filter(is_primary=True).first()
         if primary_image and primary_image.image:
             # Возвращаем прямой URL с S3
             image_path = str(primary_image.image)
@@ -118,19 +125,130 @@ class TradeOfferSerializer(serializers.ModelSerializer):
             'message', 'created_at', 'initiator_items', 'receiver_items'
         ]
     
+    def _items(self, obj, is_from_initiator):
+        """
+        Предметы одной стороны обмена. Предметы предложения делятся в памяти,
+        чтобы использовать предзагрузку trade_items вместо запроса на предложение
+        """
+        return [
+            ItemBasicSerializer(trade_item.item, context=self.context).data
+            for trade_item in obj.trade_items.all()
+            if trade_item.is_from_initiator == is_from_initiator
+        ]
+    
     def get_initiator_items(self, obj):
         """Получаем предметы инициатора"""
-        items = []
-        for trade_item in obj.trade_items.filter(is_from_initiator=True):
-            items.append(ItemBasicSerializer(trade_item.item, context=self.context).data)
-        return items
+        return self._items(obj, True)
     
     def get_receiver_items(self, obj):
         """Получаем предметы получателя"""
-        items = []
-        for trade_item in obj.trade_items.filter(is_from_initiator=False):
-            items.append(ItemBasicSerializer(trade_item.item, context=self.context).data)
-        return items
+        return self._items(obj, False)
+
+
+class TradeCycleMemberSerializer(serializers.ModelSerializer):
+    """Участник цикла обмена и получаемый им предмет"""
+    user_id = serializers.IntegerField(read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
+    item = ItemBasicSerializer(read_only=True)
+
+    class Meta:
+        model = TradeCycleMember
+        fields = ['position', 'user_id', 'username', 'item']
+
+
+class TradeCycleSerializer(serializers.ModelSerializer):
+    """Предложенный цикл обмена между несколькими пользователями"""
+    members = TradeCycleMemberSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = TradeCycle
+        fields = ['id', 'length', 'score', 'created_at', 'members']
+
+
+# Статусы предметов, недоступных для обмена
+UNAVAILABLE_ITEM_STATUSES = ('reserved', 'traded')
+
+
+def load_offer_references(entries):
+    """
+    Загружает получателей, предметы и адреса для набора предложений: по одному
+    запросу на каждую таблицу вместо запросов на каждое поле каждого предложения.
+    entries - исходные или проверенные данные предложений
+    """
+    from profiles.models import Location
+
+    def ids(values):
+        result = set()
+        for value in values:
+            try:
+                result.add(int(value))
+            except (TypeError, ValueError):
+                # Некорректные значения отклонит валидация полей
+                continue
+        return result
+
+    entries = [entry for entry in entries if isinstance(entry, dict)]
+    receiver_ids = ids(entry.get('receiver_id') for entry in entries)
+    item_ids = ids(
+        item_id
+        for entry in entries
+        for key in ('initiator_items', 'receiver_items')
+        if isinstance(entry.get(key), list)
+        for item_id in entry[key]
+    )
+    location_ids = ids(entry.get('location') for entry in entries if entry.get('location') is not None)
+
+    return {
+        'receivers': User.objects.in_bulk(receiver_ids) if receiver_ids else {},
+        'items': Item.objects.select_related('status').only(
+            'id', 'owner_id', 'status__name'
+        ).in_bulk(item_ids) if item_ids else {},
+        'locations': Location.objects.only('id', 'user_id').in_bulk(location_ids) if location_ids else {},
+    }
+
+
+def create_trade_offers(initiator, offers):
+    """
+    Создает предложения обмена из проверенных данных: предложения и их предметы
+    вставляются двумя bulk_create. Возвращает созданные предложения
+    """
+    from .expiry import offer_expires_at
+    from .summary import schedule_summary_invalidation
+
+    pending_status = lookups.get(TradeStatus, 'pending')
+    expires_at = offer_expires_at()
+    trade_offers = TradeOffer.objects.bulk_create([
+        TradeOffer(
+            initiator=initiator,
+            receiver_id=data['receiver_id'],
+            status=pending_status,
+            location_id=data.get('location'),
+            message=data.get('message', ''),
+            expires_at=expires_at
+        )
+        for data in offers
+    ])
+    TradeOfferItem.objects.bulk_create([
+        TradeOfferItem(trade_offer=trade_offer, item_id=item_id, is_from_initiator=is_from_initiator)
+        for trade_offer, data in zip(trade_offers, offers)
+        for key, is_from_initiator in (('initiator_items', True), ('receiver_items', False))
+        for item_id in data[key]
+    ])
+    # bulk_create не отправляет post_save: сводки участников сбрасываем явно
+    schedule_summary_invalidation(initiator.id, *(data['receiver_id'] for data in offers))
+    return trade_offers
+
+
+class CreateTradeOfferListSerializer(serializers.ListSerializer):
+    """Проверка нескольких предложений с общей загрузкой связанных объектов"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list) and (self.max_length is None or len(data) <= self.max_length):
+            self.context['offer_references'] = load_offer_references(data)
+        try:
+            return super().to_internal_value(data)
+        finally:
+            self.context.pop('offer_references', None)
 
 
 class CreateTradeOfferSerializer(serializers.Serializer):
@@ -148,14 +266,12 @@ class CreateTradeOfferSerializer(serializers.Serializer):
         min_length=1,
         help_text="Список ID предметов получателя"
     )
+
+    class Meta:
+        list_serializer_class = CreateTradeOfferListSerializer
     
     def validate_receiver_id(self, value):
         """Валидация получателя"""
-        try:
-            receiver = User.objects.get(id=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("Пользователь не найден")
-        
         # Проверяем, что пользователь не создает предложение самому себе
         request = self.context.get('request')
         if request and request.user.id == value:
@@ -163,111 +279,79 @@ class CreateTradeOfferSerializer(serializers.Serializer):
         
         return value
     
-    def validate_initiator_items(self, value):
-        """Валидация предметов инициатора"""
+    def _validate_items(self, item_ids, items, owner_id, foreign_message, unavailable_message):
+        """Проверяет, что предметы принадлежат владельцу и доступны для обмена"""
+        found = [items.get(item_id) for item_id in item_ids]
+        if len(set(item_ids)) != len(item_ids) or any(
+            item is None or item.owner_id != owner_id for item in found
+        ):
+            raise serializers.ValidationError(foreign_message)
+        if any(item.status.name in UNAVAILABLE_ITEM_STATUSES for item in found):
+            raise serializers.ValidationError(unavailable_message)
+    
+    def validate(self, attrs):
+        """
+        Проверка получателя, предметов и адреса. Связанные объекты загружаются
+        один раз на запрос (для пакетного создания - на все предложения сразу)
+        """
         request = self.context.get('request')
         if not request:
             raise serializers.ValidationError("Не удалось определить пользователя")
         
-        # Проверяем, что все предметы принадлежат инициатору
-        items = Item.objects.filter(id__in=value, owner=request.user)
-        if len(items) != len(value):
-            raise serializers.ValidationError("Некоторые предметы не принадлежат вам")
-        
-        # Проверяем, что предметы доступны для обмена
-        unavailable_items = items.filter(status__name__in=['reserved', 'traded'])
-        if unavailable_items.exists():
-            raise serializers.ValidationError("Некоторые предметы недоступны для обмена")
+        references = self.context.get('offer_references') or load_offer_references([attrs])
+        errors = {}
         
-        return value
-    
-    def validate_receiver_items(self, value):
-        """Валидация предметов получателя"""
-        receiver_id = self.initial_data.get('receiver_id')
-        if not receiver_id:
-            raise serializers.ValidationError("Не указан получатель")
+        receiver = references['receivers'].get(attrs['receiver_id'])
+        if receiver is None:
+            errors['receiver_id'] = ["Пользователь не найден"]
         
         try:
-            receiver = User.objects.get(id=receiver_id)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("Получатель не найден")
+            self._validate_items(
+                attrs['initiator_items'], references['items'], request.user.id,
+                "Некоторые предметы не принадлежат вам",
+                "Некоторые предметы недоступны для обмена"
+            )
+        except serializers.ValidationError as e:
+            errors['initiator_items'] = e.detail
         
-        # Проверяем, что все предметы принадлежат получателю
-        items = Item.objects.filter(id__in=value, owner=receiver)
-        if len(items) != len(value):
-            raise serializers.ValidationError("Некоторые предметы не принадлежат получателю")
+        if receiver is not None:
+            try:
+                self._validate_items(
+                    attrs['receiver_items'], references['items'], receiver.id,
+                    "Некоторые предметы не принадлежат получателю",
+                    "Некоторые предметы получателя недоступны для обмена"
+                )
+            except serializers.ValidationError as e:
+                errors['receiver_items'] = e.detail
         
-        # Проверяем, что предметы доступны для обмена
-        unavailable_items = items.filter(status__name__in=['reserved', 'traded'])
-        if unavailable_items.exists():
-            raise serializers.ValidationError("Некоторые предметы получателя недоступны для обмена")
+        location_id = attrs.get('location')
+        if location_id is not None and receiver is not None:
+            # Проверяем, что адрес принадлежит либо инициатору, либо получателю
+            location = references['locations'].get(location_id)
+            if location is None:
+                errors['location'] = ["Адрес не найден"]
+            elif location.user_id not in [request.user.id, receiver.id]:
+                errors['location'] = ["Адрес должен принадлежать одному из участников обмена"]
         
-        return value
-    
-    def validate_location(self, value):
-        """Валидация адреса встречи"""
-        if value is None:
-            return value
-        
-        from profiles.models import Location
-        
-        request = self.context.get('request')
-        if not request:
-            raise serializers.ValidationError("Не удалось определить пользователя")
-        
-        receiver_id = self.initial_data.get('receiver_id')
-        if not receiver_id:
-            raise serializers.ValidationError("Не указан получатель")
-        
-        try:
-            receiver = User.objects.get(id=receiver_id)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("Получатель не найден")
-        
-        # Проверяем, что адрес принадлежит либо инициатору, либо получателю
-        try:
-            location = Location.objects.get(id=value)
-            if location.user_id not in [request.user.id, receiver.id]:
-                raise serializers.ValidationError("Адрес должен принадлежать одному из участников обмена")
-        except Location.DoesNotExist:
-            raise serializers.ValidationError("Адрес не найден")
-        
-        return value
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
     
     @transaction.atomic
     def create(self, validated_data):
         """Создание предложения обмена"""
         request = self.context.get('request')
-        
-        # Получаем статус "pending"
-        pending_status = TradeStatus.objects.get(name='pending')
-        
-        # Создаем предложение
-        trade_offer = TradeOffer.objects.create(
-            initiator=request.user,
-            receiver_id=validated_data['receiver_id'],
-            status=pending_status,
-            location_id=validated_data.get('location'),
-            message=validated_data.get('message', '')
-        )
-        
-        # Добавляем предметы инициатора
-        for item_id in validated_data['initiator_items']:
-            TradeOfferItem.objects.create(
-                trade_offer=trade_offer,
-                item_id=item_id,
-                is_from_initiator=True
-            )
-        
-        # Добавляем предметы получателя
-        for item_id in validated_data['receiver_items']:
-            TradeOfferItem.objects.create(
-                trade_offer=trade_offer,
-                item_id=item_id,
-                is_from_initiator=False
-            )
-        
-        return trade_offer
+        return create_trade_offers(request.user, [validated_data])[0]
+
+
+class BulkCreateTradeOfferSerializer(serializers.Serializer):
+    """Создание нескольких предложений обмена разным получателям в одной транзакции"""
+    offers = CreateTradeOfferSerializer(many=True, allow_empty=False, max_length=settings.TRADE_BULK_OFFERS_MAX)
+
+    @transaction.atomic
+    def create(self, validated_data):
+        request = self.context.get('request')
+        return create_trade_offers(request.user, validated_data['offers'])
 
 
 class TradeActionSerializer(serializers.Serializer):
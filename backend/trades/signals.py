@@ -0,0 +1,32 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from items.models import Favorite, Item
+from .matching import mark_users_dirty
+from .models import TradeOffer
+from .summary import schedule_summary_invalidation
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def mark_favorite_user_dirty(sender, instance, **kwargs):
+    """
+    Изменилось ребро графа "хочет" пользователя: все циклы с этим ребром
+    проходят через него, поэтому пересчитываются его циклы
+    """
+    mark_users_dirty([instance.user_id])
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def mark_item_owner_dirty(sender, instance, **kwargs):
+    """Статус или удаление предмета меняет входящие ребра его владельца"""
+    mark_users_dirty([instance.owner_id])
+
+
+@receiver(post_save, sender=TradeOffer)
+@receiver(post_delete, sender=TradeOffer)
+def invalidate_offer_summary(sender, instance, **kwargs):
+    """Создание, смена статуса или удаление предложения меняет сводки обоих участников"""
+    schedule_summary_invalidation(instance.initiator_id, instance.receiver_id)
+
@@ -0,0 +1,84 @@
+"""
+Сводка предложений обмена пользователя: количество по статусам и направлениям.
+
+Сводка считается одним запросом с условной агрегацией (группировка по
+статусу, отдельные счетчики отправленных и полученных предложений) по
+индексам (initiator, status) и (receiver, status) и кэшируется для каждого
+пользователя. Ключ кэша включает метку версии пользователя: после
+фиксации транзакции, изменившей предложение, метки обоих участников
+меняются, и старая сводка больше не читается (как снимок дерева категорий
+в categories.tree).
+"""
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from common import lookups
+from .models import TradeOffer, TradeStatus
+
+logger = logging.getLogger(__name__)
+
+
+def _version_key(user_id):
+    return f'trades:summary:{user_id}:version'
+
+
+def _get_version(user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_trade_summary(*user_ids):
+    """Меняет метки версий сводок пользователей"""
+    cache.set_many({_version_key(user_id): uuid.uuid4().hex for user_id in user_ids if user_id}, timeout=None)
+
+
+def schedule_summary_invalidation(*user_ids):
+    """Меняет метки версий сводок после фиксации текущей транзакции"""
+    transaction.on_commit(lambda: invalidate_trade_summary(*user_ids))
+
+
+def compute_trade_summary(user):
+    """Сводка предложений пользователя из БД"""
+    rows = TradeOffer.objects.filter(
+        Q(initiator=user) | Q(receiver=user)
+    ).order_by().values('status_id').annotate(
+        sent=Count('id', filter=Q(initiator=user)),
+        received=Count('id', filter=Q(receiver=user)),
+    )
+
+    # Все статусы присутствуют в ответе, даже с нулевыми счетчиками
+    statuses = lookups.get_table(TradeStatus).by_id
+    summary = {
+        'sent': {status.name: 0 for status in statuses.values()},
+        'received': {status.name: 0 for status in statuses.values()},
+    }
+    for row in rows:
+        status = statuses.get(row['status_id'])
+        name = status.name if status is not None else str(row['status_id'])
+        summary['sent'][name] = summary['sent'].get(name, 0) + row['sent']
+        summary['received'][name] = summary['received'].get(name, 0) + row['received']
+    summary['total'] = {
+        'sent': sum(summary['sent'].values()),
+        'received': sum(summary['received'].values()),
+    }
+    return summary
+
+
+def get_trade_summary(user):
+    """Сводка предложений пользователя из кэша или из БД"""
+    key = f'trades:summary:{user.pk}:{_get_version(user.pk)}'
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_trade_summary(user)
+        cache.set(key, summary, timeout=settings.TRADE_SUMMARY_CACHE_TIMEOUT)
+        logger.debug(f"Сводка обменов пользователя {user.pk} пересчитана")
+    return summary
@@ -1,12 +1,22 @@
-from django.test import TestCase
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from rest_framework.test import APITestCase
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from .models import TradeStatus, TradeOffer, TradeOfferItem
-from items.models import Item, ItemCondition, ItemStatus
+from .expiry import expire_trade_offers
+from .matching import load_graph, mark_users_dirty, neighbourhood, rebuild_trade_cycles, update_trade_cycles
+from .models import TradeStatus, TradeOffer, TradeOfferItem, TradeHistory, TradeCycle, TradeCycleDirtyUser
+from .serializers import create_trade_offers
+from .views import TradeOfferViewSet
+from items.models import Favorite, Item, ItemCondition, ItemImage, ItemStatus
 from categories.models import Category
 
 User = get_user_model()
@@ -31,8 +41,10 @@ class TradeStatusAPITest(APITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data['results']), 2)
-        self.assertEqual(response.data['results'][0]['name'], 'pending')
+        # Статус 'expired' создается миграцией
+        self.assertEqual(
+            [item['name'] for item in response.data['results']], ['pending', 'accepted', 'expired']
+        )
 
 
 class TradeOfferAPITest(APITestCase):
@@ -125,4 +137,400 @@ class TradeOfferAPITest(APITestCase):
         url = reverse('trade-offer-list')
         response = self.client.get(url)
         
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED) 
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED) 
+
+@override_settings(IMAGE_DERIVATIVES_ENABLED=False)
+class TradeOfferListQueryTest(APITestCase):
+    """Тесты количества запросов списка предложений обмена"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(
+            username='inbox', email='inbox@test.com', password='testpass123'
+        )
+        self.pending_status, _ = TradeStatus.objects.get_or_create(name='pending')
+        self.category = Category.objects.create(name='Обмены', slug='trade-inbox')
+        self.condition, _ = ItemCondition.objects.get_or_create(name='Новый')
+        self.item_status, _ = ItemStatus.objects.get_or_create(name='Доступен')
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        )
+        self.url = reverse('trade-offer-list')
+
+    def _item(self, owner, title):
+        item = Item.objects.create(
+            title=title, description='Описание', owner=owner, category=self.category,
+            condition=self.condition, status=self.item_status
+        )
+        ItemImage.objects.create(item=item, image=f'item_images/{item.id}-extra.jpg', order=1)
+        ItemImage.objects.create(item=item, image=f'item_images/{item.id}.jpg', is_primary=True)
+        return item
+
+    def _create_offers(self, count, start=0):
+        for i in range(start, start + count):
+            peer = User.objects.create_user(
+                username=f'trader{i}', email=f'trader{i}@test.com', password='testpass123'
+            )
+            offer = TradeOffer.objects.create(initiator=self.user, receiver=peer, status=self.pending_status)
+            for title in (f'Мой {i}', f'Мой {i}б'):
+                TradeOfferItem.objects.create(trade_offer=offer, item=self._item(self.user, title), is_from_initiator=True)
+            TradeOfferItem.objects.create(trade_offer=offer, item=self._item(peer, f'Чужой {i}'), is_from_initiator=False)
+
+    def _list(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, len(queries)
+
+    def test_list_cost_does_not_depend_on_page_size(self):
+        """Страница из 20 предложений выполняется тем же числом запросов, что и из двух"""
+        self._create_offers(2)
+        _, few = self._list()
+
+        self._create_offers(18, start=2)
+        data, many = self._list()
+
+        self.assertEqual(len(data['results']), 20)
+        self.assertEqual(many, few)
+        # Пользователь, количество, предложения, предметы, основные изображения
+        self.assertEqual(many, 5)
+
+        offer = data['results'][0]
+        self.assertEqual(len(offer['initiator_items']), 2)
+        self.assertEqual(len(offer['receiver_items']), 1)
+        item_id = offer['receiver_items'][0]['id']
+        self.assertTrue(offer['receiver_items'][0]['primary_image'].endswith(f'item_images/{item_id}.jpg'))
+
+
+class TradeCycleMatchingTest(APITestCase):
+    """Тесты поиска циклов обмена между несколькими пользователями"""
+
+    def setUp(self):
+        """Настройка тестовых данных: a хочет предмет b, b - предмет c, c - предмет a"""
+        self.category = Category.objects.create(name='Циклы', slug='trade-cycles')
+        self.condition, _ = ItemCondition.objects.get_or_create(name='Новый')
+        self.available, _ = ItemStatus.objects.get_or_create(name='Доступен')
+        self.reserved, _ = ItemStatus.objects.get_or_create(name='Зарезервирован')
+        self.users = [
+            User.objects.create_user(username=f'cycle{i}', email=f'cycle{i}@test.com', password='testpass123')
+            for i in range(3)
+        ]
+        self.items = [
+            Item.objects.create(
+                title=f'Предмет {i}', description='Описание', owner=user, category=self.category,
+                condition=self.condition, status=self.available
+            )
+            for i, user in enumerate(self.users)
+        ]
+        for i, user in enumerate(self.users):
+            Favorite.objects.create(user=user, item=self.items[(i + 1) % 3])
+
+    def test_rebuild_finds_cycle(self):
+        """Полный пересчет находит цикл из трех участников"""
+        self.assertEqual(rebuild_trade_cycles(), 1)
+        cycle = TradeCycle.objects.get()
+        self.assertEqual(cycle.length, 3)
+        self.assertEqual(cycle.key, '-'.join(str(user.id) for user in self.users))
+        members = list(cycle.members.values_list('user_id', 'item_id'))
+        self.assertEqual(members, [(user.id, self.items[(i + 1) % 3].id) for i, user in enumerate(self.users)])
+        self.assertFalse(TradeCycleDirtyUser.objects.exists())
+
+    def test_incremental_update_removes_broken_cycle(self):
+        """Предмет перестал быть доступен - цикл удаляется, а затем находится снова"""
+        rebuild_trade_cycles()
+
+        self.items[1].status = self.reserved
+        self.items[1].save()
+        self.assertEqual(update_trade_cycles(), (1, 0))
+        self.assertFalse(TradeCycle.objects.exists())
+        self.assertFalse(TradeCycleDirtyUser.objects.exists())
+
+        self.items[1].status = self.available
+        self.items[1].save()
+        self.assertEqual(update_trade_cycles(), (1, 1))
+        self.assertEqual(TradeCycle.objects.count(), 1)
+
+    @override_settings(TRADE_CYCLES_PER_USER=1)
+    def test_incremental_update_keeps_other_members_cycles(self):
+        """Цикл, сохраненный как лучший для другого участника, не теряется при пересчете"""
+        newcomer = User.objects.create_user(username='cycle3', email='cycle3@test.com', password='testpass123')
+        Item.objects.create(
+            title='Предмет 3', description='Описание', owner=newcomer, category=self.category,
+            condition=self.condition, status=self.available
+        )
+        # Обмен вдвоем с newcomer лучше для cycle1, чем цикл из трех участников,
+        # который остается лучшим для cycle0 и cycle2
+        Favorite.objects.create(user=self.users[1], item=newcomer.items.get())
+        Favorite.objects.create(user=newcomer, item=self.items[1])
+        self.assertEqual(rebuild_trade_cycles(), 2)
+
+        mark_users_dirty([self.users[1].id])
+        self.assertEqual(update_trade_cycles(), (1, 2))
+        self.assertEqual(TradeCycle.objects.count(), 2)
+
+    def test_neighbourhood_bounded_by_cycle_length(self):
+        """Окрестность - только пользователи, которые могут быть в цикле допустимой длины"""
+        # 1 -> 2 -> 3 -> 1 - цикл длины 3; 1 -> 10 -> ... -> 14 -> 1 - длины 6; 3 -> 20 - без возврата
+        edges = {1: {2, 10}, 2: {3}, 3: {1, 20}, 10: {11}, 11: {12}, 12: {13}, 13: {14}, 14: {1}}
+        reverse = {}
+        for source, targets in edges.items():
+            for target in targets:
+                reverse.setdefault(target, set()).add(source)
+
+        def step(graph):
+            return lambda frontier: set().union(*(graph.get(user_id, set()) for user_id in frontier))
+
+        self.assertEqual(neighbourhood({1}, 5, step(edges), step(reverse)), {1, 2, 3})
+        self.assertEqual(neighbourhood({1}, 6, step(edges), step(reverse)), {1, 2, 3, 10, 11, 12, 13, 14})
+
+    def test_incremental_update_loads_only_neighbourhood(self):
+        """Инкрементальный пересчет не загружает избранное пользователей вне окрестности"""
+        others = [
+            User.objects.create_user(username=f'other{i}', email=f'other{i}@test.com', password='testpass123')
+            for i in range(2)
+        ]
+        other_items = [
+            Item.objects.create(
+                title=f'Другой предмет {i}', description='Описание', owner=user, category=self.category,
+                condition=self.condition, status=self.available
+            )
+            for i, user in enumerate(others)
+        ]
+        Favorite.objects.create(user=others[0], item=other_items[1])
+        Favorite.objects.create(user=others[1], item=other_items[0])
+        self.assertEqual(rebuild_trade_cycles(), 2)
+
+        graph = load_graph({self.users[0].id})
+        self.assertEqual(graph.user_ids, sorted(user.id for user in self.users))
+        self.assertEqual(graph.edge_count, 3)
+
+        mark_users_dirty([self.users[0].id])
+        self.assertEqual(update_trade_cycles(), (1, 1))
+        self.assertEqual(TradeCycle.objects.count(), 2)
+
+    def test_list_returns_user_cycles(self):
+        """API возвращает циклы только с участием текущего пользователя"""
+        rebuild_trade_cycles()
+        outsider = User.objects.create_user(username='outsider', email='outsider@test.com', password='testpass123')
+        url = reverse('trade-cycle-list')
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.users[1]).access_token}')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        members = response.data['results'][0]['members']
+        self.assertEqual([member['user_id'] for member in members], [user.id for user in self.users])
+        self.assertEqual(members[0]['item']['id'], self.items[1].id)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(outsider).access_token}')
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'], [])
+
+
+class TradeSummaryTest(APITestCase):
+    """Тесты сводки предложений обмена"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(username='summary', email='summary@test.com', password='testpass123')
+        self.peer = User.objects.create_user(username='peer', email='peer@test.com', password='testpass123')
+        self.pending, _ = TradeStatus.objects.get_or_create(name='pending')
+        self.accepted, _ = TradeStatus.objects.get_or_create(name='accepted')
+        self.url = reverse('trade-offer-summary')
+
+    def _get(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, len(queries)
+
+    def test_summary_counts_and_cache(self):
+        """Счетчики по направлениям считаются одним запросом и сбрасываются при смене статуса"""
+        with self.captureOnCommitCallbacks(execute=True):
+            offers = [
+                TradeOffer.objects.create(initiator=self.user, receiver=self.peer, status=self.pending)
+                for _ in range(2)
+            ]
+            TradeOffer.objects.create(initiator=self.peer, receiver=self.user, status=self.pending)
+
+        data, queries = self._get(self.user)
+        self.assertEqual(data['sent']['pending'], 2)
+        self.assertEqual(data['received']['pending'], 1)
+        self.assertEqual(data['sent']['accepted'], 0)
+        self.assertEqual(data['total'], {'sent': 2, 'received': 1})
+        # Пользователь, справочник статусов, сводка
+        self.assertLessEqual(queries, 3)
+
+        # Повторный запрос читает сводку из кэша
+        _, cached = self._get(self.user)
+        self.assertEqual(cached, 1)
+
+        # Получатель принимает предложение - сводки обоих участников обновляются
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.peer).access_token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('trade-offer-accept', args=[offers[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        data, _ = self._get(self.user)
+        self.assertEqual(data['sent']['pending'], 1)
+        self.assertEqual(data['sent']['accepted'], 1)
+        data, _ = self._get(self.peer)
+        self.assertEqual(data['received'], {**data['received'], 'pending': 1, 'accepted': 1})
+        self.assertEqual(data['sent']['pending'], 1)
+
+
+class TradeOfferCreateTest(APITestCase):
+    """Тесты создания предложений обмена, в том числе пакетного"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(username='offerer', email='offerer@test.com', password='testpass123')
+        self.pending, _ = TradeStatus.objects.get_or_create(name='pending')
+        self.category = Category.objects.create(name='Предложения', slug='trade-create')
+        self.condition, _ = ItemCondition.objects.get_or_create(name='Новый')
+        self.item_status, _ = ItemStatus.objects.get_or_create(name='Доступен')
+        self.my_items = [self._item(self.user, f'Мой {i}') for i in range(3)]
+        self.peers = [
+            User.objects.create_user(username=f'receiver{i}', email=f'receiver{i}@test.com', password='testpass123')
+            for i in range(3)
+        ]
+        self.peer_items = [self._item(peer, f'Чужой {i}') for i, peer in enumerate(self.peers)]
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def _item(self, owner, title):
+        return Item.objects.create(
+            title=title, description='Описание', owner=owner, category=self.category,
+            condition=self.condition, status=self.item_status
+        )
+
+    def _offer(self, index, initiator_items):
+        return {
+            'receiver_id': self.peers[index].id,
+            'initiator_items': [item.id for item in initiator_items],
+            'receiver_items': [self.peer_items[index].id],
+        }
+
+    def _create(self, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('trade-offer-list'), data, format='json')
+        inserts = [query for query in queries if query['sql'].startswith('INSERT')]
+        return response, inserts
+
+    def test_create_validates_and_inserts_in_batches(self):
+        """Предметы предложения вставляются одним запросом"""
+        response, inserts = self._create(self._offer(0, self.my_items))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['initiator_items']), 3)
+        self.assertEqual(len(response.data['receiver_items']), 1)
+        self.assertEqual(len(inserts), 2)
+
+        # Предмет получателя, указанный как свой, отклоняется
+        response, _ = self._create(self._offer(1, [self.peer_items[2]]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('initiator_items', response.data)
+
+    def test_bulk_create(self):
+        """Один предмет предлагается нескольким получателям в одной транзакции"""
+        url = reverse('trade-offer-bulk-create')
+        offers = [self._offer(i, [self.my_items[0]]) for i in range(3)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'offers': offers}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(
+            sorted(offer['receiver']['id'] for offer in response.data), [peer.id for peer in self.peers]
+        )
+        self.assertEqual(TradeOfferItem.objects.filter(item=self.my_items[0]).count(), 3)
+        # Получатели и предметы загружаются одним запросом на все предложения
+        item_selects = [
+            query for query in queries
+            if query['sql'].startswith('SELECT') and 'FROM "items"' in query['sql']
+        ]
+        self.assertEqual(len(item_selects), 1)
+
+        # Ошибка в одном предложении отменяет весь пакет
+        offers = [self._offer(0, [self.my_items[1]]), {**self._offer(1, [self.my_items[1]]), 'location': 999999}]
+        response = self.client.post(url, {'offers': offers}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['offers'][0], {})
+        self.assertIn('location', response.data['offers'][1])
+        self.assertFalse(TradeOfferItem.objects.filter(item=self.my_items[1]).exists())
+
+
+class TradeOfferExpiryTest(TestCase):
+    """Тесты автоматического истечения ожидающих предложений"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.user = User.objects.create_user(username='expirer', email='expirer@test.com', password='testpass123')
+        self.peer = User.objects.create_user(username='waiter', email='waiter@test.com', password='testpass123')
+        self.pending, _ = TradeStatus.objects.get_or_create(name='pending')
+        self.accepted, _ = TradeStatus.objects.get_or_create(name='accepted')
+        self.expired, _ = TradeStatus.objects.get_or_create(name='expired')
+
+    def _offer(self, expires_in_days):
+        return TradeOffer.objects.create(
+            initiator=self.user, receiver=self.peer, status=self.pending,
+            expires_at=timezone.now() + timedelta(days=expires_in_days)
+        )
+
+    @override_settings(TRADE_OFFER_EXPIRE_AFTER_DAYS=7)
+    def test_new_offer_gets_deadline(self):
+        """Новому предложению назначается срок ответа, после ответа он сбрасывается"""
+        offer = create_trade_offers(self.user, [
+            {'receiver_id': self.peer.id, 'initiator_items': [], 'receiver_items': []}
+        ])[0]
+        offer.refresh_from_db()
+        self.assertAlmostEqual(
+            offer.expires_at, timezone.now() + timedelta(days=7), delta=timedelta(minutes=1)
+        )
+
+        offer.status = self.accepted
+        offer.save()
+        offer.refresh_from_db()
+        self.assertIsNone(offer.expires_at)
+
+    def test_expire_in_batches_is_idempotent(self):
+        """Просроченные предложения истекают пачками, повторный запуск ничего не меняет"""
+        overdue = [self._offer(-2), self._offer(-1), self._offer(-1)]
+        waiting = self._offer(1)
+        answered = self._offer(-1)
+        answered.status = self.accepted
+        answered.save()
+
+        self.assertEqual(expire_trade_offers(batch_size=2), 3)
+        self.assertEqual(
+            set(TradeOffer.objects.filter(status=self.expired).values_list('id', flat=True)),
+            {offer.id for offer in overdue}
+        )
+        history = TradeHistory.objects.filter(new_status=self.expired)
+        self.assertEqual(sorted(history.values_list('trade_offer_id', flat=True)), sorted(o.id for o in overdue))
+        self.assertTrue(all(entry.previous_status_id == self.pending.id for entry in history))
+
+        waiting.refresh_from_db()
+        self.assertEqual(waiting.status, self.pending)
+        self.assertIsNotNone(waiting.expires_at)
+
+        self.assertEqual(expire_trade_offers(), 0)
+        self.assertEqual(history.count(), 3)
+
+    def test_answer_does_not_override_expiry(self):
+        """Смена статуса читает предложение под блокировкой и не перезаписывает истекшее"""
+        request = Request(APIRequestFactory().post('/'))
+        request.user = self.peer
+        view = TradeOfferViewSet(action='accept', request=request, format_kwarg=None)
+        self.assertTrue(view.get_queryset().query.select_for_update)
+
+        offer = self._offer(-1)
+        expire_trade_offers()
+        response = self.client.post(
+            reverse('trade-offer-accept', args=[offer.id]),
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.peer).access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        offer.refresh_from_db()
+        self.assertEqual(offer.status, self.expired)
+        self.assertEqual(TradeHistory.objects.filter(trade_offer=offer).count(), 1)
+
@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TradeStatusViewSet, TradeOfferViewSet
+from .views import TradeStatusViewSet, TradeOfferViewSet, TradeCycleViewSet
 
 # Создаем роутер для API
 router = DefaultRouter()
 router.register(r'statuses', TradeStatusViewSet, basename='trade-status')
 router.register(r'offers', TradeOfferViewSet, basename='trade-offer')
+router.register(r'cycles', TradeCycleViewSet, basename='trade-cycle')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -8,15 +8,19 @@ from django.db.models import Q, Prefetch, F
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 
-from .models import TradeStatus, TradeOffer, TradeOfferItem, TradeHistory
+from common import lookups
+from .models import TradeStatus, TradeOffer, TradeOfferItem, TradeHistory, TradeCycle, TradeCycleMember
 from .serializers import (
     TradeStatusSerializer, 
     TradeOfferSerializer, 
     CreateTradeOfferSerializer,
-    TradeActionSerializer
+    BulkCreateTradeOfferSerializer,
+    TradeActionSerializer,
+    TradeCycleSerializer
 )
-from items.models import Item
+from items.models import Item, ItemImage
 from profiles.models import UserProfile
+from .summary import get_trade_summary
 
 
 class TradeStatusViewSet(viewsets.ReadOnlyModelViewSet):
@@ -26,10 +30,38 @@ class TradeStatusViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [AllowAny]
 
 
+class TradeCycleViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Предложенные циклы обмена текущего пользователя, лучшие первыми.
+    Циклы пересчитывает команда match_trade_cycles
+    """
+    serializer_class = TradeCycleSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return TradeCycle.objects.filter(
+            members__user=self.request.user
+        ).prefetch_related(
+            Prefetch(
+                'members',
+                queryset=TradeCycleMember.objects.select_related('user', 'item').prefetch_related(
+                    Prefetch(
+                        'item__images',
+                        queryset=ItemImage.objects.filter(is_primary=True),
+                        to_attr='primary_images'
+                    )
+                ).order_by('position')
+            )
+        ).order_by('-score', 'id')
+
+
 class TradeOfferViewSet(viewsets.ModelViewSet):
     """ViewSet для предложений обмена"""
     serializer_class = TradeOfferSerializer
     permission_classes = [IsAuthenticated]
+    # Действия, меняющие статус: предложение читается под блокировкой строки,
+    # чтобы не перезаписать статус, измененный параллельно (например, истечением срока)
+    status_actions = ('accept', 'reject', 'cancel', 'complete')
     
     def get_queryset(self):
         """Получение queryset с оптимизированными запросами"""
@@ -43,8 +75,13 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
             Prefetch(
                 'trade_items',
                 queryset=TradeOfferItem.objects.select_related('item').prefetch_related(
-                    'item__images'
-                )
+                    # Сериализатору нужно только основное изображение предмета
+                    Prefetch(
+                        'item__images',
+                        queryset=ItemImage.objects.filter(is_primary=True),
+                        to_attr='primary_images'
+                    )
+                ).order_by('id')
             )
         )
         
@@ -61,6 +98,9 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
             # Все предложения пользователя (по умолчанию)
             queryset = queryset.filter(Q(initiator=user) | Q(receiver=user))
         
+        if self.action in self.status_actions:
+            queryset = queryset.select_for_update(of=('self',))
+        
         return queryset.order_by('-created_at')
     
     def get_serializer_class(self):
@@ -94,7 +134,31 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
         response_serializer = TradeOfferSerializer(trade_offer, context={'request': request})
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        """
+        Создание нескольких предложений разным получателям в одной транзакции
+        (например, один предмет предлагается нескольким пользователям).
+        Если хотя бы одно предложение не прошло проверку, не создается ни одно
+        """
+        serializer = BulkCreateTradeOfferSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        trade_offers = serializer.save()
+        
+        queryset = self.get_queryset().filter(pk__in=[trade_offer.pk for trade_offer in trade_offers])
+        response_serializer = TradeOfferSerializer(queryset, many=True, context={'request': request})
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """
+        Количество предложений пользователя по статусам: отправленных,
+        полученных и всего. Для счетчиков в приложении вместо загрузки списков
+        """
+        return Response(get_trade_summary(request.user))
+    
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def accept(self, request, pk=None):
         """Принятие предложения обмена"""
         trade_offer = self.get_object()
@@ -121,7 +185,7 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
             previous_status = trade_offer.status
             
             # Меняем статус на "accepted"
-            accepted_status = TradeStatus.objects.get(name='accepted')
+            accepted_status = lookups.get(TradeStatus, 'accepted')
             trade_offer.status = accepted_status
             trade_offer.save()
             
@@ -137,6 +201,7 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
         return Response({'success': True, 'message': 'Предложение принято'})
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def reject(self, request, pk=None):
         """Отклонение предложения обмена"""
         trade_offer = self.get_object()
@@ -163,7 +228,7 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
             previous_status = trade_offer.status
             
             # Меняем статус на "rejected"
-            rejected_status = TradeStatus.objects.get(name='rejected')
+            rejected_status = lookups.get(TradeStatus, 'rejected')
             trade_offer.status = rejected_status
             trade_offer.save()
             
@@ -179,6 +244,7 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
         return Response({'success': True, 'message': 'Предложение отклонено'})
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def cancel(self, request, pk=None):
         """Отмена предложения обмена"""
         trade_offer = self.get_object()
@@ -205,7 +271,7 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
             previous_status = trade_offer.status
             
             # Меняем статус на "cancelled"
-            cancelled_status = TradeStatus.objects.get(name='cancelled')
+            cancelled_status = lookups.get(TradeStatus, 'cancelled')
             trade_offer.status = cancelled_status
             trade_offer.save()
             
@@ -221,6 +287,7 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
         return Response({'success': True, 'message': 'Предложение отменено'})
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def complete(self, request, pk=None):
         """Подтверждение завершения обмена"""
         trade_offer = self.get_object()
@@ -247,7 +314,7 @@ class TradeOfferViewSet(viewsets.ModelViewSet):
             previous_status = trade_offer.status
             
             # Меняем статус на "completed"
-            completed_status = TradeStatus.objects.get(name='completed')
+            completed_status = lookups.get(TradeStatus, 'completed')
             trade_offer.status = completed_status
             trade_offer.completed_at = timezone.now()
             trade_offer.save()